@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks of the hot paths of the project : preprocessing, training step and
+inference of the CNN, assembly of the whole predictions.
+
+The benchmarks run offline : the SemEval dataset (see fosa/synthetic.py) and
+the word embeddings are replaced by synthetic files written into a temporary
+folder. The results are written as JSON, so that the results of two commits
+can be compared.
+
+Usage (from the root of the repository) :
+
+    python benchmarks/bench_fosa.py --output benchmarks/results/HEAD.json
+    python benchmarks/bench_fosa.py --scale quick --only clean_str,parse_XML
+    python benchmarks/bench_fosa.py --compare old.json new.json
+
+The benchmarks which need TensorFlow are skipped when it is not installed.
+The *_fused and *_xla benchmarks measure the options of the graph of the
+TextCNN (see CNN.TextCNN), to be compared with train_step and inference.
+"""
+
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+FOSA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'fosa')
+sys.path.insert(0, FOSA_FOLDER)
+
+# Project modules
+import preprocessing as pp  # noqa: E402
+import domains as dm  # noqa: E402
+import synthetic  # noqa: E402
+
+# Constants
+# ==================================================
+
+RESULTS_VERSION = 1
+
+# Size of the synthetic data and number of measures of each scale
+SCALES = {
+    'quick': {'num_reviews': 20, 'embedding_words': 500,
+              'embedding_dimension': 16, 'batch_sizes': [1, 16], 'steps': 3,
+              'repeat': 1},
+    # Size of the real restaurant dataset
+    'default': {'num_reviews': 350, 'embedding_words': 20000,
+                'embedding_dimension': 300, 'batch_sizes': [1, 16, 64, 256],
+                'steps': 20, 'repeat': 3},
+    # 100 times the real restaurant dataset, to reveal the paths which do not
+    # scale linearly
+    'x100': {'num_reviews': 35000, 'embedding_words': 200000,
+             'embedding_dimension': 300, 'batch_sizes': [64, 256],
+             'steps': 20, 'repeat': 1},
+}
+
+# Hyperparameters of the CNN (defaults of train.py)
+EMBEDDING_DIM = 128
+FILTER_SIZES = [3, 4, 5]
+NUM_FILTERS = 128
+# Constant learning rate of the measured training steps
+LEARNING_RATE = 1e-3
+
+# A benchmark is a regression when it is slower than the baseline by more
+# than this ratio
+REGRESSION_THRESHOLD = 1.2
+
+BENCHMARK_DOMAIN = 'BENCHMARK'
+
+
+class SkipBenchmark(Exception):
+    """
+    Raised by a benchmark which cannot run in this environment.
+    """
+
+
+# Synthetic data
+# ==================================================
+
+
+def embedding_words(num_words):
+    """
+    Words of the synthetic embeddings : the words of the synthetic sentences
+    once cleaned, then filler words.
+    """
+
+    sentence_words = list(synthetic.WORDS) + dm.RESTAURANT_ENTITIES
+    for polarity_words in synthetic.POLARITY_WORDS.values():
+        sentence_words += polarity_words
+    words = sorted(set(" ".join(pp.clean_str(word)
+                                for word in sentence_words).split(" ")))
+    words += ["word{}".format(i) for i in range(num_words - len(words))]
+    return words[:num_words]
+
+
+def write_word2vec_binary(filepath, words, dimension, seed=42):
+    rng = np.random.RandomState(seed)
+    with open(filepath, 'wb') as f:
+        f.write("{} {}\n".format(len(words), dimension).encode('utf-8'))
+        for word in words:
+            f.write(word.encode('utf-8') + b' ')
+            f.write(rng.uniform(-1, 1, dimension).astype(np.float32)
+                    .tobytes())
+            f.write(b'\n')
+
+
+def write_glove(filepath, words, dimension, seed=42):
+    rng = np.random.RandomState(seed)
+    with open(filepath, 'w') as f:
+        for word in words:
+            f.write(word + " " + " ".join(
+                    "{:.5f}".format(value)
+                    for value in rng.uniform(-1, 1, dimension)) + "\n")
+
+
+class Vocabulary(dict):
+    """
+    Vocabulary word -> id where the unknown words have the id 0, like the
+    vocabulary of learn.preprocessing.VocabularyProcessor.
+    """
+
+    def __init__(self, words):
+        super(Vocabulary, self).__init__(
+                (word, i + 1) for i, word in enumerate(words))
+
+    def get(self, word, default=0):
+        return dict.get(self, word, default)
+
+    def __len__(self):
+        return dict.__len__(self) + 1
+
+
+def build_context(folder, scale):
+    """
+    Write the synthetic files into folder and register their domain.
+    :return: Dictionary of the paths and parameters used by the benchmarks.
+    """
+
+    xml_path = os.path.join(folder, 'semeval.xml')
+    stats = synthetic.generate_semeval_xml(xml_path, 'RESTAURANT',
+                                           num_reviews=scale['num_reviews'])
+    synthetic.register_synthetic_domain(BENCHMARK_DOMAIN, 'RESTAURANT',
+                                        xml_path, xml_path)
+
+    words = embedding_words(scale['embedding_words'])
+    word2vec_path = os.path.join(folder, 'word2vec.bin')
+    glove_path = os.path.join(folder, 'glove.txt')
+    write_word2vec_binary(word2vec_path, words,
+                          scale['embedding_dimension'])
+    write_glove(glove_path, words, scale['embedding_dimension'])
+
+    # Half of the words of the embeddings are in the vocabulary
+    vocabulary = Vocabulary(words[::2])
+
+    return dict(scale, num_sentences=stats['sentences'], xml_path=xml_path,
+                word2vec_path=word2vec_path, glove_path=glove_path,
+                vocabulary=vocabulary)
+
+
+# Measures
+# ==================================================
+
+
+def measure(function, items, repeat=3):
+    """
+    Run function repeat times.
+    :param items: Number of items (sentences, rows, batches...) processed by
+    one run.
+    :return: Dictionary with the best and the mean time of a run in seconds,
+    and the throughput of the best run.
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {'seconds': best,
+            'mean_seconds': sum(times) / len(times),
+            'items': items,
+            'items_per_second': items / best if best > 0 else None}
+
+
+def sentences_of(context):
+    return pp.parse_XML(context['xml_path'])['text'].drop_duplicates().tolist()
+
+
+def bench_clean_str(context):
+    sentences = sentences_of(context)
+
+    def run():
+        for sentence in sentences:
+            pp.clean_str(sentence)
+    return measure(run, len(sentences), context['repeat'])
+
+
+def bench_parse_XML(context):
+    rows = len(pp.parse_XML(context['xml_path'], aspects=True))
+    return measure(lambda: pp.parse_XML(context['xml_path'], aspects=True),
+                   rows, context['repeat'])
+
+
+def bench_get_dataset_semeval(context):
+    rows = len(pp.get_dataset_semeval(context['xml_path'], 'feature',
+                                      aspects=True)['data'])
+    return measure(lambda: pp.get_dataset_semeval(context['xml_path'],
+                                                  'feature', aspects=True),
+                   rows, context['repeat'])
+
+
+def bench_load_word2vec(context):
+    return measure(lambda: pp.load_embedding_vectors_word2vec(
+                           context['vocabulary'], context['word2vec_path'],
+                           True),
+                   context['embedding_words'], context['repeat'])
+
+
+def bench_load_glove(context):
+    return measure(lambda: pp.load_embedding_vectors_glove(
+                           context['vocabulary'], context['glove_path'],
+                           context['embedding_dimension']),
+                   context['embedding_words'], context['repeat'])
+
+
+def training_data(context):
+    """
+    Random word ids and labels of the size of the synthetic dataset.
+    """
+
+    num_examples = context['num_sentences']
+    rng = np.random.RandomState(42)
+    x = rng.randint(0, len(context['vocabulary']),
+                    (num_examples, 40)).astype(np.int32)
+    y = rng.randint(0, len(dm.RESTAURANT_ASPECTS),
+                    num_examples).astype(np.int32)
+    return x, y
+
+
+def bench_batch_iter(context):
+    x, _ = training_data(context)
+    batch_size = 64
+    num_batches = pp.batch_number(x, batch_size, 1)
+
+    def run():
+        # Same input as the prediction loop of prediction.py
+        for batch in pp.batch_iter(list(x), batch_size, 1, shuffle=False):
+            pass
+    return measure(run, num_batches, context['repeat'])
+
+
+def bench_batch_iter_training(context):
+    x, y = training_data(context)
+    batch_size = 64
+    num_batches = pp.batch_number(x, batch_size, 1)
+
+    def run():
+        # Same input as the training loop of train.py
+        for batch in pp.batch_iter(list(zip(x, y)), batch_size, 1):
+            x_batch, y_batch = zip(*batch)
+    return measure(run, num_batches, context['repeat'])
+
+
+def import_tensorflow():
+    try:
+        import tensorflow as tf
+    except ImportError:
+        raise SkipBenchmark("TensorFlow is not installed")
+    return tf
+
+
+def cnn_latencies(context, train, **cnn_options):
+    """
+    Latency of a training step (train=True) or of an inference step of a
+    TextCNN for each batch size.
+    :param cnn_options: Options of the graph of the TextCNN
+    (fused_convolutions, xla_jit), compared with the default graph.
+    """
+
+    tf = import_tensorflow()
+    import CNN
+
+    x, y = training_data(context)
+    results = collections.OrderedDict()
+    with tf.Graph().as_default():
+        session = tf.Session()
+        with session.as_default():
+            cnn = CNN.TextCNN(
+                    sequence_length=x.shape[1],
+                    num_classes=len(dm.RESTAURANT_ASPECTS),
+                    vocab_size=len(context['vocabulary']),
+                    embedding_size=EMBEDDING_DIM,
+                    filter_sizes=FILTER_SIZES,
+                    num_filters=NUM_FILTERS,
+                    **cnn_options)
+            global_step = tf.Variable(0, name="global_step", trainable=False)
+            optimizer = tf.train.AdamOptimizer(LEARNING_RATE)
+            train_op = optimizer.minimize(cnn.loss, global_step=global_step)
+            session.run(tf.global_variables_initializer())
+
+            for batch_size in context['batch_sizes']:
+                feed_dict = {cnn.input_x: x[:batch_size],
+                             cnn.input_y: y[:batch_size]}
+                if train:
+                    fetches = [train_op, cnn.loss]
+                    feed_dict[cnn.dropout_keep_prob] = 0.5
+                else:
+                    fetches = cnn.predictions
+                    feed_dict[cnn.dropout_keep_prob] = 1.0
+
+                # Warm-up step, which allocates the buffers of this shape
+                session.run(fetches, feed_dict)
+
+                def run():
+                    for _ in range(context['steps']):
+                        session.run(fetches, feed_dict)
+                result = measure(run, context['steps'] * batch_size,
+                                 context['repeat'])
+                result['step_milliseconds'] = (
+                        1000 * result['seconds'] / context['steps'])
+                results['batch_{}'.format(batch_size)] = result
+        session.close()
+    return results
+
+
+def bench_train_step(context):
+    return cnn_latencies(context, train=True)
+
+
+def bench_inference(context):
+    return cnn_latencies(context, train=False)
+
+
+def bench_train_step_fused(context):
+    return cnn_latencies(context, train=True, fused_convolutions=True)
+
+
+def bench_inference_fused(context):
+    return cnn_latencies(context, train=False, fused_convolutions=True)
+
+
+def bench_inference_xla(context):
+    return cnn_latencies(context, train=False, xla_jit=True)
+
+
+def bench_inference_fused_xla(context):
+    return cnn_latencies(context, train=False, fused_convolutions=True,
+                         xla_jit=True)
+
+
+def bench_whole_assembly(context):
+    import_tensorflow()
+    import prediction
+
+    dataframe_actual = pp.select_and_simplify_dataset(
+            pp.parse_XML(context['xml_path']), context['xml_path'])
+    sentences = dataframe_actual['text'].drop_duplicates().tolist()
+    rng = np.random.RandomState(42)
+    predictions_feature = rng.randint(0, len(dm.RESTAURANT_ENTITIES),
+                                      len(sentences))
+    predictions_polarity = rng.randint(0, len(dm.POLARITY), len(sentences))
+
+    return measure(lambda: prediction.assemble_whole_prediction(
+                           dataframe_actual,
+                           sentences, predictions_feature,
+                           dm.RESTAURANT_ENTITIES,
+                           sentences, predictions_polarity, dm.POLARITY),
+                   len(dataframe_actual), context['repeat'])
+
+
+BENCHMARKS = collections.OrderedDict([
+    ('clean_str', bench_clean_str),
+    ('parse_XML', bench_parse_XML),
+    ('get_dataset_semeval', bench_get_dataset_semeval),
+    ('load_word2vec', bench_load_word2vec),
+    ('load_glove', bench_load_glove),
+    ('batch_iter', bench_batch_iter),
+    ('batch_iter_training', bench_batch_iter_training),
+    ('train_step', bench_train_step),
+    ('inference', bench_inference),
+    ('train_step_fused', bench_train_step_fused),
+    ('inference_fused', bench_inference_fused),
+    ('inference_xla', bench_inference_xla),
+    ('inference_fused_xla', bench_inference_fused_xla),
+    ('whole_assembly', bench_whole_assembly),
+])
+
+
+# Runner
+# ==================================================
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=FOSA_FOLDER,
+                stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scale_name='default', names=None, log=print):
+    """
+    Run the benchmarks on synthetic data written into a temporary folder.
+    :param names: Names of the benchmarks to run. Default : all of them.
+    :return: Dictionary of the results, ready to be written as JSON.
+    """
+
+    names = names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError("Unknown benchmarks : {}. Choose among : {}".format(
+                ", ".join(unknown), ", ".join(BENCHMARKS)))
+
+    folder = tempfile.mkdtemp(prefix='fosa_bench_')
+    results = collections.OrderedDict()
+    try:
+        context = build_context(folder, SCALES[scale_name])
+        for name in names:
+            try:
+                results[name] = BENCHMARKS[name](context)
+                log("{} : {}".format(name, format_result(results[name])))
+            except SkipBenchmark as e:
+                results[name] = {'skipped': str(e)}
+                log("{} : skipped ({})".format(name, e))
+            except Exception as e:
+                # A failing benchmark does not prevent the others from
+                # running, its error is kept in the results
+                results[name] = {'error': "{}: {}".format(
+                        type(e).__name__, e)}
+                log("{} : error ({})".format(name, results[name]['error']))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+        dm.DOMAINS.pop(BENCHMARK_DOMAIN, None)
+
+    return {'version': RESULTS_VERSION,
+            'timestamp': int(time.time()),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'scale': scale_name,
+            'results': results}
+
+
+def format_result(result):
+    if 'skipped' in result or 'error' in result:
+        return "skipped" if 'skipped' in result else "error"
+    if 'seconds' not in result:
+        return ", ".join("{} {}".format(name, format_result(value))
+                         for name, value in result.items())
+    return "{:.4f}s ({:.0f} items/s)".format(result['seconds'],
+                                             result['items_per_second'] or 0)
+
+
+def flatten(results, prefix=''):
+    """
+    :return: Dictionary name -> best time in seconds of the measured
+    benchmarks (the benchmarks by batch size are named benchmark/batch_N).
+    """
+
+    flat = collections.OrderedDict()
+    for name, result in results.items():
+        if 'seconds' in result:
+            flat[prefix + name] = result['seconds']
+        elif 'skipped' not in result and 'error' not in result:
+            flat.update(flatten(result, prefix + name + '/'))
+    return flat
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD, log=print):
+    """
+    Compare the results of two runs.
+    :return: Names of the benchmarks slower than the baseline by more than
+    threshold.
+    """
+
+    if baseline.get('scale') != current.get('scale'):
+        log("Warning : the runs have different scales ({} and {})".format(
+                baseline.get('scale'), current.get('scale')))
+
+    old = flatten(baseline['results'])
+    new = flatten(current['results'])
+    regressions = []
+    log("Benchmark | Baseline (s) | Current (s) | Ratio")
+    for name in new:
+        if name not in old:
+            continue
+        ratio = new[name] / old[name] if old[name] > 0 else float('inf')
+        flag = ""
+        if ratio > threshold:
+            regressions.append(name)
+            flag = " REGRESSION"
+        log("{} | {:.4f} | {:.4f} | {:.2f}{}".format(name, old[name],
+                                                     new[name], ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='default',
+                        help="Size of the synthetic data (default: default)")
+    parser.add_argument('--only', default='',
+                        help="Comma-separated names of the benchmarks to run "
+                             "among : " + ", ".join(BENCHMARKS))
+    parser.add_argument('--output', default='',
+                        help="JSON file where the results are written")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help="Compare two JSON files of results instead of "
+                             "running the benchmarks")
+    parser.add_argument('--threshold', type=float,
+                        default=REGRESSION_THRESHOLD,
+                        help="Slowdown ratio reported as a regression "
+                             "(default: {})".format(REGRESSION_THRESHOLD))
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], 'r') as f:
+            baseline = json.load(f)
+        with open(args.compare[1], 'r') as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.threshold) else 0)
+
+    names = [name for name in args.only.split(",") if name]
+    results = run_benchmarks(args.scale, names)
+    if args.output:
+        folder = os.path.dirname(args.output)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("Results written into {}".format(args.output))
@@ -4,9 +4,20 @@
 Implementation of the CNN algorithm used for polarity learning and prediction.
 """
 
+import contextlib
+
 import tensorflow as tf
 import numpy as np
 
+# Policies of the embedding layer
+# - trainable : the embeddings are trained with the rest of the CNN
+# - frozen : the embeddings keep their initial values (pretrained word
+#   embeddings), the optimizer neither computes their gradients nor keeps
+#   slot variables for them
+# - multichannel : a frozen and a trainable copy of the embeddings are the
+#   two input channels of the convolutions ("CNN-multichannel" of Kim, 2014)
+EMBEDDING_POLICIES = ['trainable', 'frozen', 'multichannel']
+
 
 class TextCNN(object):
     """
@@ -17,7 +28,10 @@ class TextCNN(object):
     """
 
     def __init__(self, sequence_length, num_classes, vocab_size,
-                 embedding_size, filter_sizes, num_filters, l2_reg_lambda=0.0):
+                 embedding_size, filter_sizes, num_filters, l2_reg_lambda=0.0,
+                 multilabel=False, embedding_policy='trainable',
+                 embedding_device='/cpu:0', fused_convolutions=False,
+                 xla_jit=False):
         """
         :param sequence_length: Length of the sentences. Here, all sentences\
         have the same length because of the padding of the preprocessing part.
@@ -45,6 +59,30 @@ class TextCNN(object):
         :param num_filters: The number of filters per filter size (see above).
         :type num_filters: int
 
+        :param multilabel: If True, each sentence can belong to several\
+        classes : the output layer is made of independent sigmoid units and\
+        input_y is a multi-hot vector. Otherwise, the output layer is a\
+        softmax and input_y is the id of the class (int32 sparse label).
+        :type multilabel: boolean
+
+        :param embedding_policy: 'trainable', 'frozen' or 'multichannel'\
+        (see EMBEDDING_POLICIES). The initial values of the embeddings are\
+        assigned to the variables of embedding_variables.
+        :type embedding_policy: string
+
+        :param embedding_device: Device of the embedding lookup, None to let\
+        TensorFlow place it.
+        :type embedding_device: string
+
+        :param fused_convolutions: If True, the filters of all sizes are\
+        computed by a single convolution (see _fused_conv_maxpool) instead of\
+        one convolution per filter size.
+        :type fused_convolutions: boolean
+
+        :param xla_jit: If True, the convolution, max-pooling and output\
+        layers are compiled by XLA (JIT). Needs a TensorFlow built with XLA.
+        :type xla_jit: boolean
+
         .. todo::
             Verify types.
 
@@ -52,16 +90,22 @@ class TextCNN(object):
             Modify the CNN to adapt it to SemEval dataset.
         """
 
+        if embedding_policy not in EMBEDDING_POLICIES:
+            raise ValueError("'embedding_policy' parameter must be one of : " +
+                             ", ".join(EMBEDDING_POLICIES))
+
         # Placeholders for input, output and dropout
         # ==================================================
 
         self.input_x = tf.placeholder(tf.int32,
                                       [None, sequence_length], name="input_x")
-        self.input_y = tf.placeholder(tf.float32,
-                                      [None, num_classes], name="input_y")
+        if multilabel:
+            self.input_y = tf.placeholder(tf.float32,
+                                          [None, num_classes], name="input_y")
+        else:
+            self.input_y = tf.placeholder(tf.int32, [None], name="input_y")
         self.dropout_keep_prob = tf.placeholder(tf.float32,
                                                 name="dropout_keep_prob")
-        self.learning_rate = tf.placeholder(tf.float32)
 
         # Keeping track of l2 regularization loss (optional)
         # ==================================================
@@ -74,11 +118,13 @@ class TextCNN(object):
         # Some explanations: https://stackoverflow.com/questions/37897934/tensorflow-embedding-lookup
         # ==================================================
 
-        with tf.device('/cpu:0'), tf.name_scope("embedding"):
+        with tf.device(embedding_device), tf.name_scope("embedding"):
             # Weights - filter matrix
             self.W = tf.Variable(
                     tf.random_uniform([vocab_size, embedding_size], -1.0, 1.0),
+                    trainable=embedding_policy == 'trainable',
                     name="W")
+            self.embedding_variables = [self.W]
 
             # Compute embedding (array of size embedding_size) for input_x
             # Output shape : [None, sequence_length, embedding_size]
@@ -89,9 +135,98 @@ class TextCNN(object):
             self.embedded_chars_expanded = tf.expand_dims(self.embedded_chars,
                                                           -1)
 
+            if embedding_policy == 'multichannel':
+                # Trainable copy of the frozen embeddings W, as second
+                # channel
+                # Output shape : [None, sequence_length, embedding_size, 2]
+                self.W_non_static = tf.Variable(self.W.initialized_value(),
+                                                name="W_non_static")
+                self.embedding_variables.append(self.W_non_static)
+                self.embedded_chars_expanded = tf.stack(
+                        [self.embedded_chars,
+                         tf.nn.embedding_lookup(self.W_non_static,
+                                                self.input_x)], -1)
+        num_channels = len(self.embedding_variables)
+
         # Create a convolution + maxpool layer for each filter size
         # ==================================================
 
+        # Variables of the embedding and convolution layers, which do not
+        # depend on the classes (see train.py --finetune_dir)
+        self.trunk_variables = list(self.embedding_variables)
+        conv_maxpool = (self._fused_conv_maxpool if fused_convolutions
+                        else self._conv_maxpool)
+        with _compilation_scope(xla_jit):
+            # Shape : [batch_size, num_filters_total]
+            self.h_pool_flat = conv_maxpool(
+                    self.embedded_chars_expanded, sequence_length,
+                    embedding_size, num_channels, filter_sizes, num_filters)
+        num_filters_total = num_filters * len(filter_sizes)
+
+        # Add dropout
+        # ==================================================
+
+        with tf.name_scope("dropout"), _compilation_scope(xla_jit):
+            self.h_drop = tf.nn.dropout(self.h_pool_flat,
+                                        self.dropout_keep_prob)
+
+        # Final (unnormalized) scores and predictions
+        # ==================================================
+
+        with tf.name_scope("output"), _compilation_scope(xla_jit):
+            W = tf.get_variable(
+                "W",
+                shape=[num_filters_total, num_classes],
+                initializer=tf.contrib.layers.xavier_initializer())
+            b = tf.Variable(tf.constant(0.1, shape=[num_classes]), name="b")
+            l2_loss += tf.nn.l2_loss(W)
+            l2_loss += tf.nn.l2_loss(b)
+            self.scores = tf.nn.xw_plus_b(self.h_drop, W, b, name="scores")
+            self.predictions = tf.argmax(self.scores, 1, name="predictions")
+            if multilabel:
+                self.probabilities = tf.nn.sigmoid(self.scores,
+                                                   name="probabilities")
+            else:
+                self.probabilities = tf.nn.softmax(self.scores,
+                                                   name="probabilities")
+
+        # Calculate mean cross-entropy loss
+        # ==================================================
+
+        with tf.name_scope("loss"):
+            if multilabel:
+                losses = tf.reduce_sum(
+                        tf.nn.sigmoid_cross_entropy_with_logits(
+                                logits=self.scores, labels=self.input_y), 1)
+            else:
+                losses = tf.nn.sparse_softmax_cross_entropy_with_logits(
+                        logits=self.scores, labels=self.input_y)
+            self.loss = tf.reduce_mean(losses) + l2_reg_lambda * l2_loss
+
+        # Calculate Accuracy
+        # ==================================================
+
+        with tf.name_scope("accuracy"):
+            if multilabel:
+                # A sentence is correctly predicted if its whole set of
+                # classes is found
+                predicted_labels = tf.cast(self.probabilities > 0.5,
+                                           tf.float32)
+                correct_predictions = tf.reduce_all(
+                        tf.equal(predicted_labels, self.input_y), 1)
+            else:
+                correct_predictions = tf.equal(
+                        tf.cast(self.predictions, tf.int32), self.input_y)
+            self.accuracy = tf.reduce_mean(
+                    tf.cast(correct_predictions, "float"), name="accuracy")
+
+    def _conv_maxpool(self, embedded_chars_expanded, sequence_length,
+                      embedding_size, num_channels, filter_sizes, num_filters):
+        """
+        One convolution + maxpool layer per filter size.
+        :return: The pooled features, shape [batch_size, num_filters_total].
+        """
+
         pooled_outputs = []
         for i, filter_size in enumerate(filter_sizes):
             with tf.name_scope("conv-maxpool-%s" % filter_size):
@@ -99,7 +234,8 @@ class TextCNN(object):
                 # Convolution Layer
                 # ----------------
 
-                filter_shape = [filter_size, embedding_size, 1, num_filters]
+                filter_shape = [filter_size, embedding_size, num_channels,
+                                num_filters]
 
                 # Weights - filter matrix
                 W = tf.Variable(tf.truncated_normal(filter_shape, stddev=0.1),
@@ -108,9 +244,10 @@ class TextCNN(object):
                 # Biases
                 b = tf.Variable(tf.constant(0.1, shape=[num_filters]),
                                 name="b")
+                self.trunk_variables.extend([W, b])
 
                 conv = tf.nn.conv2d(
-                    self.embedded_chars_expanded,
+                    embedded_chars_expanded,
                     W,
                     strides=[1, 1, 1, 1],
                     padding="VALID",
@@ -130,47 +267,81 @@ class TextCNN(object):
                 pooled_outputs.append(pooled)
 
         # Combine all the pooled features
-        # Shape : [batch_size, num_filters_total]
         # ==================================================
 
         num_filters_total = num_filters * len(filter_sizes)
-        self.h_pool = tf.concat(pooled_outputs, 3)
-        self.h_pool_flat = tf.reshape(self.h_pool, [-1, num_filters_total])
-
-        # Add dropout
-        # ==================================================
-
-        with tf.name_scope("dropout"):
-            self.h_drop = tf.nn.dropout(self.h_pool_flat,
-                                        self.dropout_keep_prob)
-
-        # Final (unnormalized) scores and predictions
-        # ==================================================
+        h_pool = tf.concat(pooled_outputs, 3)
+        return tf.reshape(h_pool, [-1, num_filters_total])
 
-        with tf.name_scope("output"):
-            W = tf.get_variable(
-                "W",
-                shape=[num_filters_total, num_classes],
-                initializer=tf.contrib.layers.xavier_initializer())
-            b = tf.Variable(tf.constant(0.1, shape=[num_classes]), name="b")
-            l2_loss += tf.nn.l2_loss(W)
-            l2_loss += tf.nn.l2_loss(b)
-            self.scores = tf.nn.xw_plus_b(self.h_drop, W, b, name="scores")
-            self.predictions = tf.argmax(self.scores, 1, name="predictions")
-
-        # Calculate mean cross-entropy loss
-        # ==================================================
+    def _fused_conv_maxpool(self, embedded_chars_expanded, sequence_length,
+                            embedding_size, num_channels, filter_sizes,
+                            num_filters):
+        """
+        The filters of all sizes in a single convolution, which avoids one
+        convolution, one pooling and one concatenation per filter size.
+
+        The filters are padded to the largest size and masked, so that the
+        rows beyond the size of a filter stay zero, and the sentences are
+        padded with zeros at the end so that the smallest filters slide over
+        all their positions. Each group of filters is max-pooled over its
+        own positions, so that the features are the same as the ones of
+        _conv_maxpool.
+        :return: The pooled features, shape [batch_size, num_filters_total].
+        """
 
-        with tf.name_scope("loss"):
-            losses = tf.nn.softmax_cross_entropy_with_logits(
-                    logits=self.scores, labels=self.input_y)
-            self.loss = tf.reduce_mean(losses) + l2_reg_lambda * l2_loss
+        max_size = max(filter_sizes)
+        min_size = min(filter_sizes)
+        num_filters_total = num_filters * len(filter_sizes)
 
-        # Calculate Accuracy
-        # ==================================================
+        with tf.name_scope("conv-maxpool-fused"):
+            filter_shape = [max_size, embedding_size, num_channels,
+                            num_filters_total]
+            mask = np.zeros([max_size, 1, 1, num_filters_total],
+                            dtype=np.float32)
+            for i, filter_size in enumerate(filter_sizes):
+                mask[:filter_size, :, :,
+                     i * num_filters:(i + 1) * num_filters] = 1.0
+
+            # Weights - filter matrix, the masked rows get no gradient
+            W = tf.Variable(tf.truncated_normal(filter_shape, stddev=0.1),
+                            name="W")
+
+            # Biases
+            b = tf.Variable(tf.constant(0.1, shape=[num_filters_total]),
+                            name="b")
+            self.trunk_variables.extend([W, b])
+
+            padded = tf.pad(embedded_chars_expanded,
+                            [[0, 0], [0, max_size - min_size], [0, 0],
+                             [0, 0]])
+            # Output shape : [batch_size, sequence_length - min_size + 1, 1,
+            # num_filters_total]
+            conv = tf.nn.conv2d(
+                padded,
+                W * tf.constant(mask),
+                strides=[1, 1, 1, 1],
+                padding="VALID",
+                name="conv")
+
+            # Apply nonlinearity
+            h = tf.nn.relu(tf.nn.bias_add(conv, b), name="relu")
+
+            # Max-pooling of each group of filters over its valid positions
+            pooled_outputs = []
+            for i, filter_size in enumerate(filter_sizes):
+                positions = sequence_length - filter_size + 1
+                pooled_outputs.append(tf.reduce_max(
+                        h[:, :positions, 0,
+                          i * num_filters:(i + 1) * num_filters], axis=1))
+            return tf.concat(pooled_outputs, 1, name="pool")
+
+
+def _compilation_scope(xla_jit):
+    """
+    :return: Scope whose operations are compiled by XLA if xla_jit is True,
+    a scope without effect otherwise.
+    """
 
-        with tf.name_scope("accuracy"):
-            correct_predictions = tf.equal(self.predictions,
-                                           tf.argmax(self.input_y, 1))
-            self.accuracy = tf.reduce_mean(
-                    tf.cast(correct_predictions, "float"), name="accuracy")
+    if xla_jit:
+        return tf.contrib.compiler.jit.experimental_jit_scope()
+    return contextlib.ExitStack()
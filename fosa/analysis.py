@@ -4,58 +4,146 @@ Display some information like pie charts...etc... in order to analyse the
 results of the evaluation part of the algorithm.
 """
 
-import tensorflow as tf
-import matplotlib
-import matplotlib.pyplot as plt
-import pandas as pd
+import argparse
 import yaml
 import numpy as np
-import preprocessing as pp
+import os
+import multiprocessing
+import evaluation as ev
+import scorer
+import dataset_stats as ds
 
 # Constants
 # ==================================================
-matplotlib.rcParams['font.size'] = 5.0
+CHART_FONT_SIZE = 5.0
+
+# Charts are saved as vector images by default. The resolution is only used
+# by raster formats (png, jpg...)
+CHART_FORMAT = 'svg'
+CHART_DPI = 150
 
 # Definitions
 # ==================================================
 
 
-def pie_chart_support_distribution(classification_report, title, folder):
+def get_pyplot():
     """
-    Plot a pie chart which describes the distribution of each class.
-    :param classification_report: Sliced classification report : classes,
-    toPlot, support. toPlot must be a tuple (precision, recall, f1-score)
+    Import matplotlib only when a chart is drawn : it is slow to import and
+    most of the tools importing this module never draw any chart.
     """
 
-    classes, toPlot, support = slice_classification_report(
-            classification_report)
+    import matplotlib
+    import matplotlib.pyplot as plt
+    matplotlib.rcParams['font.size'] = CHART_FONT_SIZE
+    return plt
+
+
+def save_figure(fig, filepath, fmt=CHART_FORMAT, dpi=CHART_DPI):
+    """
+    Save a figure as filepath.fmt, then close it to free its memory.
+    """
 
-    # Don't take into account the last column which is the total number
-    # of each class
-    labels = classes[0:len(classes)-1]
-    sizes = support[0:len(classes)-1]
+    fig.savefig(filepath + "." + fmt, format=fmt, dpi=dpi)
+    get_pyplot().close(fig)
 
-    fig1, ax1 = plt.subplots()
-    patches, texts, _ = ax1.pie(sizes, labels=labels, autopct='%1.1f%%',
-                                startangle=90)
+
+def render_charts(charts, processes=0):
+    """
+    Render all the charts of a run in a single pass.
+    :param charts: List of (function, args) tuples where function is one of
+    the chart functions of this module, e.g.
+    (bar_chart_classification_report, (report, title, folder)).
+    :param processes: Number of worker processes rendering the charts with
+    the headless Agg backend. Default : 0, the charts are rendered in the
+    current process.
+    :type processes: int
+    """
+
+    if processes > 1 and len(charts) > 1:
+        # The workers are spawned so that they pick the Agg backend when
+        # importing matplotlib
+        previous_backend = os.environ.get('MPLBACKEND')
+        os.environ['MPLBACKEND'] = 'Agg'
+        try:
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(min(processes, len(charts))) as pool:
+                pool.map(render_chart, charts, chunksize=1)
+        finally:
+            if previous_backend is None:
+                del os.environ['MPLBACKEND']
+            else:
+                os.environ['MPLBACKEND'] = previous_backend
+    else:
+        for chart in charts:
+            render_chart(chart)
+
+
+def render_chart(chart):
+    function, args = chart
+    function(*args)
+
+
+def pie_chart(sizes, labels, filepath, title=None, legend=False,
+              fmt=CHART_FORMAT, dpi=CHART_DPI):
+    """
+    Plot a pie chart and save it as filepath.fmt.
+    """
+
+    plt = get_pyplot()
+
+    fig, ax = plt.subplots()
+    patches, texts, _ = ax.pie(sizes, labels=labels, autopct='%1.1f%%',
+                               startangle=90)
     # Equal aspect ratio ensures that pie is drawn as a circle.
-    ax1.axis('equal')
-    ax1.set_title(title)
-    ax1.legend(patches, labels, loc="best")
+    ax.axis('equal')
+    if title is not None:
+        ax.set_title(title)
+    if legend:
+        ax.legend(patches, labels, loc="best")
+
+    save_figure(fig, filepath, fmt, dpi)
+
+
+def pie_chart_support_distribution(metrics, title, folder,
+                                   fmt=CHART_FORMAT, dpi=CHART_DPI):
+    """
+    Plot a pie chart which describes the distribution of each class.
+    :param metrics: Measures of a classification computed by
+    evaluation.classification_metrics.
+    """
+
+    # Classes absent from the dataset are not displayed
+    support = np.asarray(metrics['support'])
+    present = np.flatnonzero(support)
+    labels = [metrics['target_names'][i] for i in present]
+    sizes = support[present].tolist()
 
-    plt.savefig(folder+"/"+title.replace(" ", "_")+".png", format="png",
-                dpi=1000)
+    pie_chart(sizes, labels, os.path.join(folder, title.replace(" ", "_")),
+              title, True, fmt, dpi)
 
 
-def bar_chart_classification_report(classification_report, title, folder):
+def bar_chart_classification_report(metrics, title, folder,
+                                    fmt=CHART_FORMAT, dpi=CHART_DPI):
     """
-    Plot a bar graph which sums up the classification report of the scikit
-    learn tool.
-    :param classification_report: Sliced classification report : classes,
-    toPlot, support. toPlot must be a tuple (precision, recall, f1-score)
+    Plot a bar graph which sums up the precision, recall and F1-score of each
+    class, and their average.
+    :param metrics: Measures of a classification computed by
+    evaluation.classification_metrics.
     """
-    classes, toPlot, support = slice_classification_report(
-            classification_report)
+
+    plt = get_pyplot()
+
+    # Classes neither present in the dataset nor predicted are not displayed
+    present = np.flatnonzero(np.asarray(metrics['support']) +
+                             np.asarray(metrics['predicted']))
+    classes = [metrics['target_names'][i] for i in present]
+    toPlot = [[metrics['precision'][i], metrics['recall'][i],
+               metrics['f1'][i]] for i in present]
+
+    # The last bars represent the average
+    average = metrics['average']
+    classes.append(ev.AVERAGE_NAME)
+    toPlot.append([average['precision'], average['recall'], average['f1']])
 
     N = 3
     bar_width = 0.05
@@ -63,8 +151,6 @@ def bar_chart_classification_report(classification_report, title, folder):
     ind = np.arange(N)
     fig, ax = plt.subplots()
 
-    # Enumerate over each class except the last one which represent the average
-    # and total
     bars = []
     for i in range(len(classes)):
         bar_i = ax.bar(ind + i * bar_width, toPlot[i], bar_width)
@@ -78,47 +164,7 @@ def bar_chart_classification_report(classification_report, title, folder):
 
     ax.legend(bars, classes, loc="best")
 
-    plt.savefig(folder+"/"+title.replace(" ", "_")+".png", format="png",
-                dpi=1000)
-
-
-def slice_classification_report(classification_report):
-    """
-    Plot scikit-learn classification report.
-    Extension based on https://stackoverflow.com/a/31689645/395857
-    """
-    lines = classification_report.split('\n')
-
-    classes = []
-    plotMat = []
-    support = []
-    class_names = []
-
-    for line in lines[2: (len(lines) - 2)]:
-        t = line.strip().split()
-
-        if len(t) < 2:
-            continue
-
-        classes.append(t[0])
-        v = [float(x) for x in t[1: len(t) - 1]]
-        support.append(int(t[-1]))
-        class_names.append(t[0])
-        plotMat.append(v)
-
-    # Save the average precision/recall/F1-score and total support
-    t = lines[len(lines) - 2].strip().split()
-    classes.append(t[0] + t[1] + t[2])
-    v = [float(x) for x in t[3: len(t) - 1]]
-    support.append(int(t[-1]))
-    class_names.append(t[0] + t[1] + t[2])
-    plotMat.append(v)
-
-    print("\n")
-    print("plotMat: {0}".format(plotMat))
-    print("support: {0}".format(support))
-
-    return classes, plotMat, support
+    save_figure(fig, os.path.join(folder, title.replace(" ", "_")), fmt, dpi)
 
 
 def display_stat(filepath):
@@ -127,189 +173,95 @@ def display_stat(filepath):
     :param filepath: Path of the dataset SemEval. The path must leads to a
     folder containing both the training and testing sets.
     :type filepath: string
-    :return: Pandas.dataframe with the following columns : review_id,
-    sentence_id, text, feature, polarity
     """
 
-    training_set = pp.parse_XML(filepath+"/train.xml")
-    testing_set = pp.parse_XML(filepath+"/test/test_gold.xml")
+    plt = get_pyplot()
 
     # Some opinions concerns various food, drinks...etc... but the opinion
-    # is the same while the target differ. So deleting duplicates as the scope
-    # of this study does not imply target (OPE in SemEval)
-    training_set = training_set.drop_duplicates()
-    testing_set = testing_set.drop_duplicates()
-
-    # Count # of opinions for each sentence
-    count_opinions_train = training_set['sentence_id'].value_counts()
-    count_opinions_train = count_opinions_train.value_counts()
-    count_opinions_test = testing_set['sentence_id'].value_counts()
-    count_opinions_test = count_opinions_test.value_counts()
-
-    # Display pie charts
-    count_dict_train = count_opinions_train.to_dict()
-    labels = list(count_dict_train.keys())
-    sizes = list(count_dict_train.values())
+    # is the same while the target differ. So duplicates are counted once as
+    # the scope of this study does not imply target (OPE in SemEval)
+    # (see dataset_stats.py)
+    for title, xml_file in [('[TRAIN]', "/train.xml"),
+                            ('[TEST]', "/test/test_gold.xml")]:
 
-    fig, ax = plt.subplots()
-    ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90)
-    ax.axis('equal')
-    ax.set_title('[TRAIN] Percentage of opinion occurences in a sentence')
+        # Count # of opinions for each sentence
+        count_opinions = ds.file_statistics(
+                filepath + xml_file)['opinions_per_sentence']
 
-    count_dict_test = count_opinions_test.to_dict()
-    labels = list(count_dict_test.keys())
-    sizes = list(count_dict_test.values())
+        # Display pie charts
+        labels = sorted(count_opinions.keys())
+        sizes = [count_opinions[label] for label in labels]
 
-    fig1, ax1 = plt.subplots()
-    ax1.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90)
-    ax1.axis('equal')
-    ax1.set_title('[TEST] Percentage of opinion occurences in a sentence')
+        fig, ax = plt.subplots()
+        ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90)
+        ax.axis('equal')
+        ax.set_title(title + ' Percentage of opinion occurences in a sentence')
 
     plt.show()
+    plt.close('all')
 
 
-def display_pie(data, folder):
-
-    # Feature distribution
-    # --------------------
-
-    distribution_train = data.groupby('feature').size()
-    labels = distribution_train.index.tolist()
-    sizes = distribution_train.tolist()
-
-    fig, ax = plt.subplots()
-    patches, texts, autotexts = ax.pie(sizes, labels=labels, autopct='%1.1f%%',
-                               startangle=90)
-    # Equal aspect ratio ensures that pie is drawn as a circle.
-    ax.axis('equal')
-
-    this_folder = folder+"/feature_distribution"
-    plt.savefig(this_folder+".png", format="png",
-                dpi=1000)
-
-    # Polarity distribution
-    # ---------------------
-
-    distribution_train = data.groupby('polarity').size()
-    labels = distribution_train.index.tolist()
-    sizes = distribution_train.tolist()
-
-    fig, ax = plt.subplots()
-    patches, texts, autotexts = ax.pie(sizes, labels=labels, autopct='%1.1f%%',
-                               startangle=90)
-    # Equal aspect ratio ensures that pie is drawn as a circle.
-    ax.axis('equal')
+def distribution_charts(counters, folder, fmt=CHART_FORMAT, dpi=CHART_DPI):
+    """
+    Charts describing the distribution of the features, the polarities and
+    the combinations of both in a SemEval dataset.
+    :param counters: Counters of one level computed by dataset_stats.py.
+    :return: List of charts to give to render_charts.
+    """
 
-    this_folder = folder+"/polarity_distribution"
-    plt.savefig(this_folder+".png", format="png",
-                dpi=1000)
+    charts = []
+    for name, filename in [('feature', "/feature_distribution"),
+                           ('polarity', "/polarity_distribution"),
+                           ('combination', "/comb_distribution")]:
+        labels = sorted(counters[name].keys())
+        sizes = [counters[name][label] for label in labels]
+        charts.append((pie_chart, (sizes, labels, folder + filename, None,
+                                   False, fmt, dpi)))
 
-    # Combination distribution
-    # ------------------------
+    return charts
 
-    distribution_train = data.groupby(['feature', 'polarity']).size()
-    labels = distribution_train.index.tolist()
-    sizes = distribution_train.tolist()
 
-    fig, ax = plt.subplots()
-    patches, texts, autotexts = ax.pie(sizes, labels=labels, autopct='%1.1f%%',
-                               startangle=90)
-    # Equal aspect ratio ensures that pie is drawn as a circle.
-    ax.axis('equal')
+def display_pie(data, folder, fmt=CHART_FORMAT, dpi=CHART_DPI):
 
-    this_folder = folder+"/comb_distribution"
-    plt.savefig(this_folder+".png", format="png",
-                dpi=1000)
+    render_charts(distribution_charts(ds.count_dataframe(data), folder, fmt,
+                                      dpi))
 
 
-def display_distrib_data():
+def display_distrib_data(fmt=CHART_FORMAT, dpi=CHART_DPI, processes=0):
 
     folder = "Figures/Data_distribution"
 
-    # Aspect solution
-    # ===============
-
-    # Restaurant domain
-    filepath = "../data/SemEval/Subtask1/restaurant"
-
-    training_set = pp.parse_XML(filepath+"/train.xml", True)
-    testing_set = pp.parse_XML(filepath+"/test/test_gold.xml", True)
+    # The counters of both levels are computed in a single pass over each
+    # file, and are read from the stored statistics afterwards
+    charts = []
+    for level, level_folder in [('aspect', "/Aspect"), ('entity', "/Entity")]:
+        for domain in ['restaurant', 'laptop']:
+            filepath = "../data/SemEval/Subtask1/" + domain
 
-    training_set = training_set.drop_duplicates()
-    testing_set = testing_set.drop_duplicates()
+            charts += distribution_charts(
+                    ds.file_statistics(filepath+"/train.xml", level),
+                    folder+"/Train"+level_folder+"/"+domain, fmt, dpi)
+            charts += distribution_charts(
+                    ds.file_statistics(filepath+"/test/test_gold.xml", level),
+                    folder+"/Test"+level_folder+"/"+domain, fmt, dpi)
 
-    display_pie(training_set, folder+"/Train/Aspect/restaurant")
-    display_pie(testing_set, folder+"/Test/Aspect/restaurant")
+    render_charts(charts, processes)
 
-    # Laptop domain
-    filepath = "../data/SemEval/Subtask1/laptop"
 
-    training_set = pp.parse_XML(filepath+"/train.xml", True)
-    testing_set = pp.parse_XML(filepath+"/test/test_gold.xml", True)
-
-    training_set = training_set.drop_duplicates()
-    testing_set = testing_set.drop_duplicates()
-
-    display_pie(training_set, folder+"/Train/Aspect/laptop")
-    display_pie(testing_set, folder+"/Test/Aspect/laptop")
-
-    # Entity solution
-    # ===============
-
-    # Restaurant domain
-    filepath = "../data/SemEval/Subtask1/restaurant"
-
-    training_set = pp.parse_XML(filepath+"/train.xml")
-    testing_set = pp.parse_XML(filepath+"/test/test_gold.xml")
-
-    training_set = training_set.drop_duplicates()
-    testing_set = testing_set.drop_duplicates()
-
-    display_pie(training_set, folder+"/Train/Entity/restaurant")
-    display_pie(testing_set, folder+"/Test/Entity/restaurant")
-
-    # Laptop domain
-    filepath = "../data/SemEval/Subtask1/laptop"
-
-    training_set = pp.parse_XML(filepath+"/train.xml")
-    testing_set = pp.parse_XML(filepath+"/test/test_gold.xml")
-
-    training_set = training_set.drop_duplicates()
-    testing_set = testing_set.drop_duplicates()
-
-    display_pie(training_set, folder+"/Train/Entity/laptop")
-    display_pie(testing_set, folder+"/Test/Entity/laptop")
-
-
-def slot3_accuracy():
-
-    # Filepath for restaurant domain predictions
-    filepath = "runs/aspects/word2vec_200-epochs/1501773565/predictions.csv"
-
-    # Load the predictions into a DataFrame
-    predictions = pd.DataFrame.from_csv(filepath)
-    predictions = predictions[['text', 'feature', 'polarity', 'pred_polarity']]
-
-    # For each aspect, determine the accuracy
-    # ---------------------------------------
-    predictions = predictions.groupby('feature')
-
-    acc = {}
-    for key, item in predictions:
-        predictions_one_aspect = predictions.get_group(key)
-        total_number = len(predictions_one_aspect)
-        df = pd.DataFrame(columns=['correct_polarities'])
-        df['correct_polarities'] = (predictions_one_aspect.polarity == predictions_one_aspect.pred_polarity)
-        correct_polarities = df['correct_polarities'].sum()
-        acc[key] = float(correct_polarities)/total_number
+def slot3_accuracy(run_directory):
+    """
+    Display the accuracy of each aspect following the slot 3 measure of the
+    SemEval competition (see scorer.py).
+    :param run_directory: Folder of a run containing predictions.csv.
+    :type run_directory: string
+    """
 
-    # Get the mean accuracy
-    mean_acc = float(sum(acc.values())) / len(acc)
-    acc["mean"] = mean_acc
+    scores = scorer.slot3_scores(scorer.load_predictions(run_directory))
 
     print("Slot 3 - Accuracy measure :")
-    for key, value in acc.items():
+    for key, value in scores['slot3_accuracy_per_feature'].items():
         print(key + " : " + str(value))
+    print("mean : " + str(scores['slot3_mean_accuracy']))
 
 
 if __name__ == '__main__':
@@ -320,18 +272,16 @@ if __name__ == '__main__':
     # Parameters
     # ==================================================
 
-    # Data Parameters
-
     # Eval Parameters
-    tf.flags.DEFINE_boolean("display_stat", False,
-                            "Display statistics of SemEval dataset")
-
-    tf.flags.DEFINE_boolean("slot3", False,
-                            "Display accuracy following the accuracy measure "+ 
-                            "of SemEval competition")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--display_stat", action='store_true',
+                        help="Display statistics of SemEval dataset")
+    parser.add_argument("--slot3", metavar="RUN_DIRECTORY", default="",
+                        help="Display accuracy following the accuracy "
+                             "measure of SemEval competition for the run "
+                             "(folder containing predictions.csv)")
 
-    FLAGS = tf.flags.FLAGS
-    FLAGS._parse_flags()
+    FLAGS = parser.parse_args()
 
     dataset_filepath_REST = "../data/SemEval/Subtask1/restaurant"
     dataset_filepath_LAPT = "../data/SemEval/Subtask1/laptop"
@@ -341,4 +291,4 @@ if __name__ == '__main__':
         display_stat(dataset_filepath_LAPT)
 
     if FLAGS.slot3:
-        slot3_accuracy()
+        slot3_accuracy(FLAGS.slot3)
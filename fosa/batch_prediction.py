@@ -0,0 +1,375 @@
+#! /usr/bin/env python3
+
+"""
+Batch prediction part of the algorithm.
+
+Score review files of any size with both CNN_feature and CNN_polarity. The
+sentences are read chunk by chunk from a file or from stdin (JSONL, CSV or
+SemEval XML) and the predictions are streamed to an output CSV file, so the
+memory used does not depend on the size of the input.
+"""
+
+import tensorflow as tf
+from tensorflow.contrib import learn
+import numpy as np
+import os
+import sys
+import csv
+import time
+import yaml
+import logging
+
+# Project modules
+import preprocessing as pp
+import domains as dm
+from evaluation import softmax, sigmoid, select_labels
+from cache import PredictionCache, cached_predict
+import session_config as sc
+import logs
+from sentence_streams import iter_sentences, iter_chunks
+
+# Constants
+# ==================================================
+
+OUTPUT_COLUMNS = ['review_id', 'sentence_id', 'entity', 'polarity',
+                  'entity_probabilities', 'polarity_probabilities']
+
+# Same logger as the one configured by the entry points, so that the
+# functions of this module can also be used from other modules
+logger = logging.getLogger()
+
+# Functions
+# ==================================================
+
+
+def get_target_names(config_file, focus, aspects=False):
+    """
+    Labels predicted by a CNN.
+    :param config_file: The configuration file of the project opened with yaml
+    library.
+    :param focus: (required) 'feature' or 'polarity'.
+    :type focus: string
+    :return: List of the labels, in the order of the output layer of the CNN.
+    """
+
+    domain = dm.get_current_domain(config_file)
+    return list(domain.labels(focus, aspects).names)
+
+
+class CNNPredictor(object):
+    """
+    A trained CNN restored from a run of train.py, kept warm in its own graph
+    and session so that it can score many chunks of sentences.
+    """
+
+    def __init__(self, folderpath_run, focus, batch_size=64,
+                 session_conf=None, cache=None, multilabel=False):
+        """
+        :param folderpath_run: The filepath of a run of train.py.
+        :type folderpath_run: string
+
+        :param focus: 'feature' or 'polarity'. This precises the folder of\
+        the CNN ('CNN_feature' or 'CNN_polarity').
+        :type focus: string
+
+        :param batch_size: Number of sentences given to the CNN at once.
+        :type batch_size: int
+
+        :param session_conf: Configuration of the TensorFlow session.
+        :type session_conf: tf.ConfigProto
+
+        :param cache: Outputs of the CNN for the sentences already scored.\
+        Default : no cache.
+        :type cache: cache.PredictionCache
+
+        :param multilabel: True if the CNN has been trained as a multi-label\
+        classifier (sigmoid outputs instead of softmax).
+        :type multilabel: boolean
+        """
+
+        self.batch_size = batch_size
+        self.cache = cache
+        self.multilabel = multilabel
+
+        # Vocabulary
+        vocab_path = os.path.join(folderpath_run, 'CNN_' + focus, 'vocab')
+        self.vocab_processor = learn.preprocessing.VocabularyProcessor.restore(
+                vocab_path)
+
+        # Restore the graph and the variables
+        checkpoints_folder = os.path.join(folderpath_run, 'CNN_' + focus,
+                                          'checkpoints')
+        self.checkpoint_file = tf.train.latest_checkpoint(checkpoints_folder)
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.sess = tf.Session(config=session_conf)
+            with self.sess.as_default():
+                saver = tf.train.import_meta_graph(
+                        "{}.meta".format(self.checkpoint_file))
+                saver.restore(self.sess, self.checkpoint_file)
+
+                self.input_x = self.graph.get_operation_by_name(
+                        "input_x").outputs[0]
+                self.dropout_keep_prob = self.graph.get_operation_by_name(
+                        "dropout_keep_prob").outputs[0]
+                self.scores = self.graph.get_operation_by_name(
+                        "output/scores").outputs[0]
+                self.predictions = self.graph.get_operation_by_name(
+                        "output/predictions").outputs[0]
+
+    def predict(self, x_text):
+        """
+        Score a list of cleaned sentences. The sentences found in the cache
+        are not given to the CNN.
+        :param x_text: Sentences already cleaned with preprocessing.clean_str.
+        :type x_text: list
+        :return: predictions (int array of shape [n]) and probabilities
+        (float array of shape [n, num_classes]).
+        """
+
+        return cached_predict(self.cache, self.checkpoint_file, x_text,
+                              self.run_CNN)
+
+    def run_CNN(self, x_text):
+        """
+        Score a list of cleaned sentences with the CNN.
+        """
+
+        x = np.array(list(self.vocab_processor.transform(x_text)))
+
+        all_predictions = []
+        all_probabilities = []
+        for start in range(0, len(x), self.batch_size):
+            batch_predictions, batch_scores = self.sess.run(
+                    [self.predictions, self.scores],
+                    {self.input_x: x[start:start + self.batch_size],
+                     self.dropout_keep_prob: 1.0})
+            all_predictions.append(batch_predictions)
+            if self.multilabel:
+                all_probabilities.append(sigmoid(batch_scores))
+            else:
+                all_probabilities.append(softmax(batch_scores))
+
+        return (np.concatenate(all_predictions),
+                np.concatenate(all_probabilities))
+
+    def close(self):
+        self.sess.close()
+
+
+def format_probabilities(probabilities):
+    return " ".join("{:.6f}".format(p) for p in probabilities)
+
+
+def score_stream(sentences, feature_predictor, polarity_predictor,
+                 target_names_feature, target_names_polarity, writer,
+                 chunk_size=10000, report_every=10, threshold=0.5,
+                 top_k=None, with_chunk_number=False):
+    """
+    Score sentences chunk by chunk with CNN_feature and CNN_polarity and write
+    one row per sentence as soon as its chunk is scored. If CNN_feature is a
+    multi-label classifier, one row is written for each feature detected in
+    the sentence, with the polarity of the sentence.
+    :param sentences: Iterable of dictionaries with the keys review_id,
+    sentence_id and text (see iter_sentences).
+    :param writer: csv.writer the predictions are written to.
+    :param chunk_size: Number of sentences held in memory at once.
+    :type chunk_size: int
+    :param report_every: Log the throughput every given chunks.
+    :type report_every: int
+    :param threshold: Multi-label mode only. Minimal probability of a
+    feature detected in a sentence.
+    :type threshold: float
+    :param top_k: Multi-label mode only. Maximal number of features detected
+    in a sentence.
+    :type top_k: int
+    :param with_chunk_number: If True, the number of the chunk is written
+    as the first column of each row.
+    :type with_chunk_number: boolean
+    :return: Number of scored sentences.
+    """
+
+    start_time = time.time()
+    number_of_rows = 0
+
+    for chunk_number, chunk in enumerate(iter_chunks(sentences, chunk_size),
+                                         start=1):
+        x_text = [pp.clean_str(sentence['text']) for sentence in chunk]
+
+        predictions_feature, probabilities_feature =\
+            feature_predictor.predict(x_text)
+        predictions_polarity, probabilities_polarity =\
+            polarity_predictor.predict(x_text)
+
+        if feature_predictor.multilabel:
+            features = select_labels(probabilities_feature, threshold, top_k)
+        else:
+            features = [[int(prediction)]
+                        for prediction in predictions_feature]
+
+        prefix = [chunk_number] if with_chunk_number else []
+        writer.writerows(
+                prefix +
+                [sentence['review_id'], sentence['sentence_id'],
+                 target_names_feature[feature],
+                 target_names_polarity[int(pred_polarity)],
+                 format_probabilities(prob_feature),
+                 format_probabilities(prob_polarity)]
+                for sentence, pred_features, pred_polarity, prob_feature,
+                prob_polarity in zip(chunk, features,
+                                     predictions_polarity,
+                                     probabilities_feature,
+                                     probabilities_polarity)
+                for feature in pred_features)
+        number_of_rows += len(chunk)
+
+        if chunk_number % report_every == 0:
+            elapsed_time = time.time() - start_time
+            logger.info("{} sentences scored in {:.1f}s ({:.1f} sentences/s)"
+                        .format(number_of_rows, elapsed_time,
+                                number_of_rows / elapsed_time))
+
+    elapsed_time = time.time() - start_time
+    logger.info("Total : {} sentences scored in {:.1f}s ({:.1f} sentences/s)"
+                .format(number_of_rows, elapsed_time,
+                        number_of_rows / max(elapsed_time, 1e-9)))
+
+    return number_of_rows
+
+
+if __name__ == '__main__':
+
+    with open("config.yml", 'r') as ymlfile:
+        cfg = yaml.load(ymlfile)
+
+    # Parameters
+    # ==================================================
+
+    # Data Parameters
+    tf.flags.DEFINE_string("input_file", "-",
+                           "File to score, '-' to read from stdin")
+    tf.flags.DEFINE_string("input_format", "auto",
+                           "'auto', 'jsonl', 'csv' or 'xml' (default: auto)")
+    tf.flags.DEFINE_string("output_file", "-",
+                           "CSV file where the predictions are written, '-' "
+                           "to write to stdout")
+
+    # Eval Parameters
+    tf.flags.DEFINE_integer("batch_size", 64, "Batch Size (default: 64)")
+    tf.flags.DEFINE_integer("chunk_size", 10000,
+                            "Number of sentences held in memory at once "
+                            "(default: 10000)")
+    tf.flags.DEFINE_integer("report_every", 10,
+                            "Log the throughput every given chunks "
+                            "(default: 10)")
+    tf.flags.DEFINE_string("checkpoint_dir", "",
+                           "Checkpoint directory from training run")
+
+    # Cache Parameters
+    tf.flags.DEFINE_integer("cache_size", 100000,
+                            "Number of sentences whose outputs are kept in "
+                            "memory, 0 to disable the cache (default: 100000)")
+    tf.flags.DEFINE_string("cache_path", "",
+                           "SQLite file used as on-disk tier of the cache "
+                           "(default: no disk tier)")
+
+    # Misc Parameters
+    tf.flags.DEFINE_boolean("allow_soft_placement", True,
+                            "Allow device soft device placement")
+    tf.flags.DEFINE_boolean("log_device_placement", False,
+                            "Log placement of ops on devices")
+    tf.flags.DEFINE_integer("intra_op_threads", -1,
+                            "Threads of the intra-op pool, 0 to let "
+                            "TensorFlow choose (default: config.yml)")
+    tf.flags.DEFINE_integer("inter_op_threads", -1,
+                            "Threads of the inter-op pool, 0 to let "
+                            "TensorFlow choose (default: config.yml)")
+    tf.flags.DEFINE_string("cpu_affinity", None,
+                           "Cores the process is pinned to, e.g. '0-3,8' "
+                           "(default: config.yml)")
+    tf.flags.DEFINE_boolean("aspects",
+                            False,
+                            "Scope widened to aspects and not only entities")
+
+    # Multi-label Parameters
+    tf.flags.DEFINE_boolean("multilabel",
+                            False,
+                            "CNN_feature has been trained as a multi-label "
+                            "classifier (see train.py)")
+    tf.flags.DEFINE_float("threshold", 0.5,
+                          "Minimal probability of a feature detected in a "
+                          "sentence (default: 0.5)")
+    tf.flags.DEFINE_integer("top_k", 3,
+                            "Maximal number of features detected in a "
+                            "sentence (default: 3)")
+
+    FLAGS = tf.flags.FLAGS
+    FLAGS._parse_flags()
+
+    # Logger
+    # ==================================================
+
+    # Log file of the run (see logs.py). The console handler logs to
+    # stderr, as stdout may be used for the predictions
+    logger = logs.setup_logging(os.path.join(FLAGS.checkpoint_dir,
+                                             "batch.log"),
+                                shared_log_file=None)
+    logger.debug(" *** Parameters *** ")
+    for attr, value in sorted(FLAGS.__flags.items()):
+        logger.debug("{}={}".format(attr.upper(), value))
+    logger.debug("")
+
+    # ==================================================
+    # Load both CNNs
+    # ==================================================
+
+    session_settings = sc.get_session_settings(
+            cfg, FLAGS.intra_op_threads, FLAGS.inter_op_threads,
+            FLAGS.cpu_affinity)
+    if sc.apply_cpu_affinity(session_settings['cpu_affinity']):
+        logger.info("Process pinned to the cores {}".format(
+                session_settings['cpu_affinity']))
+    session_conf = sc.make_session_config(
+            session_settings, FLAGS.allow_soft_placement,
+            FLAGS.log_device_placement)
+
+    cache = None
+    if FLAGS.cache_size > 0:
+        cache = PredictionCache(FLAGS.cache_size, FLAGS.cache_path or None)
+
+    feature_predictor = CNNPredictor(FLAGS.checkpoint_dir, 'feature',
+                                     FLAGS.batch_size, session_conf, cache,
+                                     FLAGS.multilabel)
+    polarity_predictor = CNNPredictor(FLAGS.checkpoint_dir, 'polarity',
+                                      FLAGS.batch_size, session_conf, cache)
+
+    # ==================================================
+    # Stream the predictions
+    # ==================================================
+
+    sentences = iter_sentences(FLAGS.input_file, FLAGS.input_format)
+
+    if FLAGS.output_file == '-':
+        output_file = sys.stdout
+    else:
+        output_file = open(FLAGS.output_file, 'w', encoding='utf-8',
+                           newline='')
+
+    try:
+        writer = csv.writer(output_file)
+        writer.writerow(OUTPUT_COLUMNS)
+        score_stream(sentences, feature_predictor, polarity_predictor,
+                     get_target_names(cfg, 'feature', FLAGS.aspects),
+                     get_target_names(cfg, 'polarity'),
+                     writer, FLAGS.chunk_size, FLAGS.report_every,
+                     FLAGS.threshold, FLAGS.top_k)
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+        feature_predictor.close()
+        polarity_predictor.close()
+        if cache is not None:
+            logger.info("Cache : {}".format(cache.metrics()))
+            cache.save_metrics(os.path.join(FLAGS.checkpoint_dir,
+                                            "cache_metrics.json"))
+            cache.close()
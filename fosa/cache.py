@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""
+Cache of the outputs of the CNNs for sentences which have already been
+scored.
+
+Review streams contain many exact duplicates ("Great food!", "Service was
+slow."...), so the outputs of a CNN are kept in a bounded LRU cache, with an
+optional on-disk tier (SQLite) which survives between runs. The entries are
+keyed by the checkpoint of the CNN and the sentence normalized with
+preprocessing.clean_str, so the outputs of CNN_feature and CNN_polarity can
+live in the same cache.
+"""
+
+import collections
+import json
+import sqlite3
+import numpy as np
+
+
+class PredictionCache(object):
+    """
+    Bounded LRU cache of (prediction, probabilities) pairs.
+    """
+
+    def __init__(self, max_size=100000, disk_path=None):
+        """
+        :param max_size: Maximum number of entries kept in memory. The least\
+        recently used entries are evicted first.
+        :type max_size: int
+
+        :param disk_path: Path of a SQLite database used as a second tier.\
+        Entries evicted from memory stay on disk. Default : no disk tier.
+        :type disk_path: string
+        """
+
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.connection = None
+        if disk_path:
+            self.connection = sqlite3.connect(disk_path, timeout=60)
+            self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS predictions ("
+                    "key TEXT PRIMARY KEY, prediction INTEGER, "
+                    "probabilities BLOB)")
+
+    @staticmethod
+    def make_key(checkpoint_id, text):
+        return checkpoint_id + "\t" + text
+
+    def get(self, checkpoint_id, text):
+        """
+        :return: (prediction, probabilities) or None if the sentence has not
+        been scored by this checkpoint yet.
+        """
+
+        key = self.make_key(checkpoint_id, text)
+
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+        if self.connection is not None:
+            row = self.connection.execute(
+                    "SELECT prediction, probabilities FROM predictions "
+                    "WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value = (row[0], np.frombuffer(row[1], dtype=np.float32))
+                self._put_in_memory(key, value)
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, checkpoint_id, text, prediction, probabilities):
+        key = self.make_key(checkpoint_id, text)
+        value = (int(prediction), np.asarray(probabilities, dtype=np.float32))
+        self._put_in_memory(key, value)
+
+        if self.connection is not None:
+            self.connection.execute(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)",
+                    (key, value[0], value[1].tobytes()))
+
+    def _put_in_memory(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def commit(self):
+        """
+        Write the pending entries of the disk tier.
+        """
+
+        if self.connection is not None:
+            self.connection.commit()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def metrics(self):
+        """
+        :return: Dictionary with the number of hits (memory and disk), misses,
+        the hit rate and the number of entries in memory.
+        """
+
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': ((self.hits + self.disk_hits) / lookups
+                             if lookups else 0.0),
+                'size': len(self.entries),
+                'max_size': self.max_size}
+
+    def save_metrics(self, filepath):
+        with open(filepath, 'w') as f:
+            json.dump(self.metrics(), f, indent=2)
+
+
+def cached_predict(cache, checkpoint_id, x_text, predict):
+    """
+    Score cleaned sentences, running the CNN only on the sentences missing
+    from the cache (each missing sentence is scored once, even if it appears
+    several times in x_text).
+    :param cache: PredictionCache or None to disable the cache.
+    :param checkpoint_id: Identifier of the checkpoint of the CNN, usually
+    the path returned by tf.train.latest_checkpoint.
+    :type checkpoint_id: string
+    :param x_text: Sentences cleaned with preprocessing.clean_str.
+    :type x_text: list
+    :param predict: Function which scores a list of cleaned sentences and
+    returns predictions and probabilities arrays.
+    :return: predictions (int array of shape [n]) and probabilities (float
+    array of shape [n, num_classes]).
+    """
+
+    if cache is None or not x_text:
+        return predict(x_text)
+
+    results = [cache.get(checkpoint_id, text) for text in x_text]
+
+    # Unique sentences to give to the CNN
+    missing_texts = list(collections.OrderedDict.fromkeys(
+            text for text, result in zip(x_text, results) if result is None))
+
+    if missing_texts:
+        predictions, probabilities = predict(missing_texts)
+        computed = {}
+        for text, prediction, probability in zip(missing_texts, predictions,
+                                                 probabilities):
+            cache.put(checkpoint_id, text, prediction, probability)
+            computed[text] = (int(prediction), probability)
+        cache.commit()
+        results = [result if result is not None else computed[text]
+                   for text, result in zip(x_text, results)]
+
+    return (np.array([prediction for prediction, _ in results]),
+            np.array([probability for _, probability in results]))
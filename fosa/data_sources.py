@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+"""
+Common interface of the datasets supported by the project : mrpolarity,
+20newsgroup, localdata and semeval (see the 'config.yml' file).
+
+Each source yields its (text, label) examples lazily, or by batches whose
+texts go through the same cleaning stage (preprocessing.cached_clean_str).
+Hence the training and prediction pipelines read any source in the same
+way, without building the intermediate lists of the former loaders.
+"""
+
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+
+# Project modules
+import preprocessing as pp
+import domains as dm
+
+# Sources
+# ==================================================
+
+
+class DataSource(object):
+    """
+    Base class of the sources. A subclass defines target_names and
+    iter_examples.
+    """
+
+    target_names = []
+    multilabel = False
+
+    def iter_examples(self):
+        """
+        Generate the examples of the source.
+        :return: Iterator of (text, label) where the text is not cleaned and
+        the label is the id of the class (or the list of the ids of the
+        classes in multi-label mode).
+        """
+
+        raise NotImplementedError
+
+    def iter_batches(self, batch_size=1000, clean=True):
+        """
+        Generate the examples of the source by batches.
+        :param clean: If True, the texts are cleaned by
+        preprocessing.cached_clean_str.
+        :return: Iterator of (texts, labels) lists of at most batch_size
+        examples.
+        """
+
+        texts = []
+        labels = []
+        for text, label in self.iter_examples():
+            texts.append(pp.cached_clean_str(text) if clean else text)
+            labels.append(label)
+            if len(texts) == batch_size:
+                yield texts, labels
+                texts = []
+                labels = []
+        if texts:
+            yield texts, labels
+
+    def load(self):
+        """
+        Read the whole source in the dictionary returned by the former
+        loaders of preprocessing.py.
+        :return: Dictionary with the keys data, target and target_names.
+        """
+
+        data = []
+        target = []
+        for text, label in self.iter_examples():
+            data.append(text)
+            target.append(label)
+        return {'data': data, 'target': target,
+                'target_names': list(self.target_names)}
+
+
+class MRPolaritySource(DataSource):
+    """
+    MR polarity data : one sentence per line in a file of positive examples
+    and a file of negative examples.
+    """
+
+    target_names = ['positive_examples', 'negative_examples']
+
+    def __init__(self, positive_data_file, negative_data_file):
+        self.filepaths = [positive_data_file, negative_data_file]
+
+    def iter_examples(self):
+        for label, filepath in enumerate(self.filepaths):
+            with open(filepath, "r") as f:
+                for line in f:
+                    yield line.strip(), label
+
+
+class NewsgroupSource(DataSource):
+    """
+    20 newsgroups dataset, downloaded and cached by scikit-learn.
+    """
+
+    def __init__(self, subset='train', categories=None, shuffle=True,
+                 random_state=42):
+        self.datasets = pp.get_datasets_20newsgroup(subset, categories,
+                                                    shuffle, random_state)
+        self.target_names = list(self.datasets.target_names)
+
+    def iter_examples(self):
+        return zip(self.datasets.data, self.datasets.target.tolist())
+
+
+class LocalDataSource(DataSource):
+    """
+    Text files with categories as subfolder names (see
+    sklearn.datasets.load_files). The files are only read when their example
+    is generated.
+    """
+
+    def __init__(self, container_path, categories=None, encoding='utf-8',
+                 shuffle=True, random_state=42, decode_error='replace'):
+        self.encoding = encoding
+        self.decode_error = decode_error
+        self.target_names = sorted(
+                folder for folder in os.listdir(container_path)
+                if os.path.isdir(os.path.join(container_path, folder)) and
+                (not categories or folder in categories))
+
+        self.filepaths = []
+        self.target = []
+        for label, folder in enumerate(self.target_names):
+            folder_path = os.path.join(container_path, folder)
+            for filename in sorted(os.listdir(folder_path)):
+                self.filepaths.append(os.path.join(folder_path, filename))
+                self.target.append(label)
+
+        if shuffle:
+            indices = np.arange(len(self.filepaths))
+            np.random.RandomState(random_state).shuffle(indices)
+            self.filepaths = [self.filepaths[i] for i in indices]
+            self.target = [self.target[i] for i in indices]
+
+    def iter_examples(self):
+        for filepath, label in zip(self.filepaths, self.target):
+            with open(filepath, 'rb') as f:
+                yield (f.read().decode(self.encoding, self.decode_error),
+                       label)
+
+
+class SemEvalSource(DataSource):
+    """
+    SemEval 2016 dataset (Task 5, Subtask 1), read in one streaming pass.
+    The examples are the same as the ones of
+    preprocessing.get_dataset_semeval : one example per distinct
+    (sentence, label) pair, or one example per distinct sentence in
+    multi-label mode.
+    """
+
+    def __init__(self, filepath, focus='polarity', aspects=False,
+                 multilabel=False, domain=None):
+        """
+        :param filepath: Path of the dataset SemEval.
+        :param focus: 'feature' or 'polarity'.
+        :param domain: Domain of the dataset. Default : the registered
+        domain of filepath.
+        """
+
+        self.filepath = filepath
+        self.focus = focus
+        self.domain = domain or dm.get_domain_of_file(filepath)
+        self.aspects = self.domain.uses_aspects(aspects)
+        self.labels = self.domain.labels(focus, self.aspects)
+        self.aliases = self.domain.simplify if focus == 'feature' else {}
+        self.multilabel = multilabel
+        self.target_names = list(self.labels.names)
+
+    def iter_sentences(self):
+        """
+        Generate the sentences of the XML file with the ids of their labels
+        (the labels which are not studied in this scope are left out).
+        :return: Iterator of (text, list of label ids).
+        """
+
+        root = None
+        for event, element in ET.iterparse(self.filepath,
+                                           events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                continue
+
+            if element.tag == 'sentence':
+                label_ids = []
+                for opinion in element.iterfind('./Opinions/Opinion'):
+                    if self.focus == 'feature':
+                        label = opinion.get('category')
+                        if not self.aspects:
+                            label = label.split('#')[0]
+                    else:
+                        label = opinion.get('polarity')
+                    label_id = self.labels.index.get(
+                            self.aliases.get(label, label), -1)
+                    if label_id >= 0:
+                        label_ids.append(label_id)
+                yield element.findtext('text'), label_ids
+                element.clear()
+            elif element.tag == 'Review':
+                root.clear()
+
+    def iter_examples(self):
+        if self.multilabel:
+            # A sentence can appear several times in the file : its labels
+            # are gathered before it is generated
+            sentences = {}
+            for text, label_ids in self.iter_sentences():
+                labels = sentences.setdefault(text, []) if label_ids else None
+                for label_id in label_ids:
+                    if label_id not in labels:
+                        labels.append(label_id)
+            for text, labels in sentences.items():
+                yield text, labels
+            return
+
+        seen = set()
+        for text, label_ids in self.iter_sentences():
+            for label_id in label_ids:
+                if (text, label_id) not in seen:
+                    seen.add((text, label_id))
+                    yield text, label_id
+
+
+# Registry
+# ==================================================
+
+
+def _mrpolarity(parameters, split, focus, aspects, multilabel):
+    return MRPolaritySource(parameters["positive_data_file"]["path"],
+                            parameters["negative_data_file"]["path"])
+
+
+def _20newsgroup(parameters, split, focus, aspects, multilabel):
+    return NewsgroupSource(split, parameters["categories"],
+                           parameters["shuffle"], parameters["random_state"])
+
+
+def _localdata(parameters, split, focus, aspects, multilabel):
+    container_path = parameters["container_path"]
+    if split == 'test':
+        container_path = parameters["test_path"]
+    return LocalDataSource(container_path, parameters["categories"],
+                           shuffle=parameters["shuffle"],
+                           random_state=parameters["random_state"])
+
+
+def _semeval(parameters, split, focus, aspects, multilabel):
+    domain = dm.get_domain(parameters["current_domain"])
+    filepath = domain.test_path if split == 'test' else domain.train_path
+    return SemEvalSource(filepath, focus, aspects, multilabel, domain)
+
+
+SOURCES = {
+    'mrpolarity': _mrpolarity,
+    '20newsgroup': _20newsgroup,
+    'localdata': _localdata,
+    'semeval': _semeval,
+}
+
+
+def register_source(name, factory):
+    """
+    Add a kind of dataset which can be selected in the 'config.yml' file.
+    :param factory: Function (parameters, split, focus, aspects, multilabel)
+    -> DataSource, where parameters is the section of the dataset in the
+    'config.yml' file.
+    """
+
+    SOURCES[name] = factory
+
+
+def get_source(config_file, split='train', focus='polarity', aspects=False,
+               multilabel=False):
+    """
+    Source of the dataset selected by datasets > default in the 'config.yml'
+    file.
+    :param config_file: The configuration file of the project opened with yaml
+    library.
+    :param split: 'train' or 'test'.
+    :param focus: 'feature' or 'polarity' (only used by semeval).
+    :return: DataSource
+    """
+
+    dataset_name = config_file["datasets"]["default"]
+    if dataset_name not in SOURCES:
+        raise ValueError("The 'default' dataset in the 'config.yml' file " +
+                         "must be one of : " + ", ".join(sorted(SOURCES)))
+    if dataset_name == 'semeval':
+        dm.register_config_domains(config_file)
+    return SOURCES[dataset_name](config_file["datasets"][dataset_name],
+                                 split, focus, aspects, multilabel)
+
+
+def load_data_and_labels(source, batch_size=1000):
+    """
+    Read a source by batches into the cleaned texts and the labels of the
+    CNNs (see preprocessing.load_data_and_labels).
+    :return: [x_text, y]
+    """
+
+    x_text = []
+    labels = []
+    for texts, batch_labels in source.iter_batches(batch_size):
+        x_text.extend(texts)
+        labels.extend(batch_labels)
+
+    y = pp.build_labels(labels, len(source.target_names), source.multilabel)
+    return [x_text, y]
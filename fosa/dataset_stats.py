@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+"""
+Statistics of the SemEval 2016 datasets (Task 5, Subtask 1).
+
+The counters (features, polarities, combinations of both and number of
+opinions per sentence) are computed in one streaming pass per XML file, at
+the entity level (E) and at the aspect level (E#A) at the same time. They are
+stored next to the data in a JSON file, and only the files which are new or
+have changed since the last pass are parsed again.
+"""
+
+import collections
+import json
+import os
+import xml.etree.ElementTree as ET
+
+# Constants
+# ==================================================
+
+STATS_FILE = 'fosa_stats.json'
+STATS_VERSION = 1
+LEVELS = ['entity', 'aspect']
+COUNTERS = ['feature', 'polarity', 'combination', 'opinions_per_sentence']
+
+
+def empty_counters():
+    return {level: {name: collections.Counter() for name in COUNTERS}
+            for level in LEVELS}
+
+
+def count_opinions(counters, opinions):
+    """
+    Add the opinions of one sentence to the counters of one level.
+    :param opinions: Set of (feature, polarity) pairs of the sentence.
+    """
+
+    if not opinions:
+        return
+    counters['opinions_per_sentence'][len(opinions)] += 1
+    for feature, polarity in opinions:
+        counters['feature'][feature] += 1
+        counters['polarity'][polarity] += 1
+        counters['combination'][(feature, polarity)] += 1
+
+
+def compute_file_statistics(filepath):
+    """
+    Count the opinions of a SemEval XML file in one streaming pass.
+
+    As in analysis.py, opinions which only differ by their target are
+    counted once (the scope of this study does not imply targets).
+    :param filepath: Path of the XML file.
+    :type filepath: string
+    :return: Counters of each level (see empty_counters).
+    """
+
+    counters = empty_counters()
+
+    root = None
+    aspect_opinions = set()
+    for event, element in ET.iterparse(filepath, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            elif element.tag == 'sentence':
+                aspect_opinions = set()
+            continue
+
+        if element.tag == 'Opinion':
+            aspect_opinions.add((element.get('category'),
+                                 element.get('polarity')))
+        elif element.tag == 'sentence':
+            entity_opinions = set((category.split('#')[0], polarity)
+                                  for category, polarity in aspect_opinions)
+            count_opinions(counters['aspect'], aspect_opinions)
+            count_opinions(counters['entity'], entity_opinions)
+            element.clear()
+        elif element.tag == 'Review':
+            root.clear()
+
+    return counters
+
+
+def count_dataframe(data):
+    """
+    Counters of one level for a DataFrame parsed by preprocessing.parse_XML.
+    """
+
+    data = data.drop_duplicates()
+    counters = {name: collections.Counter() for name in COUNTERS}
+    counters['feature'].update(data['feature'])
+    counters['polarity'].update(data['polarity'])
+    counters['combination'].update(zip(data['feature'], data['polarity']))
+    counters['opinions_per_sentence'].update(
+            data['sentence_id'].value_counts().values.tolist())
+    return counters
+
+
+def merge_counters(all_counters):
+    """
+    Sum the counters of several files.
+    """
+
+    merged = empty_counters()
+    for counters in all_counters:
+        for level in LEVELS:
+            for name in COUNTERS:
+                merged[level][name].update(counters[level][name])
+    return merged
+
+
+def _to_json(counters):
+    return {level: {
+                'feature': dict(counters[level]['feature']),
+                'polarity': dict(counters[level]['polarity']),
+                'combination': [[feature, polarity, count] for
+                                (feature, polarity), count in
+                                counters[level]['combination'].items()],
+                'opinions_per_sentence': {
+                        str(number): count for number, count in
+                        counters[level]['opinions_per_sentence'].items()}}
+            for level in LEVELS}
+
+
+def _from_json(data):
+    counters = empty_counters()
+    for level in LEVELS:
+        counters[level]['feature'].update(data[level]['feature'])
+        counters[level]['polarity'].update(data[level]['polarity'])
+        for feature, polarity, count in data[level]['combination']:
+            counters[level]['combination'][(feature, polarity)] = count
+        for number, count in data[level]['opinions_per_sentence'].items():
+            counters[level]['opinions_per_sentence'][int(number)] = count
+    return counters
+
+
+class DatasetStatistics(object):
+    """
+    Statistics of the XML files of a folder, persisted in STATS_FILE inside
+    the folder.
+    """
+
+    def __init__(self, folder):
+        """
+        :param folder: Folder containing the XML files.
+        :type folder: string
+        """
+
+        self.stats_path = os.path.join(folder, STATS_FILE)
+        self.files = {}
+        if os.path.exists(self.stats_path):
+            with open(self.stats_path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == STATS_VERSION:
+                self.files = data['files']
+
+    def update(self, filepaths):
+        """
+        Parse the files which are not counted yet or which have changed
+        since they were counted, and save the statistics.
+        :return: Names of the files which have been parsed.
+        """
+
+        parsed = []
+        for filepath in filepaths:
+            name = os.path.basename(filepath)
+            status = os.stat(filepath)
+            entry = self.files.get(name)
+            if (entry is not None and entry['size'] == status.st_size and
+                    entry['mtime'] == status.st_mtime):
+                continue
+            self.files[name] = {
+                    'size': status.st_size,
+                    'mtime': status.st_mtime,
+                    'counters': _to_json(compute_file_statistics(filepath))}
+            parsed.append(name)
+
+        if parsed:
+            self.save()
+        return parsed
+
+    def save(self):
+        with open(self.stats_path, 'w') as f:
+            json.dump({'version': STATS_VERSION, 'files': self.files}, f)
+
+    def counters(self, names=None):
+        """
+        :param names: Names of the files to take into account. Default : all
+        the files counted in the folder.
+        :return: Sum of the counters of the files (see empty_counters).
+        """
+
+        if names is None:
+            names = list(self.files.keys())
+        return merge_counters(_from_json(self.files[name]['counters'])
+                              for name in names)
+
+
+def file_statistics(filepath, level='entity'):
+    """
+    Counters of one XML file, read from the statistics stored next to it and
+    updated first if needed.
+    :param level: 'entity' or 'aspect'.
+    :type level: string
+    """
+
+    statistics = DatasetStatistics(os.path.dirname(filepath))
+    statistics.update([filepath])
+    return statistics.counters([os.path.basename(filepath)])[level]
+
+
+def folder_statistics(folder, level='entity'):
+    """
+    Counters of all the XML files of a folder. New review files added to the
+    folder are parsed, the others are read from the stored statistics.
+    """
+
+    filepaths = sorted(os.path.join(folder, name)
+                       for name in os.listdir(folder)
+                       if name.endswith('.xml'))
+    statistics = DatasetStatistics(folder)
+    statistics.update(filepaths)
+    return statistics.counters(
+            [os.path.basename(filepath) for filepath in filepaths])[level]
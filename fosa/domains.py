@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+"""
+Domains of the SemEval 2016 competition (Task 5, Subtask 1) and their labels.
+
+Each domain gathers its dataset files and the label encoders of its features
+(entities, and aspects when they are studied) and of the polarities. The
+encoders are built once : they hold the label -> id mapping and the array of
+the labels, so that the labels of a whole dataset are encoded and decoded
+with array operations. The combinations feature x polarity used to measure
+the whole algorithm are precomputed in the same way.
+
+The RESTAURANT and LAPTOP domains are registered by default. Other domains
+can be declared in the 'config.yml' file (see register_config_domains).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+# Constants
+# ==================================================
+
+SEMEVAL_FOLDER = '../data/SemEval/Subtask1'
+RESTAURANT_TRAIN = os.path.join(SEMEVAL_FOLDER, 'restaurant', 'train.xml')
+RESTAURANT_TEST = os.path.join(SEMEVAL_FOLDER, 'restaurant', 'test',
+                               'test_gold.xml')
+LAPTOP_TRAIN = os.path.join(SEMEVAL_FOLDER, 'laptop', 'train.xml')
+LAPTOP_TEST = os.path.join(SEMEVAL_FOLDER, 'laptop', 'test', 'test_gold.xml')
+RESTAURANT_ENTITIES = ['FOOD', 'DRINKS', 'SERVICE', 'RESTAURANT', 'AMBIENCE',
+                       'LOCATION']
+LAPTOP_ENTITIES = ['LAPTOP', 'HARDWARE', 'SHIPPING', 'COMPANY', 'SUPPORT',
+                   'SOFTWARE']
+# The following entities will be simplified as HARDWARE entity
+HARDWARE = ['DISPLAY', 'CPU', 'MOTHERBOARD', 'HARD_DISC', 'MEMORY', 'BATTERY',
+            'POWER_SUPPLY', 'KEYBOARD', 'MOUSE', 'FANS_COOLING',
+            'OPTICAL_DRIVES', 'PORTS', 'GRAPHICS', 'MULTIMEDIA_DEVICES']
+POLARITY = ['positive', 'neutral', 'negative']
+# Define aspects (only for restaurant domain)
+RESTAURANT_ASPECTS = [
+        'RESTAURANT#GENERAL', 'RESTAURANT#PRICES', 'RESTAURANT#MISCELLANEOUS',
+        'FOOD#PRICES', 'FOOD#QUALITY', 'FOOD#STYLE_OPTIONS',
+        'DRINKS#PRICES', 'DRINKS#QUALITY', 'DRINKS#STYLE_OPTIONS',
+        'AMBIENCE#GENERAL', 'SERVICE#GENERAL', 'LOCATION#GENERAL']
+
+# Classes
+# ==================================================
+
+
+class LabelEncoder(object):
+    """
+    Immutable encoder between labels and their ids (position in the output
+    layer of a CNN).
+    """
+
+    __slots__ = ('names', 'index', 'names_array')
+
+    def __init__(self, names):
+        """
+        :param names: Labels, in the order of their ids.
+        :type names: list
+        """
+
+        if len(set(names)) != len(names):
+            raise ValueError("Labels must be unique : {}".format(names))
+
+        names_array = np.array(names, dtype=object)
+        names_array.flags.writeable = False
+        object.__setattr__(self, 'names', tuple(names))
+        object.__setattr__(self, 'index',
+                           {name: i for i, name in enumerate(names)})
+        object.__setattr__(self, 'names_array', names_array)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("LabelEncoder is immutable")
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return "LabelEncoder({})".format(list(self.names))
+
+    def encode(self, labels, aliases=None):
+        """
+        Ids of a sequence of labels. The labels are converted to categorical
+        codes, so that the lookup is only done once per distinct label.
+        :param aliases: Dictionary label -> label of the labels renamed before
+        the lookup (see Domain.simplify).
+        :return: Array of int32, where the labels which are not known by the
+        encoder are -1.
+        """
+
+        categorical = pd.Categorical(labels)
+        aliases = aliases or {}
+        # The last id is the one of the missing values (code -1)
+        ids = np.array([self.index.get(aliases.get(label, label), -1)
+                        for label in categorical.categories] + [-1],
+                       dtype=np.int32)
+        return ids[categorical.codes]
+
+    def decode(self, ids):
+        """
+        Labels of a sequence of ids.
+        :return: Array of the labels.
+        """
+
+        return self.names_array[np.asarray(ids, dtype=np.intp)]
+
+
+class CombinationEncoder(object):
+    """
+    Immutable encoder of the combinations feature x polarity, used to measure
+    the whole algorithm. The class of (feature i, polarity j) is
+    i * number of polarities + j : FOOD, positive is 0, FOOD, neutral is
+    1...etc...
+    """
+
+    __slots__ = ('features', 'polarities', 'classes', 'names')
+
+    def __init__(self, features, polarities):
+        """
+        :param features: LabelEncoder of the features.
+        :param polarities: LabelEncoder of the polarities.
+        """
+
+        classes = np.arange(len(features) * len(polarities),
+                            dtype=np.int32).reshape(len(features),
+                                                    len(polarities))
+        classes.flags.writeable = False
+        object.__setattr__(self, 'features', features)
+        object.__setattr__(self, 'polarities', polarities)
+        object.__setattr__(self, 'classes', classes)
+        object.__setattr__(self, 'names', tuple(
+                "{} - {}".format(feature, polarity)
+                for feature in features.names
+                for polarity in polarities.names))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CombinationEncoder is immutable")
+
+    def __len__(self):
+        return len(self.names)
+
+    def encode(self, features, polarities):
+        """
+        Classes of the pairs (features[k], polarities[k]).
+        :return: Array of int32, -1 if the feature or the polarity is unknown.
+        """
+
+        feature_ids = self.features.encode(features)
+        polarity_ids = self.polarities.encode(polarities)
+        return np.where((feature_ids >= 0) & (polarity_ids >= 0),
+                        feature_ids * len(self.polarities) + polarity_ids,
+                        -1).astype(np.int32)
+
+
+class Domain(object):
+    """
+    A domain of the SemEval competition : its dataset files and its labels.
+    """
+
+    def __init__(self, name, train_path, test_path, entities, aspects=None,
+                 simplify=None, polarities=POLARITY):
+        """
+        :param name: Name of the domain, as written in the 'config.yml' file.
+        :param train_path: Path of the training dataset.
+        :param test_path: Path of the test dataset.
+        :param entities: Entities studied in the domain.
+        :param aspects: Aspects (E#A) studied when the scope is widened to
+        aspects. Default : None, the domain is only studied with entities.
+        :param simplify: Dictionary entity -> entity of the entities renamed
+        before the selection (see HARDWARE).
+        :param polarities: Polarities of the opinions.
+        """
+
+        self.name = name
+        self.train_path = train_path
+        self.test_path = test_path
+        self.entities = LabelEncoder(entities)
+        self.aspects = LabelEncoder(aspects) if aspects else None
+        self.simplify = dict(simplify or {})
+        self.polarities = LabelEncoder(polarities)
+        self._combinations = {
+                False: CombinationEncoder(self.entities, self.polarities)}
+        if self.aspects is not None:
+            self._combinations[True] = CombinationEncoder(self.aspects,
+                                                          self.polarities)
+
+    def __repr__(self):
+        return "Domain({})".format(self.name)
+
+    def uses_aspects(self, aspects):
+        """
+        :return: True if the scope is widened to aspects and the domain
+        defines aspects.
+        """
+
+        return bool(aspects) and self.aspects is not None
+
+    def features(self, aspects=False):
+        """
+        :return: LabelEncoder of the features (aspects or entities).
+        """
+
+        return self.aspects if self.uses_aspects(aspects) else self.entities
+
+    def labels(self, focus, aspects=False):
+        """
+        :param focus: 'feature' or 'polarity'.
+        :return: LabelEncoder of the outputs of the CNN of the focus.
+        """
+
+        if focus == 'polarity':
+            return self.polarities
+        elif focus == 'feature':
+            return self.features(aspects)
+        else:
+            raise ValueError("'focus' parameter must be 'feature' or " +
+                             "'polarity'")
+
+    def combinations(self, aspects=False):
+        """
+        :return: CombinationEncoder of the features and the polarities.
+        """
+
+        return self._combinations[self.uses_aspects(aspects)]
+
+
+# Registry
+# ==================================================
+
+DOMAINS = {}
+
+
+def register_domain(domain):
+    """
+    Add a domain to the registry, replacing any domain of the same name.
+    """
+
+    DOMAINS[domain.name] = domain
+    return domain
+
+
+def register_config_domains(config_file):
+    """
+    Register the domains declared in the 'config.yml' file, under
+    datasets > semeval > domains. Each domain is declared by its name with
+    the keys train, test, entities and optionally aspects and simplify.
+    :param config_file: The configuration file of the project opened with yaml
+    library.
+    """
+
+    semeval = config_file["datasets"].get("semeval") or {}
+    for name, declaration in (semeval.get("domains") or {}).items():
+        register_domain(Domain(name, declaration['train'],
+                               declaration['test'],
+                               declaration['entities'],
+                               declaration.get('aspects'),
+                               declaration.get('simplify')))
+
+
+def get_domain(name):
+    """
+    :return: The registered domain of this name.
+    """
+
+    try:
+        return DOMAINS[name]
+    except KeyError:
+        raise ValueError("The 'current_domain' parameter in the " +
+                         "'config.yml' file must be one of : " +
+                         ", ".join("'{}'".format(name) for name in
+                                   sorted(DOMAINS)))
+
+
+def get_current_domain(config_file):
+    """
+    :param config_file: The configuration file of the project opened with yaml
+    library.
+    :return: The domain selected by 'current_domain' in the 'config.yml' file.
+    """
+
+    register_config_domains(config_file)
+    dataset_name = config_file["datasets"]["default"]
+    return get_domain(config_file["datasets"][dataset_name]["current_domain"])
+
+
+def get_domain_of_file(filepath):
+    """
+    :return: The registered domain whose training or test dataset is filepath.
+    """
+
+    for domain in DOMAINS.values():
+        if filepath in (domain.train_path, domain.test_path):
+            return domain
+    raise ValueError("'filepath' parameter must be the training or test " +
+                     "dataset of a domain : 'RESTAURANT_TRAIN', " +
+                     "'RESTAURANT_TEST', 'LAPTOP_TRAIN', 'LAPTOP_TEST'...")
+
+
+RESTAURANT = register_domain(Domain(
+        'RESTAURANT', RESTAURANT_TRAIN, RESTAURANT_TEST, RESTAURANT_ENTITIES,
+        aspects=RESTAURANT_ASPECTS))
+LAPTOP = register_domain(Domain(
+        'LAPTOP', LAPTOP_TRAIN, LAPTOP_TEST, LAPTOP_ENTITIES,
+        simplify={entity: 'HARDWARE' for entity in HARDWARE}))
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+"""
+Decisions over the outputs of the CNNs (softmax, sigmoid, multi-label
+selection) and measures of their effectiveness.
+
+The confusion matrix is computed once with a single np.bincount and the
+precision, recall, F1-score and support of each class are derived from it.
+The resulting dictionary is read by the logs, the charts (see analysis.py)
+and the CSV files, instead of parsing the text of
+sklearn.metrics.classification_report.
+"""
+
+import csv
+import numpy as np
+
+# Constants
+# ==================================================
+
+AVERAGE_NAME = 'avg / total'
+
+# Decisions over the outputs of the CNNs
+# ==================================================
+
+
+def softmax(x):
+    """Compute softmax values for each sets of scores in x."""
+    if x.ndim == 1:
+        x = x.reshape((1, -1))
+    max_x = np.max(x, axis=1).reshape((-1, 1))
+    exp_x = np.exp(x - max_x)
+    return exp_x / np.sum(exp_x, axis=1).reshape((-1, 1))
+
+
+def sigmoid(x):
+    """Compute sigmoid values for each sets of scores in x."""
+    if x.ndim == 1:
+        x = x.reshape((1, -1))
+    return 1 / (1 + np.exp(-x))
+
+
+def select_labels(probabilities, threshold=0.5, top_k=None):
+    """
+    Multi-label decision over the outputs of a CNN : for each sentence, keep
+    the classes among the top_k most probable ones whose probability reaches
+    the threshold. The most probable class is always kept so that each
+    sentence has at least one class.
+    :param probabilities: Array of shape [n, num_classes].
+    :param threshold: Minimal probability of a class to be kept.
+    :type threshold: float
+    :param top_k: Maximal number of classes kept for a sentence. Default :
+    no limit.
+    :type top_k: int
+    :return: List of n lists of classes, sorted by decreasing probability.
+    """
+
+    order = np.argsort(-probabilities, axis=1)[:, :top_k]
+    return [[int(j) for j in row if probabilities[i, j] >= threshold] or
+            [int(row[0])] for i, row in enumerate(order)]
+
+
+# Measures
+# ==================================================
+
+
+def _divide(numerator, denominator):
+    """
+    Element-wise division where x / 0 = 0.
+    """
+
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    result = np.zeros(numerator.shape)
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return result
+
+
+def classification_metrics(y, y_pred, target_names):
+    """
+    Compute the measures of a classification.
+    :param y: Actual classes. Either an int array of shape [n], where the
+    unknown classes are -1, or, for a multi-label classification, a
+    multi-hot array of shape [n, num_classes].
+    :param y_pred: Predicted classes, same shape as y.
+    :param target_names: Names of the classes.
+    :type target_names: list
+    :return: Dictionary with the keys target_names, confusion_matrix (None
+    for a multi-label classification), precision, recall, f1, support,
+    predicted (arrays of shape [num_classes]), accuracy and average
+    (dictionary of the averages weighted by the support).
+    """
+
+    num_classes = len(target_names)
+    y = np.asarray(y, dtype=np.int64)
+    y_pred = np.asarray(y_pred, dtype=np.int64)
+
+    if y.ndim == 1:
+        if (y >= num_classes).any() or (y_pred >= num_classes).any():
+            raise ValueError("The classes must be lower than the number of "
+                             "target names ({})".format(num_classes))
+        # Unknown classes are -1 (see domains.LabelEncoder.encode) : the
+        # examples whose actual class is unknown are ignored and an unknown
+        # predicted class is an error which belongs to no column of the
+        # confusion matrix
+        y_pred = y_pred[y >= 0]
+        y = y[y >= 0]
+        known = y_pred >= 0
+        confusion_matrix = np.bincount(
+                y[known] * num_classes + y_pred[known],
+                minlength=num_classes * num_classes).reshape(
+                        num_classes, num_classes)
+        true_positives = np.diag(confusion_matrix)
+        support = np.bincount(y, minlength=num_classes)
+        predicted = confusion_matrix.sum(axis=0)
+        accuracy = _divide(true_positives.sum(), len(y))
+    else:
+        # Multi-label : each class is a separate binary classification and a
+        # sentence is correct if its whole set of classes is found
+        confusion_matrix = None
+        true_positives = (y & y_pred).sum(axis=0)
+        support = y.sum(axis=0)
+        predicted = y_pred.sum(axis=0)
+        accuracy = _divide(np.all(y == y_pred, axis=1).sum(), len(y))
+
+    precision = _divide(true_positives, predicted)
+    recall = _divide(true_positives, support)
+    f1 = _divide(2 * precision * recall, precision + recall)
+
+    total = support.sum()
+    average = {'precision': float(_divide((precision * support).sum(), total)),
+               'recall': float(_divide((recall * support).sum(), total)),
+               'f1': float(_divide((f1 * support).sum(), total)),
+               'support': int(total)}
+
+    return {'target_names': list(target_names),
+            'confusion_matrix': confusion_matrix,
+            'precision': precision,
+            'recall': recall,
+            'f1': f1,
+            'support': support,
+            'predicted': predicted,
+            'accuracy': float(accuracy),
+            'average': average}
+
+
+def format_report(metrics, digits=2):
+    """
+    Text report of the measures, laid out like
+    sklearn.metrics.classification_report.
+    """
+
+    width = max(len(name) for name in
+                metrics['target_names'] + [AVERAGE_NAME])
+    header = "{:>{width}} {:>9} {:>9} {:>9} {:>9}".format(
+            "", "precision", "recall", "f1-score", "support", width=width)
+    row = "{:>{width}} {:>9.{digits}f} {:>9.{digits}f} {:>9.{digits}f} {:>9}"
+
+    lines = [header, ""]
+    for i, name in enumerate(metrics['target_names']):
+        lines.append(row.format(name, metrics['precision'][i],
+                                metrics['recall'][i], metrics['f1'][i],
+                                int(metrics['support'][i]), width=width,
+                                digits=digits))
+    lines.append("")
+    average = metrics['average']
+    lines.append(row.format(AVERAGE_NAME, average['precision'],
+                            average['recall'], average['f1'],
+                            average['support'], width=width, digits=digits))
+    return "\n".join(lines) + "\n"
+
+
+def save_metrics(metrics, filepath):
+    """
+    Save the measures of each class, and their average, into a CSV file.
+    """
+
+    with open(filepath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['class', 'precision', 'recall', 'f1-score',
+                         'support'])
+        for i, name in enumerate(metrics['target_names']):
+            writer.writerow([name, metrics['precision'][i],
+                             metrics['recall'][i], metrics['f1'][i],
+                             int(metrics['support'][i])])
+        average = metrics['average']
+        writer.writerow([AVERAGE_NAME, average['precision'],
+                         average['recall'], average['f1'],
+                         average['support']])
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+"""
+Logging setup shared by the scripts of the project.
+
+The messages are written to a console handler and to log files : the
+shared 'log.log' file of the working directory and the log file of the run.
+The files are written by a background thread : the logger only puts the
+records into a queue (see logging.handlers.QueueHandler), so that the writes
+do not slow down the training or prediction loops.
+
+The log file of a run is only written by its process : it is bounded by a
+rotation (MAX_BYTES, BACKUP_COUNT). The shared file is written by every
+process running in the working directory at the same time : it is only
+appended to, since each process would rotate it on its own and lose the
+records of the others. It can be rotated by an external tool such as
+logrotate, the processes then reopen it (see
+logging.handlers.WatchedFileHandler).
+
+The dumps of whole data arrays are logged by the DATA_LOGGER logger, which
+is disabled unless setup_logging is called with log_data=True. They must be
+guarded with data_enabled(), so that the arrays are not even formatted when
+they are not logged.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Constants
+# ==================================================
+
+# Log file shared by all the runs, in the working directory
+SHARED_LOG_FILE = 'log.log'
+
+# Rotation of the log files of the runs : size of a file and number of old
+# files kept
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+FORMAT = "%(message)s"
+
+# Logger of the dumps of data arrays
+DATA_LOGGER = 'fosa.data'
+
+# Handlers added and queue listeners started by setup_logging
+_handlers = []
+_listeners = []
+
+# Functions
+# ==================================================
+
+
+def _file_handler(handler_class, filepath, level, **kwargs):
+    folder = os.path.dirname(filepath)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    handler = handler_class(filepath, **kwargs)
+    handler.setLevel(level)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    return handler
+
+
+def rotating_file_handler(filepath, level=logging.DEBUG, max_bytes=MAX_BYTES,
+                          backup_count=BACKUP_COUNT):
+    """
+    :return: Handler writing into filepath, which is renamed filepath.1
+    (and so on up to backup_count) when it exceeds max_bytes. The file must
+    not be written by other processes.
+    """
+
+    return _file_handler(logging.handlers.RotatingFileHandler, filepath,
+                         level, maxBytes=max_bytes, backupCount=backup_count)
+
+
+def shared_file_handler(filepath, level=logging.DEBUG):
+    """
+    :return: Handler appending to filepath, which can be written by several
+    processes at the same time. The file is reopened when it has been
+    rotated by another program.
+    """
+
+    return _file_handler(logging.handlers.WatchedFileHandler, filepath,
+                         level)
+
+
+def setup_logging(run_log_file=None, shared_log_file=SHARED_LOG_FILE,
+                  console_stream=None, log_data=False, max_bytes=MAX_BYTES,
+                  backup_count=BACKUP_COUNT):
+    """
+    Configure the root logger : INFO messages to the console, DEBUG messages
+    to the log files through a queue.
+    :param run_log_file: Log file of the run, None for no such file.
+    :param shared_log_file: Log file shared by all the runs, None for no
+    such file.
+    :param console_stream: Stream of the console handler. Default :
+    sys.stderr.
+    :param log_data: If True, the dumps of data arrays (see DATA_LOGGER) are
+    logged.
+    :param max_bytes: Size of the log file of the run before its rotation.
+    :param backup_count: Number of old log files of the run kept.
+    :return: The root logger.
+    """
+
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+
+    console_handler = logging.StreamHandler(console_stream or sys.stderr)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter(FORMAT))
+    logger.addHandler(console_handler)
+    _handlers.append(console_handler)
+
+    file_handlers = []
+    if shared_log_file:
+        file_handlers.append(shared_file_handler(shared_log_file))
+    if run_log_file:
+        file_handlers.append(rotating_file_handler(
+                run_log_file, max_bytes=max_bytes,
+                backup_count=backup_count))
+    if file_handlers:
+        records = queue.Queue(-1)
+        queue_handler = logging.handlers.QueueHandler(records)
+        logger.addHandler(queue_handler)
+        _handlers.append(queue_handler)
+        listener = logging.handlers.QueueListener(
+                records, *file_handlers, respect_handler_level=True)
+        listener.start()
+        _listeners.append((listener, file_handlers))
+
+    logging.getLogger(DATA_LOGGER).setLevel(
+            logging.DEBUG if log_data else logging.INFO)
+    return logger
+
+
+def shutdown_logging():
+    """
+    Write the records still in the queues, close the log files and remove
+    the handlers added by setup_logging. Called at exit.
+    """
+
+    logger = logging.getLogger()
+    while _handlers:
+        logger.removeHandler(_handlers.pop())
+    while _listeners:
+        listener, file_handlers = _listeners.pop()
+        listener.stop()
+        for handler in file_handlers:
+            handler.close()
+
+
+atexit.register(shutdown_logging)
+
+
+def data_enabled():
+    """
+    :return: True if the dumps of data arrays are logged.
+    """
+
+    return logging.getLogger(DATA_LOGGER).isEnabledFor(logging.DEBUG)
+
+
+def log_data(message, *args):
+    """
+    Log a dump of data arrays. The caller should check data_enabled()
+    first when computing args is expensive.
+    """
+
+    logging.getLogger(DATA_LOGGER).debug(message, *args)
@@ -134,7 +134,6 @@ if __name__ == '__main__':
                                  "or 'LAPTOP'")
 
         x_raw, y_test = pp.load_data_and_labels(datasets)
-        y_test = np.argmax(y_test, axis=1)
         logger.debug("Total number of test examples: {}".format(len(y_test)))
     else:
         if dataset_name == "mrpolarity":
@@ -29,6 +29,7 @@ import yaml
 # Project modules
 import preprocessing as pp
 import CNN
+import logs
 
 # Constants
 # ==================================================
@@ -105,6 +106,9 @@ if __name__ == '__main__':
             "Number of checkpoints to store (default: 5)")
 
     # Misc Parameters
+    tf.flags.DEFINE_boolean(
+            "log_data", False,
+            "Log the whole data arrays in the log files (default: False)")
     tf.flags.DEFINE_boolean(
             "allow_soft_placement", True,
             "Allow device soft device placement")
@@ -120,36 +124,10 @@ if __name__ == '__main__':
     # Logger
     # ==================================================
 
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-
-    # File handler which logs even debug messages
-    file_handler = logging.FileHandler('log.log')
-    file_handler.setLevel(logging.DEBUG)
-
-    # Other file handler to store information for each run
-    if not os.path.exists(CURRENT_RUN_DIRECTORY):
-        os.makedirs(CURRENT_RUN_DIRECTORY)
-    log_directory = os.path.join(CURRENT_RUN_DIRECTORY, "train.log")
-    run_file_handler = logging.FileHandler(log_directory)
-    run_file_handler.setLevel(logging.DEBUG)
-
-    # Console handler which logs info messages
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-
-    # Create formatter and add it to the handlers
-#    formatter = logging.Formatter('%(asctime)s -- %(name)s -- %(levelname)s\n'
-#                                  '%(message)s\n')
-    formatter = logging.Formatter("%(message)s")
-    file_handler.setFormatter(formatter)
-    run_file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-
-    # Add handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(run_file_handler)
-    logger.addHandler(console_handler)
+    # Shared log file and log file of the run (see logs.py)
+    logger = logs.setup_logging(
+            os.path.join(CURRENT_RUN_DIRECTORY, "train.log"),
+            log_data=FLAGS.log_data)
 
     # Use parameters set in config file
     with open("config.yml", 'r') as ymlfile:
@@ -211,17 +189,19 @@ if __name__ == '__main__':
     vocab_processor = (learn.preprocessing.VocabularyProcessor(
             max_document_length))
     x = np.array(list(vocab_processor.fit_transform(x_text)))
-    logger.debug("Data (shape : %s):\n %s", x.shape, x)
+    if logs.data_enabled():
+        logs.log_data("Data (shape : %s):\n %s", x.shape, x)
 
     # Randomly shuffle data
     np.random.seed(10)
     shuffle_indices = np.random.permutation(np.arange(len(y)))
     x_shuffled = x[shuffle_indices]
-    logger.debug("Data shuffled (shape: %s):\n %s", x_shuffled.shape,
-                 x_shuffled)
     y_shuffled = y[shuffle_indices]
-    logger.debug("Label shuffled (shape: %s):\n %s", y_shuffled.shape,
-                 y_shuffled)
+    if logs.data_enabled():
+        logs.log_data("Data shuffled (shape: %s):\n %s", x_shuffled.shape,
+                      x_shuffled)
+        logs.log_data("Label shuffled (shape: %s):\n %s", y_shuffled.shape,
+                      y_shuffled)
 
     # Split train/test set
     # TODO: This is very crude, should use cross-validation
@@ -267,7 +247,7 @@ if __name__ == '__main__':
 
             cnn = CNN.TextCNN(
                 sequence_length=x_train.shape[1],
-                num_classes=y_train.shape[1],
+                num_classes=len(datasets['target_names']),
                 vocab_size=len(vocab_processor.vocabulary_),
                 embedding_size=embedding_dimension,
                 filter_sizes=list(map(int, FLAGS.filter_sizes.split(","))),
@@ -8,47 +8,29 @@ import tensorflow as tf
 import numpy as np
 import os
 import preprocessing as pp
+import domains as dm
+import data_sources as src
 import analysis as an
+import evaluation as ev
 from tensorflow.contrib import learn
 import csv
-from sklearn import metrics
 import pandas as pd
-import matplotlib.pyplot as plt
-from pandas_ml import ConfusionMatrix
 import yaml
-import logging
+from cache import PredictionCache, cached_predict
+from evaluation import softmax, sigmoid, select_labels
+import profiling
+import session_config as sc
+import logs
 
 # Constants
-# ============================================
-
-SEMEVAL_FOLDER = '../data/SemEval/Subtask1'
-RESTAURANT_TRAIN = os.path.join(SEMEVAL_FOLDER, 'restaurant', 'train.xml')
-RESTAURANT_TEST = os.path.join(SEMEVAL_FOLDER, 'restaurant', 'test',
-                               'test_gold.xml')
-LAPTOP_TRAIN = os.path.join(SEMEVAL_FOLDER, 'laptop', 'train.xml')
-LAPTOP_TEST = os.path.join(SEMEVAL_FOLDER, 'laptop', 'test', 'test_gold.xml')
-RESTAURANT_ENTITIES = ['FOOD', 'DRINKS', 'SERVICE', 'RESTAURANT', 'AMBIENCE',
-                       'LOCATION']
-LAPTOP_ENTITIES = ['LAPTOP', 'HARDWARE', 'SHIPPING', 'COMPANY', 'SUPPORT',
-                   'SOFTWARE']
-POLARITY = ['positive', 'neutral', 'negative']
-RESTAURANT_ASPECTS = [
-        'RESTAURANT#GENERAL', 'RESTAURANT#PRICES', 'RESTAURANT#MISCELLANEOUS',
-        'FOOD#PRICES', 'FOOD#QUALITY', 'FOOD#STYLE_OPTIONS',
-        'DRINKS#PRICES', 'DRINKS#QUALITY', 'DRINKS#STYLE_OPTIONS',
-        'AMBIENCE#GENERAL', 'SERVICE#GENERAL', 'LOCATION#GENERAL']
-
-# Functions
 # ==================================================
 
+# Separator of the features detected in a sentence, in the pred_features
+# column of predictions.csv (the names of the features have no spaces)
+PRED_FEATURES_SEPARATOR = " "
 
-def softmax(x):
-    """Compute softmax values for each sets of scores in x."""
-    if x.ndim == 1:
-        x = x.reshape((1, -1))
-    max_x = np.max(x, axis=1).reshape((-1, 1))
-    exp_x = np.exp(x - max_x)
-    return exp_x / np.sum(exp_x, axis=1).reshape((-1, 1))
+# Functions
+# ==================================================
 
 
 def prediction_process_CNN(folderpath_run, config_file, focus):
@@ -62,38 +44,35 @@ def prediction_process_CNN(folderpath_run, config_file, focus):
     folder of a CNN. It will lead to the folder 'CNN_feature' or
     'CNN_polarity'.
     :type focus: string
-    :return: datasets['data'], all_predictions, datasets['target_names'].
-    datasets['data'] are the sentences before cleaning (after cleaning it is
-    x_raw), all_predictions represents the prediction of the algorithm
-    depending on the focus and datasets['target_names'] are the labels
-    possible for the predictions.
+    :return: datasets['data'], all_predictions, datasets['target_names'],
+    class_metrics. datasets['data'] are the sentences before cleaning (after
+    cleaning it is x_raw), all_predictions represents the prediction of the
+    algorithm depending on the focus, datasets['target_names'] are the labels
+    possible for the predictions and class_metrics are the measures computed
+    by evaluation.classification_metrics. In multi-label mode, each
+    prediction is the list of the classes of the sentence.
     """
 
-    datasets = None
+    # Only CNN_feature can be a multi-label classifier (see train.py)
+    multilabel = FLAGS.multilabel and focus == 'feature'
+
+    stage = "CNN_" + focus + "/"
 
     # Load data
-    dataset_name = config_file["datasets"]["default"]
-    if dataset_name == "semeval":
-        current_domain = config_file["datasets"][dataset_name]["current_domain"]
-        if current_domain == 'RESTAURANT':
-            datasets = pp.get_dataset_semeval(RESTAURANT_TEST, focus,
-                                              FLAGS.aspects)
-        elif current_domain == 'LAPTOP':
-            datasets = pp.get_dataset_semeval(LAPTOP_TEST, focus)
-        else:
-            raise ValueError("The 'current_domain' parameter in the " +
-                             "'config.yml' file must be 'RESTAURANT' " +
-                             "or 'LAPTOP'")
-
-    x_raw, y_test = pp.load_data_and_labels(datasets)
-    y_test = np.argmax(y_test, axis=1)
+    with profiler.stage(stage + "read_data"):
+        datasets = src.get_source(config_file, 'test', focus, FLAGS.aspects,
+                                  multilabel).load()
+
+    with profiler.stage(stage + "clean_str"):
+        x_raw, y_test = pp.load_data_and_labels(datasets, multilabel)
     logger.debug("Total number of test examples: {}".format(len(y_test)))
+    profiler.count(stage + "examples", len(y_test))
 
     # Map data into vocabulary
     vocab_path = os.path.join(folderpath_run, 'CNN_' + focus, 'vocab')
-    vocab_processor = learn.preprocessing.VocabularyProcessor.restore(
-            vocab_path)
-    x_test = np.array(list(vocab_processor.transform(x_raw)))
+    with profiler.stage(stage + "restore_vocabulary"):
+        vocab_processor = learn.preprocessing.VocabularyProcessor.restore(
+                vocab_path)
 
     logger.info("")
     logger.info("Evaluation :")
@@ -108,17 +87,18 @@ def prediction_process_CNN(folderpath_run, config_file, focus):
 
     with graph.as_default():
 
-        session_conf = tf.ConfigProto(
-          allow_soft_placement=FLAGS.allow_soft_placement,
-          log_device_placement=FLAGS.log_device_placement)
+        session_conf = sc.make_session_config(
+                session_settings, FLAGS.allow_soft_placement,
+                FLAGS.log_device_placement)
         sess = tf.Session(config=session_conf)
 
         with sess.as_default():
 
             # Load the saved meta graph and restore variables
-            saver = tf.train.import_meta_graph(
-                    "{}.meta".format(checkpoint_file))
-            saver.restore(sess, checkpoint_file)
+            with profiler.stage(stage + "restore_checkpoint"):
+                saver = tf.train.import_meta_graph(
+                        "{}.meta".format(checkpoint_file))
+                saver.restore(sess, checkpoint_file)
 
             # Get the placeholders from the graph by name
             input_x = graph.get_operation_by_name("input_x").outputs[0]
@@ -133,43 +113,85 @@ def prediction_process_CNN(folderpath_run, config_file, focus):
             predictions = graph.get_operation_by_name(
                     "output/predictions").outputs[0]
 
-            # Generate batches for one epoch
-            batches = pp.batch_iter(
-                    list(x_test), FLAGS.batch_size, 1, shuffle=False)
-
-            # Collect the predictions here
-            all_predictions = []
-            all_probabilities = None
-
-            for x_test_batch in batches:
-                batch_predictions_scores = sess.run(
-                        [predictions, scores],
-                        {input_x: x_test_batch, dropout_keep_prob: 1.0})
-                all_predictions = np.concatenate(
-                        [all_predictions, batch_predictions_scores[0]])
-                probabilities = softmax(batch_predictions_scores[1])
-                if all_probabilities is not None:
-                    all_probabilities = np.concatenate(
-                            [all_probabilities, probabilities])
-                else:
-                    all_probabilities = probabilities
+            def run_CNN(x_text):
+                """
+                Score cleaned sentences with the CNN.
+                """
+
+                with profiler.stage(stage + "vocabulary_transform"):
+                    x = np.array(list(vocab_processor.transform(x_text)))
+                profiler.count(stage + "scored_sentences", len(x_text))
+
+                # Generate batches for one epoch
+                batches = pp.batch_iter(
+                        list(x), FLAGS.batch_size, 1, shuffle=False)
+
+                # Collect the predictions here
+                all_predictions = []
+                all_probabilities = None
+
+                for x_test_batch in batches:
+                    with profiler.stage(stage + "predict_step"):
+                        batch_predictions_scores = sess.run(
+                                [predictions, scores],
+                                {input_x: x_test_batch,
+                                 dropout_keep_prob: 1.0})
+                    all_predictions = np.concatenate(
+                            [all_predictions, batch_predictions_scores[0]])
+                    if multilabel:
+                        probabilities = sigmoid(batch_predictions_scores[1])
+                    else:
+                        probabilities = softmax(batch_predictions_scores[1])
+                    if all_probabilities is not None:
+                        all_probabilities = np.concatenate(
+                                [all_probabilities, probabilities])
+                    else:
+                        all_probabilities = probabilities
+
+                return all_predictions, all_probabilities
+
+            # A sentence with several opinions appears once per opinion, so
+            # only the unique sentences are scored and their outputs are
+            # broadcast back to every row. Sentences already scored by this
+            # checkpoint are read from the cache instead of being given to
+            # the CNN again.
+            unique_x_raw, inverse_indices = np.unique(x_raw,
+                                                      return_inverse=True)
+            logger.debug("Unique test sentences: {}".format(
+                    len(unique_x_raw)))
+            unique_predictions, unique_probabilities = cached_predict(
+                    cache, checkpoint_file, unique_x_raw.tolist(), run_CNN)
+            all_predictions = np.asarray(unique_predictions)[inverse_indices]
+            all_probabilities = unique_probabilities[inverse_indices]
+
+    if multilabel:
+        # Every class detected in a sentence is kept, and compared to the
+        # whole set of actual classes of the sentence
+        all_predictions = select_labels(all_probabilities, FLAGS.threshold,
+                                        FLAGS.top_k)
+        predicted_labels = np.zeros_like(y_test)
+        for i, labels in enumerate(all_predictions):
+            predicted_labels[i, labels] = 1
+    else:
+        predicted_labels = all_predictions
 
     # Print accuracy if y_test is defined
     if y_test is not None:
-        correct_predictions = float(sum(all_predictions == y_test))
+        with profiler.stage(stage + "metrics"):
+            class_metrics = ev.classification_metrics(
+                    y_test, predicted_labels, datasets['target_names'])
         logger.debug("Total number of test examples: {}".format(len(y_test)))
         logger.info("")
-        logger.info(
-                "Accuracy: {:g}".format(
-                        correct_predictions/float(len(y_test))))
+        logger.info("Accuracy: {:g}".format(class_metrics['accuracy']))
 
-        class_report = metrics.classification_report(
-                y_test, all_predictions,
-                target_names=datasets['target_names'])
-        logger.info(class_report)
+        logger.info(ev.format_report(class_metrics))
+        ev.save_metrics(class_metrics, os.path.join(
+                folderpath_run, 'CNN_' + focus, "metrics.csv"))
 
-        confusion_matrix = ConfusionMatrix(y_test, all_predictions)
-        logger.info(confusion_matrix)
+        if not multilabel:
+            logger.info(pd.DataFrame(class_metrics['confusion_matrix'],
+                                     index=datasets['target_names'],
+                                     columns=datasets['target_names']))
         logger.info("")
         str_labels = "Labels : "
         for idx, label in enumerate(datasets['target_names']):
@@ -178,9 +200,15 @@ def prediction_process_CNN(folderpath_run, config_file, focus):
         logger.info("")
 
     # Save the evaluation to a csv
+    if multilabel:
+        predictions_to_save = [" ".join(str(label) for label in labels)
+                               for labels in all_predictions]
+    else:
+        predictions_to_save = [int(prediction)
+                               for prediction in all_predictions]
     predictions_human_readable = np.column_stack(
             (np.array(x_raw),
-             [int(prediction) for prediction in all_predictions],
+             predictions_to_save,
              ["{}".format(probability) for probability in all_probabilities]))
     out_path = os.path.join(checkpoints_folder, "..", "prediction.csv")
 
@@ -190,7 +218,95 @@ def prediction_process_CNN(folderpath_run, config_file, focus):
         csv.writer(f).writerows(predictions_human_readable)
 
     return (datasets['data'], all_predictions, datasets['target_names'],
-            class_report)
+            class_metrics)
+
+
+def assemble_whole_prediction(dataframe_actual, sentences_feature,
+                              all_predictions_feature, target_names_feature,
+                              sentences_polarity, all_predictions_polarity,
+                              target_names_polarity, multilabel=False):
+    """
+    Gather the predictions of both CNNs for each opinion of the test dataset.
+    :param dataframe_actual: Opinions of the test dataset (see
+    preprocessing.parse_XML).
+    :param sentences_feature: Sentences predicted by CNN_feature (see
+    prediction_process_CNN), and likewise for its predictions and the names
+    of its classes and for CNN_polarity.
+    :param multilabel: If True, each prediction of CNN_feature is the list of
+    the classes of the sentence.
+    :return: Pandas.DataFrame with the columns review_id, sentence_id, text,
+    feature, pred_feature, pred_features, polarity, pred_polarity and check
+    (True if both the feature and the polarity are correctly predicted).
+    pred_features holds every feature detected in the sentence, separated
+    by PRED_FEATURES_SEPARATOR. In multi-label mode, pred_feature is the
+    actual feature if it has been detected, otherwise the most probable
+    detected feature.
+    """
+
+    # Index of the first occurence of each sentence in the predictions
+    index_sentences_feature = {}
+    for index_text, sentence in enumerate(sentences_feature):
+        index_sentences_feature.setdefault(sentence, index_text)
+    index_sentences_polarity = {}
+    for index_text, sentence in enumerate(sentences_polarity):
+        index_sentences_polarity.setdefault(sentence, index_text)
+
+    texts = dataframe_actual['text'].tolist()
+    features = dataframe_actual['feature'].tolist()
+
+    # Feature
+    # ==================================================
+
+    # Predictions of the sentence of each opinion
+    predictions_feature = [
+            all_predictions_feature[index_sentences_feature[text]]
+            for text in texts]
+
+    # Translate to corresponding labels
+    if multilabel:
+        all_pred_features = [[target_names_feature[label]
+                              for label in labels]
+                             for labels in predictions_feature]
+        # The opinion is found if its feature is among the features
+        # detected in the sentence
+        pred_feature = [feature if feature in pred_features
+                        else pred_features[0]
+                        for feature, pred_features in zip(features,
+                                                          all_pred_features)]
+    else:
+        pred_feature = [target_names_feature[int(prediction)]
+                        for prediction in predictions_feature]
+        all_pred_features = [[feature] for feature in pred_feature]
+
+    # Polarity
+    # ==================================================
+
+    pred_polarity = [target_names_polarity[int(
+            all_predictions_polarity[index_sentences_polarity[text]])]
+                     for text in texts]
+
+    whole_prediction = pd.DataFrame({
+            'review_id': dataframe_actual['review_id'].tolist(),
+            'sentence_id': dataframe_actual['sentence_id'].tolist(),
+            'text': texts,
+            'feature': features,
+            'pred_feature': pred_feature,
+            'pred_features': [PRED_FEATURES_SEPARATOR.join(pred_features)
+                              for pred_features in all_pred_features],
+            'polarity': dataframe_actual['polarity'].tolist(),
+            'pred_polarity': pred_polarity},
+            columns=['review_id', 'sentence_id', 'text', 'feature',
+                     'pred_feature', 'pred_features', 'polarity',
+                     'pred_polarity'])
+
+    # Add a column to check if the whole prediction is correct (feature and
+    # pred_feature must be equal AND polarity and pred_polarity must also be
+    # equal)
+    whole_prediction['check'] =\
+        ((whole_prediction.feature == whole_prediction.pred_feature) &
+         (whole_prediction.polarity == whole_prediction.pred_polarity))
+    return whole_prediction
+
 
 if __name__ == '__main__':
 
@@ -207,6 +323,14 @@ if __name__ == '__main__':
     tf.flags.DEFINE_string("checkpoint_dir", "",
                            "Checkpoint directory from training run")
 
+    # Cache Parameters
+    tf.flags.DEFINE_integer("cache_size", 100000,
+                            "Number of sentences whose outputs are kept in "
+                            "memory, 0 to disable the cache (default: 100000)")
+    tf.flags.DEFINE_string("cache_path", "",
+                           "SQLite file used as on-disk tier of the cache "
+                           "(default: no disk tier)")
+
     # Misc Parameters
     tf.flags.DEFINE_boolean("allow_soft_placement", True,
                             "Allow device soft device placement")
@@ -216,46 +340,72 @@ if __name__ == '__main__':
                             False,
                             "Scope widened to aspects and not only entities")
 
+    # Multi-label Parameters
+    tf.flags.DEFINE_boolean("multilabel",
+                            False,
+                            "CNN_feature has been trained as a multi-label "
+                            "classifier (see train.py)")
+    tf.flags.DEFINE_float("threshold", 0.5,
+                          "Minimal probability of a feature detected in a "
+                          "sentence (default: 0.5)")
+    tf.flags.DEFINE_integer("top_k", 3,
+                            "Maximal number of features detected in a "
+                            "sentence (default: 3)")
+
+    # Chart Parameters
+    tf.flags.DEFINE_string("chart_format", an.CHART_FORMAT,
+                           "Format of the charts : svg, pdf, png... "
+                           "(default: svg)")
+    tf.flags.DEFINE_integer("chart_dpi", an.CHART_DPI,
+                            "Resolution of the charts saved in a raster "
+                            "format (default: 150)")
+    tf.flags.DEFINE_integer("chart_processes", 0,
+                            "Number of processes rendering the charts, 0 to "
+                            "render them in this process (default: 0)")
+
     # Precise if predictions is on features or polarity
     tf.flags.DEFINE_string("focus", "", "'feature' or 'polarity'")
 
+    # Session Parameters (default: 'session' section of the 'config.yml' file)
+    tf.flags.DEFINE_integer("intra_op_threads", -1,
+                            "Threads of the intra-op pool, 0 to let "
+                            "TensorFlow choose (default: config.yml)")
+    tf.flags.DEFINE_integer("inter_op_threads", -1,
+                            "Threads of the inter-op pool, 0 to let "
+                            "TensorFlow choose (default: config.yml)")
+    tf.flags.DEFINE_string("cpu_affinity", None,
+                           "Cores the process is pinned to, e.g. '0-3,8' "
+                           "(default: config.yml)")
+
+    # Profiling Parameters
+    tf.flags.DEFINE_boolean("profile", True,
+                            "Measure the time spent in each stage and write "
+                            "it in prediction_timings.json inside the "
+                            "checkpoint directory")
+
     FLAGS = tf.flags.FLAGS
     FLAGS._parse_flags()
+    profiler = profiling.Profiler(FLAGS.profile)
 
     # Logger
     # ==================================================
 
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-
-    # File handler which logs even debug messages
-    file_handler = logging.FileHandler('log.log')
-    file_handler.setLevel(logging.DEBUG)
-
-    # Other file handler to store information for each run
-    log_directory = os.path.join(FLAGS.checkpoint_dir, "eval.log")
-    run_file_handler = logging.FileHandler(log_directory)
-    run_file_handler.setLevel(logging.DEBUG)
-
-    # Console handler which logs info messages
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-
-    # Create formatter and add it to the handlers
-    formatter = logging.Formatter("%(message)s")
-    file_handler.setFormatter(formatter)
-    run_file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-
-    # Add handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(run_file_handler)
-    logger.addHandler(console_handler)
+    # Shared log file and log file of the run (see logs.py)
+    logger = logs.setup_logging(os.path.join(FLAGS.checkpoint_dir,
+                                             "eval.log"))
     logger.debug(" *** Parameters *** ")
     for attr, value in sorted(FLAGS.__flags.items()):
         logger.debug("{}={}".format(attr.upper(), value))
     logger.debug("")
 
+    # Thread pools and CPU placement of the sessions
+    session_settings = sc.get_session_settings(
+            cfg, FLAGS.intra_op_threads, FLAGS.inter_op_threads,
+            FLAGS.cpu_affinity)
+    if sc.apply_cpu_affinity(session_settings['cpu_affinity']):
+        logger.info("Process pinned to the cores {}".format(
+                session_settings['cpu_affinity']))
+
     # ----------
     # Prediction part :
     # ----------
@@ -277,158 +427,80 @@ if __name__ == '__main__':
     #                    'pred_feature', 'polarity', 'pred_polarity'
     # ==================================================
 
-    dataset_name = cfg["datasets"]["default"]
-    current_domain = cfg["datasets"][dataset_name]["current_domain"]
-    if current_domain == 'RESTAURANT':
-        dataframe_actual = pp.parse_XML(RESTAURANT_TEST, FLAGS.aspects)
-        dataframe_actual = pp.select_and_simplify_dataset(
-                dataframe_actual, RESTAURANT_TEST, FLAGS.aspects)
-    elif current_domain == 'LAPTOP':
-        dataframe_actual = pp.parse_XML(LAPTOP_TEST)
+    domain = dm.get_current_domain(cfg)
+    aspects = domain.uses_aspects(FLAGS.aspects)
+    with profiler.stage("parse_XML"):
+        dataframe_actual = pp.parse_XML(domain.test_path, aspects)
         dataframe_actual = pp.select_and_simplify_dataset(
-                dataframe_actual, LAPTOP_TEST)
-    else:
-        raise ValueError("The 'current_domain' parameter in the " +
-                         "'config.yml' file must be 'RESTAURANT' " +
-                         "or 'LAPTOP'")
+                dataframe_actual, domain.test_path, aspects)
 
-    whole_prediction = pd.DataFrame(data=None, columns=[
-            'review_id', 'sentence_id', 'text', 'feature', 'pred_feature',
-            'polarity', 'pred_polarity'])
+    # Cache of the outputs of both CNNs
+    cache = None
+    if FLAGS.cache_size > 0:
+        cache = PredictionCache(FLAGS.cache_size, FLAGS.cache_path or None)
 
     # ==================================================
     # CNN_feature predictions
     # ==================================================
 
-    sentences_feature, all_predictions_feature, target_names_feature, feature_class_report =\
+    sentences_feature, all_predictions_feature, target_names_feature, feature_metrics =\
         prediction_process_CNN(FLAGS.checkpoint_dir, cfg, 'feature')
 
     # ==================================================
     # CNN_polarity predictions
     # ==================================================
 
-    sentences_polarity, all_predictions_polarity, target_names_polarity, polarity_class_report =\
+    sentences_polarity, all_predictions_polarity, target_names_polarity, polarity_metrics =\
         prediction_process_CNN(FLAGS.checkpoint_dir, cfg, 'polarity')
 
+    if cache is not None:
+        logger.info("Cache : {}".format(cache.metrics()))
+        cache.save_metrics(os.path.join(FLAGS.checkpoint_dir,
+                                        "cache_metrics.json"))
+        cache.close()
+
     # ==================================================
     # Construction of the whole predictions
     # ==================================================
-    for index, row in dataframe_actual.iterrows():
-        review_id = row['review_id']
-        sentence_id = row['sentence_id']
-        text = row['text']
-        feature = row['feature']
-        polarity = row['polarity']
-
-        # Feature
-        # ==================================================
-
-        # Retrieve index in the list of sentences
-        index_text = sentences_feature.index(text)
-
-        # Search the feature which corresponds to the text (retrieve the first
-        # occurence)
-        pred_feature = all_predictions_feature[index_text]
-
-        # Translate to corresponding label
-        pred_feature = target_names_feature[int(pred_feature)]
-
-        # Polarity
-        # ==================================================
-
-        # Retrieve index in the list of sentences
-        index_text = sentences_polarity.index(text)
 
-        # Search the feature which corresponds to the text (retrieve the first
-        # occurence)
-        pred_polarity = all_predictions_polarity[index_text]
+    whole_assembly = profiler.start("whole_assembly")
 
-        # Translate to corresponding label
-        pred_polarity = target_names_polarity[int(pred_polarity)]
-
-        whole_prediction = whole_prediction.append(
-                pd.DataFrame({'review_id': review_id,
-                              'sentence_id': sentence_id,
-                              'text': text,
-                              'feature': feature,
-                              'pred_feature': pred_feature,
-                              'polarity': polarity,
-                              'pred_polarity': pred_polarity},
-                             index=[0]), ignore_index=True)
-
-    # Add a column to check if the whole prediction is correct (feature and
-    # pred_feature must be equal AND polarity and pred_polarity must also be
-    # equal)
-    whole_prediction['check'] =\
-        ((whole_prediction.feature == whole_prediction.pred_feature) &
-         (whole_prediction.polarity == whole_prediction.pred_polarity))
+    whole_prediction = assemble_whole_prediction(
+            dataframe_actual,
+            sentences_feature, all_predictions_feature, target_names_feature,
+            sentences_polarity, all_predictions_polarity,
+            target_names_polarity, FLAGS.multilabel)
+    whole_assembly.stop()
 
     # ==================================================
     # Effectiveness of the algorithm
     # ==================================================
 
-    # Construction of dictionary to store new classes
+    # New classes of the combinations entity x polarity
     # Ex : FOOD, positive will be 0, FOOD, neutral : 1...etc...
-    dict_polarity = {}
-    for key, value in zip(POLARITY, list(range(len(POLARITY)))):
-        dict_polarity[key] = value
-
-    dict_entity_polarity = {}
-    if current_domain == 'RESTAURANT':
-        if not FLAGS.aspects:
-            index = 0
-            for entity in RESTAURANT_ENTITIES:
-                dict_polarity = {}
-                for polarity in POLARITY:
-                    dict_polarity[polarity] = index
-                    index += 1
-                dict_entity_polarity[entity] = dict_polarity
-        else:
-            index = 0
-            for entity in RESTAURANT_ASPECTS:
-                dict_polarity = {}
-                for polarity in POLARITY:
-                    dict_polarity[polarity] = index
-                    index += 1
-                dict_entity_polarity[entity] = dict_polarity
-    elif current_domain == 'LAPTOP':
-        index = 0
-        for entity in LAPTOP_ENTITIES:
-            dict_polarity = {}
-            for polarity in POLARITY:
-                dict_polarity[polarity] = index
-                index += 1
-            dict_entity_polarity[entity] = dict_polarity
-    else:
-        raise ValueError("The 'current_domain' parameter in the " +
-                         "'config.yml' file must be 'RESTAURANT' " +
-                         "or 'LAPTOP'")
-
-    # Create a new DataFrame to add to whole_prediction. The new DataFrame is
-    # composed of 'new_class' and 'pred_new_class' columns
-    list_of_rows = []
-    for index, row in whole_prediction.iterrows():
-        list_of_rows.append(
-                [dict_entity_polarity[row['feature']][row['polarity']],
-                 dict_entity_polarity[row['pred_feature']][row['pred_polarity']]])
-    df_to_append = pd.DataFrame(data=list_of_rows,
-                                columns=['new_class', 'pred_new_class'])
-    whole_prediction = whole_prediction.assign(
-             new_class=df_to_append['new_class'])
+    combinations = domain.combinations(aspects)
     whole_prediction = whole_prediction.assign(
-             pred_new_class=df_to_append['pred_new_class'])
+            new_class=combinations.encode(whole_prediction['feature'],
+                                          whole_prediction['polarity']),
+            pred_new_class=combinations.encode(
+                    whole_prediction['pred_feature'],
+                    whole_prediction['pred_polarity']))
+    target_names_whole = list(combinations.names)
 
     logger.info("Effectiveness of the whole algorithm")
     logger.info("")
-    class_report = metrics.classification_report(
-            whole_prediction['new_class'],
-            whole_prediction['pred_new_class'])
-    logger.info(class_report)
+    with profiler.stage("whole_metrics"):
+        whole_metrics = ev.classification_metrics(
+                whole_prediction['new_class'].values,
+                whole_prediction['pred_new_class'].values,
+                target_names_whole)
+    logger.info(ev.format_report(whole_metrics))
+    ev.save_metrics(whole_metrics, os.path.join(FLAGS.checkpoint_dir,
+                                                'metrics.csv'))
 
     logger.info("")
-    for entity, dict_polarity in dict_entity_polarity.items():
-        for polarity, num_class in dict_polarity.items():
-            logger.info("{} : {} - {}".format(num_class, entity, polarity))
+    for num_class, name in enumerate(target_names_whole):
+        logger.info("{} : {}".format(num_class, name))
 
     # Save the predictions into a CSV file inside the folder of the current run
     path_prediction_file = os.path.join(FLAGS.checkpoint_dir,
@@ -436,28 +508,31 @@ if __name__ == '__main__':
     whole_prediction.to_csv(path_prediction_file, encoding='utf-8',
                             columns=['review_id', 'sentence_id', 'text',
                                      'feature', 'pred_feature',
-                                     'polarity', 'pred_polarity',
-                                     'check', 'new_class', 'pred_new_class'])
+                                     'pred_features', 'polarity',
+                                     'pred_polarity', 'check', 'new_class', 'pred_new_class'])
 
     # ==================================================
     # Display charts
     # ==================================================
-    an.bar_chart_classification_report(feature_class_report,
-                                       "Effectiveness of CNN_feature",
-                                       FLAGS.checkpoint_dir)
-    an.bar_chart_classification_report(polarity_class_report,
-                                       "Effectiveness of CNN_polarity",
-                                       FLAGS.checkpoint_dir)
-    an.bar_chart_classification_report(class_report,
-                                       "Effectiveness of whole algorithm",
-                                       FLAGS.checkpoint_dir)
-
-    an.pie_chart_support_distribution(feature_class_report,
-                                      "Data distribution for CNN_feature",
-                                      FLAGS.checkpoint_dir)
-    an.pie_chart_support_distribution(polarity_class_report,
-                                      "Data distribution for CNN_polarity",
-                                      FLAGS.checkpoint_dir)
-    an.pie_chart_support_distribution(class_report,
-                                      "Data distribution for whole algorithm",
-                                      FLAGS.checkpoint_dir)
+    charts = []
+    for class_metrics, title in [(feature_metrics, "CNN_feature"),
+                                 (polarity_metrics, "CNN_polarity"),
+                                 (whole_metrics, "whole algorithm")]:
+        charts.append((an.bar_chart_classification_report,
+                       (class_metrics, "Effectiveness of " + title,
+                        FLAGS.checkpoint_dir, FLAGS.chart_format,
+                        FLAGS.chart_dpi)))
+        charts.append((an.pie_chart_support_distribution,
+                       (class_metrics, "Data distribution for " + title,
+                        FLAGS.checkpoint_dir, FLAGS.chart_format,
+                        FLAGS.chart_dpi)))
+    with profiler.stage("charts"):
+        an.render_charts(charts, FLAGS.chart_processes)
+
+    # ==================================================
+    # Timings
+    # ==================================================
+
+    logger.info("")
+    profiler.log(logger)
+    profiler.save(FLAGS.checkpoint_dir, "prediction_timings.json")
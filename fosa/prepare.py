@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+"""
+Preparation of the training data of the CNNs.
+
+Before its first training step, train.py reads the dataset, cleans the
+sentences, fits the vocabulary, pads the sentences and loads the word
+embeddings. This module does these steps once and writes the result into a
+prepared folder, one subfolder per CNN (CNN_feature and CNN_polarity) :
+
+    - x.npy : int32 matrix of the word ids of the padded sentences
+    - y.npy : labels (int32 ids of the classes, or multi-hot vectors)
+    - vocab : vocabulary (VocabularyProcessor)
+    - embeddings.npy : float32 embedding vectors of the words of the
+      vocabulary (only if the word embeddings are enabled)
+    - meta.json : version of the format and parameters of the preparation
+
+The .npy files are memory-mapped when they are loaded (see load_prepared),
+so that train.py --prepared_dir=... starts training in a few seconds and a
+prepared folder can be shared by many runs.
+"""
+
+import tensorflow as tf
+from tensorflow.contrib import learn
+import numpy as np
+import os
+import json
+import time
+import logging
+import yaml
+
+# Project modules
+import preprocessing as pp
+import data_sources as src
+import logs
+
+# Same logger as the one configured by the entry points
+logger = logging.getLogger()
+
+# Constants
+# ==================================================
+
+PREPARED_VERSION = 2
+META_FILE = 'meta.json'
+
+# Functions
+# ==================================================
+
+
+def dataset_of_config(config_file):
+    """
+    :param config_file: The configuration file of the project opened with yaml
+    library.
+    :return: Name of the dataset selected in the 'config.yml' file and name
+    of its current domain (None if the dataset is not semeval).
+    """
+
+    dataset_name = config_file["datasets"]["default"]
+    domain_name = None
+    if dataset_name == 'semeval':
+        domain_name = config_file["datasets"]["semeval"]["current_domain"]
+    return dataset_name, domain_name
+
+
+def build_vocabulary(x_text):
+    """
+    Fit the vocabulary on the cleaned sentences and map them to word ids.
+    :return: int32 matrix of shape [n, max_document_length] and the
+    VocabularyProcessor.
+    """
+
+    max_document_length = max([len(x.split(" ")) for x in x_text])
+    logger.debug("Max document length : %s", max_document_length)
+    vocab_processor = (learn.preprocessing.VocabularyProcessor(
+            max_document_length))
+    x = np.array(list(vocab_processor.fit_transform(x_text)), dtype=np.int32)
+    return x, vocab_processor
+
+
+def vocabulary_words(vocab_processor):
+    """
+    :return: Words of the vocabulary, in the order of their ids.
+    """
+
+    vocabulary = vocab_processor.vocabulary_
+    return [vocabulary.reverse(i) for i in range(len(vocabulary))]
+
+
+def same_vocabulary(vocab_processor, other):
+    """
+    :return: True if both VocabularyProcessors map the sentences to the same
+    word ids : same words with the same ids and same length of documents.
+    """
+
+    return (vocab_processor.max_document_length ==
+            other.max_document_length and
+            vocabulary_words(vocab_processor) == vocabulary_words(other))
+
+
+def load_embeddings(config_file, vocabulary, embedding_name,
+                    embedding_dimension):
+    """
+    Embedding vectors of the words of the vocabulary.
+    :param embedding_name: 'word2vec' or 'glove'.
+    :return: float32 matrix of shape [len(vocabulary), embedding_dimension].
+    """
+
+    initW = None
+    if embedding_name == 'word2vec':
+        # Load embedding vectors from the word2vec
+        logger.info("Load word2vec file {}".format(
+                config_file['word_embeddings']['word2vec']['path']))
+        initW = pp.load_embedding_vectors_word2vec(
+                vocabulary,
+                config_file['word_embeddings']['word2vec']['path'],
+                config_file['word_embeddings']['word2vec']['binary'])
+        logger.info("Word2vec file has been loaded")
+    elif embedding_name == 'glove':
+        # Load embedding vectors from the glove
+        logger.info("Load glove file {}".format(
+                config_file['word_embeddings']['glove']['path']))
+        initW = pp.load_embedding_vectors_glove(
+                vocabulary,
+                config_file['word_embeddings']['glove']['path'],
+                embedding_dimension)
+        logger.info("Glove file has been loaded")
+    else:
+        raise ValueError("'embedding_name' parameter must be 'word2vec' or " +
+                         "'glove'")
+    return initW.astype(np.float32)
+
+
+def prepare(config_file, focus, folder, aspects=False, multilabel=False,
+            embedding_name=None):
+    """
+    Prepare the training data of one CNN into a folder.
+    :param config_file: The configuration file of the project opened with yaml
+    library.
+    :param focus: (required) 'feature' or 'polarity'.
+    :type focus: string
+    :param folder: Folder where the prepared files are written.
+    :param multilabel: Prepare multi-hot labels (only for 'feature').
+    :param embedding_name: 'word2vec', 'glove' or None to skip the word
+    embeddings.
+    :return: Content of the meta.json file.
+    """
+
+    start_time = time.time()
+    multilabel = multilabel and focus == 'feature'
+
+    source = src.get_source(config_file, 'train', focus, aspects, multilabel)
+    x_text, y = src.load_data_and_labels(source)
+    x, vocab_processor = build_vocabulary(x_text)
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    np.save(os.path.join(folder, 'x.npy'), x)
+    np.save(os.path.join(folder, 'y.npy'), y)
+    vocab_processor.save(os.path.join(folder, 'vocab'))
+
+    embedding_dimension = None
+    if embedding_name:
+        embedding_dimension = (
+                config_file['word_embeddings'][embedding_name]['dimension'])
+        embeddings = load_embeddings(config_file, vocab_processor.vocabulary_,
+                                     embedding_name, embedding_dimension)
+        np.save(os.path.join(folder, 'embeddings.npy'), embeddings)
+
+    dataset_name, domain_name = dataset_of_config(config_file)
+    meta = {'version': PREPARED_VERSION,
+            'dataset': dataset_name,
+            'domain': domain_name,
+            'focus': focus,
+            'aspects': aspects,
+            'multilabel': multilabel,
+            'target_names': list(source.target_names),
+            'num_examples': int(x.shape[0]),
+            'sequence_length': int(x.shape[1]),
+            'vocab_size': len(vocab_processor.vocabulary_),
+            'embedding_name': embedding_name,
+            'embedding_dimension': embedding_dimension,
+            'timestamp': int(time.time())}
+    with open(os.path.join(folder, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    logger.info("CNN_{} : {} examples prepared in {:.1f}s".format(
+            focus, meta['num_examples'], time.time() - start_time))
+    return meta
+
+
+def load_prepared(folder, mmap_mode='r'):
+    """
+    Load the training data of one CNN prepared by prepare.
+    :param mmap_mode: Memory-map mode of the .npy files (see numpy.load),
+    None to read them in memory.
+    :return: Dictionary with the keys meta, x, y, vocab_processor and
+    embeddings (None if the word embeddings have not been prepared).
+    """
+
+    with open(os.path.join(folder, META_FILE), 'r') as f:
+        meta = json.load(f)
+    if meta.get('version') != PREPARED_VERSION:
+        raise ValueError("The folder {} has been prepared with the version "
+                         "{} of the format, expected version {}. Prepare it "
+                         "again.".format(folder, meta.get('version'),
+                                         PREPARED_VERSION))
+
+    embeddings = None
+    if meta['embedding_name']:
+        embeddings = np.load(os.path.join(folder, 'embeddings.npy'),
+                             mmap_mode=mmap_mode)
+
+    return {'meta': meta,
+            'x': np.load(os.path.join(folder, 'x.npy'), mmap_mode=mmap_mode),
+            'y': np.load(os.path.join(folder, 'y.npy'), mmap_mode=mmap_mode),
+            'vocab_processor': learn.preprocessing.VocabularyProcessor.restore(
+                    os.path.join(folder, 'vocab')),
+            'embeddings': embeddings}
+
+
+if __name__ == '__main__':
+
+    # Parameters
+    # ==================================================
+
+    tf.flags.DEFINE_string("prepared_dir", "prepared",
+                           "Folder where the prepared data are written "
+                           "(default: prepared)")
+    tf.flags.DEFINE_boolean("aspects",
+                            False,
+                            "Scope widened to aspects and not only entities")
+    tf.flags.DEFINE_boolean("multilabel",
+                            False,
+                            "Prepare multi-hot labels for CNN_feature")
+    tf.flags.DEFINE_boolean(
+            "enable_word_embeddings",
+            True, "Enable/disable the word embedding (default: True)")
+
+    FLAGS = tf.flags.FLAGS
+    FLAGS._parse_flags()
+
+    # Logger
+    # ==================================================
+
+    # Shared log file and log file of the prepared data (see logs.py)
+    logs.setup_logging(os.path.join(FLAGS.prepared_dir, "prepare.log"))
+
+    with open("config.yml", 'r') as ymlfile:
+        cfg = yaml.load(ymlfile)
+
+    embedding_name = None
+    if FLAGS.enable_word_embeddings:
+        embedding_name = cfg['word_embeddings']['default'] or None
+
+    for focus in ['feature', 'polarity']:
+        prepare(cfg, focus, os.path.join(FLAGS.prepared_dir, 'CNN_' + focus),
+                FLAGS.aspects, FLAGS.multilabel, embedding_name)
@@ -5,41 +5,20 @@ Tools for the preprocessing part of the algorithm.
 """
 
 import re
-from sklearn.datasets import fetch_20newsgroups
-from sklearn.datasets import load_files
-import os
+import functools
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import xml.etree.ElementTree as ET
 import codecs
 
+# Project modules
+import domains as dm
+
 # Constants
 # ============================================
 
-# TODO : Make the constants the same for each module by gathering them
-# in one file, then put the file on the top of each module
-SEMEVAL_FOLDER = '../data/SemEval/Subtask1'
-RESTAURANT_TRAIN = os.path.join(SEMEVAL_FOLDER, 'restaurant', 'train.xml')
-RESTAURANT_TEST = os.path.join(SEMEVAL_FOLDER, 'restaurant', 'test',
-                               'test_gold.xml')
-LAPTOP_TRAIN = os.path.join(SEMEVAL_FOLDER, 'laptop', 'train.xml')
-LAPTOP_TEST = os.path.join(SEMEVAL_FOLDER, 'laptop', 'test', 'test_gold.xml')
-RESTAURANT_ENTITIES = ['FOOD', 'DRINKS', 'SERVICE', 'RESTAURANT', 'AMBIENCE',
-                       'LOCATION']
-LAPTOP_ENTITIES = ['LAPTOP', 'HARDWARE', 'SHIPPING', 'COMPANY', 'SUPPORT',
-                   'SOFTWARE']
-# The following entities will be simplified as HARDWARE entity
-HARDWARE = ['DISPLAY', 'CPU', 'MOTHERBOARD', 'HARD_DISC', 'MEMORY', 'BATTERY',
-            'POWER_SUPPLY', 'KEYBOARD', 'MOUSE', 'FANS_COOLING',
-            'OPTICAL_DRIVES', 'PORTS', 'GRAPHICS', 'MULTIMEDIA_DEVICES']
-POLARITY = ['positive', 'neutral', 'negative']
-# Define aspects (only for restaurant domain)
-RESTAURANT_ASPECTS = [
-        'RESTAURANT#GENERAL', 'RESTAURANT#PRICES', 'RESTAURANT#MISCELLANEOUS',
-        'FOOD#PRICES', 'FOOD#QUALITY', 'FOOD#STYLE_OPTIONS',
-        'DRINKS#PRICES', 'DRINKS#QUALITY', 'DRINKS#STYLE_OPTIONS',
-        'AMBIENCE#GENERAL', 'SERVICE#GENERAL', 'LOCATION#GENERAL']
+# Number of distinct sentences whose cleaned text is kept in memory
+CLEAN_CACHE_SIZE = 100000
 
 
 def clean_str(string):
@@ -65,6 +44,16 @@ def clean_str(string):
     return string.strip().lower()
 
 
+@functools.lru_cache(maxsize=CLEAN_CACHE_SIZE)
+def cached_clean_str(string):
+    """
+    clean_str with a cache, as the same sentence is often read several times
+    (one example per feature of the sentence).
+    """
+
+    return clean_str(string)
+
+
 def batch_number(data, batch_size, num_epochs):
     """
     Compute the number of batch to process during the epoch loop
@@ -73,22 +62,34 @@ def batch_number(data, batch_size, num_epochs):
     return int((len(data)-1)/batch_size) + 1
 
 
-def batch_iter(data, batch_size, num_epochs, shuffle=True):
+def batch_iter(data, batch_size, num_epochs, shuffle=True, seed=None,
+               start=0):
     """
     Generates a batch iterator for a dataset.
+    :param seed: If given, the data of the epoch e are shuffled by a random
+    generator seeded with seed + e, so that the batches of an epoch do not
+    depend on the previous ones. Otherwise the global numpy generator is used.
+    :param start: Number of batches to skip, to resume an interrupted training
+    (only reproducible with a seed).
     """
 
     data = np.array(data)
     data_size = len(data)
     num_batches_per_epoch = batch_number(data, batch_size, num_epochs)
-    for epoch in range(num_epochs):
+    start_epoch, start_batch = divmod(start, num_batches_per_epoch)
+    for epoch in range(start_epoch, num_epochs):
         # Shuffle the data at each epoch
         if shuffle:
-            shuffle_indices = np.random.permutation(np.arange(data_size))
+            if seed is None:
+                shuffle_indices = np.random.permutation(np.arange(data_size))
+            else:
+                shuffle_indices = np.random.RandomState(
+                        seed + epoch).permutation(data_size)
             shuffled_data = data[shuffle_indices]
         else:
             shuffled_data = data
-        for batch_num in range(num_batches_per_epoch):
+        first_batch = start_batch if epoch == start_epoch else 0
+        for batch_num in range(first_batch, num_batches_per_epoch):
             start_index = batch_num * batch_size
             end_index = min((batch_num + 1) * batch_size, data_size)
             yield shuffled_data[start_index:end_index]
@@ -104,6 +105,9 @@ def get_datasets_20newsgroup(subset='train', categories=None, shuffle=True,
     :param random_state: seed integer to shuffle the dataset
     :return: data and labels of the newsgroup
     """
+    # Imported here as sklearn.datasets is slow to import
+    from sklearn.datasets import fetch_20newsgroups
+
     datasets = fetch_20newsgroups(subset=subset, categories=categories,
                                   shuffle=shuffle, random_state=random_state)
     return datasets
@@ -114,18 +118,10 @@ def get_datasets_mrpolarity(positive_data_file, negative_data_file):
     Loads MR polarity data from files, splits the data into words and generates
     labels. Returns split sentences and labels.
     """
-    # Load data from files
-    positive_examples = list(open(positive_data_file, "r").readlines())
-    positive_examples = [s.strip() for s in positive_examples]
-    negative_examples = list(open(negative_data_file, "r").readlines())
-    negative_examples = [s.strip() for s in negative_examples]
-
-    datasets = dict()
-    datasets['data'] = positive_examples + negative_examples
-    target = [0 for x in positive_examples] + [1 for x in negative_examples]
-    datasets['target'] = target
-    datasets['target_names'] = ['positive_examples', 'negative_examples']
-    return datasets
+    # Imported here as data_sources depends on this module
+    import data_sources as src
+
+    return src.MRPolaritySource(positive_data_file, negative_data_file).load()
 
 
 def get_datasets_localdata(container_path=None, categories=None,
@@ -142,6 +138,9 @@ def get_datasets_localdata(container_path=None, categories=None,
     :param random_state: seed integer to shuffle the dataset
     :return: data and labels of the dataset
     """
+    # Imported here as sklearn.datasets is slow to import
+    from sklearn.datasets import load_files
+
     datasets = load_files(container_path=container_path,
                           categories=categories,
                           load_content=load_content,
@@ -152,27 +151,48 @@ def get_datasets_localdata(container_path=None, categories=None,
     return datasets
 
 
-def load_data_and_labels(datasets):
+def load_data_and_labels(datasets, multilabel=False):
     """
     Load data and labels
     :param datasets:
+    :param multilabel: If True, each target is a list of classes and the
+    labels are multi-hot vectors. Otherwise, each target is one class and the
+    labels are the int32 ids of the classes (sparse labels).
     :return:
     """
 
     # Split by words
     x_text = datasets['data']
-    x_text = [clean_str(sent) for sent in x_text]
+    x_text = [cached_clean_str(sent) for sent in x_text]
 
     # Generate labels
-    labels = []
-    for i in range(len(x_text)):
-        label = [0 for j in datasets['target_names']]
-        label[datasets['target'][i]] = 1
-        labels.append(label)
-    y = np.array(labels)
+    y = build_labels(datasets['target'], len(datasets['target_names']),
+                     multilabel)
     return [x_text, y]
 
 
+def build_labels(target, num_classes, multilabel=False):
+    """
+    Labels of the CNNs.
+    :param target: Id of the class of each sentence, or list of the ids of
+    its classes in multi-label mode.
+    :return: Array of the int32 ids of the classes (sparse labels), or array
+    of multi-hot vectors of shape [n, num_classes] in multi-label mode.
+    """
+
+    if not multilabel:
+        return np.asarray(target, dtype=np.int32)
+
+    lengths = [len(targets) for targets in target]
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    columns = np.fromiter((class_id for targets in target
+                           for class_id in targets),
+                          dtype=np.intp, count=len(rows))
+    y = np.zeros((len(lengths), num_classes), dtype=np.int64)
+    y[rows, columns] = 1
+    return y
+
+
 def load_embedding_vectors_word2vec(vocabulary, filename, binary):
     # Load embedding_vectors from the word2vec
     encoding = 'utf-8'
@@ -201,7 +221,7 @@ def load_embedding_vectors_word2vec(vocabulary, filename, binary):
                 word = str(b''.join(word), encoding=encoding, errors='strict')
                 idx = vocabulary.get(word)
                 if idx != 0:
-                    embedding_vectors[idx] = np.fromstring(
+                    embedding_vectors[idx] = np.frombuffer(
                             f.read(binary_len), dtype='float32')
                 else:
                     f.seek(binary_len, 1)
@@ -310,29 +330,21 @@ def select_and_simplify_dataset(parsed_dataset, filepath, aspects=False):
     # TODO : It will be interesting to use this function inside the function
     # get_dataset_semeval
 
-    parsed_dataset = parsed_dataset.replace(HARDWARE, 'HARDWARE')
+    domain = dm.get_domain_of_file(filepath)
+    aspects = domain.uses_aspects(aspects)
 
-    if filepath == RESTAURANT_TRAIN or filepath == RESTAURANT_TEST:
-        if not aspects:
-            parsed_dataset = parsed_dataset[
-                    parsed_dataset['feature'].isin(RESTAURANT_ENTITIES)]
-        else:
-            parsed_dataset = parsed_dataset[
-                    parsed_dataset['feature'].isin(RESTAURANT_ASPECTS)]
-    elif filepath == LAPTOP_TRAIN or filepath == LAPTOP_TEST:
-        parsed_dataset = parsed_dataset[
-                parsed_dataset['feature'].isin(LAPTOP_ENTITIES)]
-    else:
-        raise ValueError("'filepath' parameter must use the " +
-                         "following constants : 'RESTAURANT_TRAIN', " +
-                         "'RESTAURANT_TEST', 'LAPTOP_TRAIN', " +
-                         "'LAPTOP_TEST'")
+    # Only the feature column is simplified
+    features = domain.features(aspects)
+    feature_ids = features.encode(parsed_dataset['feature'], domain.simplify)
+    parsed_dataset = parsed_dataset[feature_ids >= 0]
+    parsed_dataset = parsed_dataset.assign(
+            feature=features.decode(feature_ids[feature_ids >= 0]))
 
     return parsed_dataset
 
 
-def get_dataset_semeval(filepath=RESTAURANT_TRAIN, focus='polarity',
-                        aspects=False):
+def get_dataset_semeval(filepath=dm.RESTAURANT_TRAIN, focus='polarity',
+                        aspects=False, multilabel=False):
     """
     Parse the XML document of SemEval competition (SemEval 2016, Task 5,
     Subtask 1). The targetted domains are those containing English reviews :
@@ -355,19 +367,24 @@ def get_dataset_semeval(filepath=RESTAURANT_TRAIN, focus='polarity',
     will be assigned one or multiple polarities depending on which polarities
     are expressed in the sentence.
     :type focus: string
+    :param multilabel: Default : False. If True, each sentence appears once
+    and its target is the list of all its features (or polarities).
+    Otherwise, a sentence appears once per feature (or polarity).
+    :type multilabel: boolean
     :return: A dictionnary representing the SemEval dataset. This dictionnary
     will be focusing on either the features or the polarities included in the
     sentences.
     """
-    # TODO : Multilabel for feature and polarity.
 
-    dataset_df = parse_XML(filepath, aspects)
+    # Imported here as data_sources depends on this module
+    import data_sources as src
 
     # The dataset is composed of either features or polarity in order to
     # be feed to the CNN.
     #
     # Some other manipulations are done on the data :
-    # - rename some features for simplicity (see HARDWARE constant)
+    # - rename some features for simplicity (see the simplify
+    #   parameter of domains.Domain)
     # - suppress the sentences which has features not studied in this
     #   scope
     # - remove duplicates
@@ -380,62 +397,4 @@ def get_dataset_semeval(filepath=RESTAURANT_TRAIN, focus='polarity',
     # be read further in the algorithm.
     # ============================================
 
-    datasets = {}
-
-    if focus == 'polarity':
-        dataset_df = dataset_df[['text', 'polarity']]
-        dataset_df = dataset_df.rename(columns={'polarity': 'y'})
-
-        range_dict = list(range(len(POLARITY)))
-        polarity_dict = dict(zip(POLARITY, range_dict))
-        dataset_df = dataset_df.replace({'y': polarity_dict})
-        datasets['target_names'] = POLARITY
-    elif focus == 'feature':
-        dataset_df = dataset_df[['text', 'feature']]
-        dataset_df = dataset_df.rename(columns={'feature': 'y'})
-
-        if filepath == RESTAURANT_TRAIN or filepath == RESTAURANT_TEST:
-            if not aspects:
-                datasets['target_names'] = RESTAURANT_ENTITIES
-                dataset_df = dataset_df[dataset_df['y'].isin(
-                        RESTAURANT_ENTITIES)]
-                range_dict = list(range(len(RESTAURANT_ENTITIES)))
-                restaurant_entities_dict = dict(zip(RESTAURANT_ENTITIES,
-                                                    range_dict))
-                dataset_df = dataset_df.replace({'y':
-                                                restaurant_entities_dict})
-            else:
-                datasets['target_names'] = RESTAURANT_ASPECTS
-                dataset_df = dataset_df[dataset_df['y'].isin(
-                        RESTAURANT_ASPECTS)]
-                range_dict = list(range(len(RESTAURANT_ASPECTS)))
-                restaurant_entities_dict = dict(zip(RESTAURANT_ASPECTS,
-                                                    range_dict))
-                dataset_df = dataset_df.replace({'y':
-                                                restaurant_entities_dict})
-
-        elif filepath == LAPTOP_TRAIN or filepath == LAPTOP_TEST:
-            dataset_df = dataset_df.replace(HARDWARE, 'HARDWARE')
-
-            datasets['target_names'] = LAPTOP_ENTITIES
-            dataset_df = dataset_df[dataset_df['y'].isin(LAPTOP_ENTITIES)]
-
-            range_dict = list(range(len(LAPTOP_ENTITIES)))
-            laptop_entities_dict = dict(zip(LAPTOP_ENTITIES, range_dict))
-            dataset_df = dataset_df.replace({'y': laptop_entities_dict})
-        else:
-            raise ValueError("'filepath' parameter must use the " +
-                             "following constants : 'RESTAURANT_TRAIN', " +
-                             "'RESTAURANT_TEST', 'LAPTOP_TRAIN', " +
-                             "'LAPTOP_TEST'")
-
-    else:
-        raise ValueError("'focus' parameter must be 'feature' or" +
-                         "'polarity'")
-
-    dataset_df = dataset_df.drop_duplicates()
-
-    datasets['data'] = dataset_df['text'].values.tolist()
-    datasets['target'] = dataset_df['y'].values.tolist()
-
-    return datasets
+    return src.SemEvalSource(filepath, focus, aspects, multilabel).load()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""
+Timing instrumentation of the stages of train.py and prediction.py.
+
+A Profiler measures the stages wrapped in its stage context manager and
+sums counters, then writes a JSON report into the folder of the run. A
+disabled profiler hands out a shared no-op context manager, so the
+instrumented code costs almost nothing when the profiling is turned off.
+
+TensorFlow step traces (RunMetadata) can also be captured every N steps and
+saved in the Chrome trace format (chrome://tracing).
+"""
+
+import collections
+import json
+import os
+import time
+
+# Constants
+# ==================================================
+
+REPORT_FILE = 'timings.json'
+
+
+class _NullStage(object):
+    """
+    Context manager which does nothing, used by disabled profilers.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def stop(self):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    """
+    Context manager measuring the wall time of one execution of a stage.
+    """
+
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+    def stop(self):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+
+
+class Profiler(object):
+    """
+    Timers and counters of the stages of a run.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.timings = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.start_time = time.time()
+
+    def stage(self, name):
+        """
+        :return: Context manager measuring the stage name. The times of the
+        executions of a stage are summed.
+        """
+
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def start(self, name):
+        """
+        Start measuring the stage name outside of a with statement.
+        :return: Object whose stop method ends the measure.
+        """
+
+        return self.stage(name).__enter__()
+
+    def add_time(self, name, seconds):
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = {'count': 1, 'total': seconds,
+                                  'min': seconds, 'max': seconds}
+        else:
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['min'] = min(timing['min'], seconds)
+            timing['max'] = max(timing['max'], seconds)
+
+    def count(self, name, value=1):
+        """
+        Add value to the counter name.
+        """
+
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        """
+        :return: Dictionary with the wall time since the creation of the
+        profiler, the timings of each stage (count, total, mean, min and max
+        in seconds) and the counters.
+        """
+
+        timings = collections.OrderedDict()
+        for name, timing in self.timings.items():
+            timings[name] = dict(timing,
+                                 mean=timing['total'] / timing['count'])
+        return {'wall_time': time.time() - self.start_time,
+                'timings': timings,
+                'counters': dict(self.counters)}
+
+    def save(self, folder, filename=REPORT_FILE):
+        """
+        Write the report into folder/filename as JSON.
+        :return: Path of the report.
+        """
+
+        path = os.path.join(folder, filename)
+        if self.enabled:
+            with open(path, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+        return path
+
+    def log(self, logger):
+        """
+        Log the stages sorted by total time.
+        """
+
+        if not self.enabled:
+            return
+        report = self.report()
+        logger.info("Stage | Count | Total (s) | Mean (s)")
+        for name, timing in sorted(report['timings'].items(),
+                                   key=lambda item: -item[1]['total']):
+            logger.info("{} | {} | {:.3f} | {:.4f}".format(
+                    name, timing['count'], timing['total'], timing['mean']))
+        for name, value in report['counters'].items():
+            logger.info("{} : {}".format(name, value))
+
+
+NULL_PROFILER = Profiler(enabled=False)
+
+
+# TensorFlow traces
+# ==================================================
+
+
+class StepTracer(object):
+    """
+    Capture the RunMetadata of one step every trace_every steps.
+    """
+
+    def __init__(self, trace_every=0, folder=None):
+        """
+        :param trace_every: Number of steps between two traces, 0 to disable
+        the traces.
+        :param folder: Folder where the Chrome traces are written.
+        """
+
+        self.trace_every = trace_every
+        self.folder = folder
+        self.calls = 0
+
+    def run_kwargs(self):
+        """
+        Keyword arguments of the next session.run : options and
+        run_metadata for a traced step, nothing otherwise.
+        """
+
+        self.calls += 1
+        if not self.trace_every or self.calls % self.trace_every != 0:
+            return {}
+
+        import tensorflow as tf
+        return {'options': tf.RunOptions(
+                        trace_level=tf.RunOptions.FULL_TRACE),
+                'run_metadata': tf.RunMetadata()}
+
+    def save(self, run_kwargs, step, summary_writer=None):
+        """
+        Save the trace of a step run with run_kwargs (see run_kwargs).
+        """
+
+        run_metadata = run_kwargs.get('run_metadata')
+        if run_metadata is None:
+            return
+
+        from tensorflow.python.client import timeline
+        if summary_writer is not None:
+            summary_writer.add_run_metadata(run_metadata,
+                                            "step{}".format(step))
+        if self.folder:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+            trace = timeline.Timeline(run_metadata.step_stats)
+            with open(os.path.join(self.folder,
+                                   "step_{}.json".format(step)), 'w') as f:
+                f.write(trace.generate_chrome_trace_format())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""
+Scorer following the measures of the SemEval 2016 competition (Task 5,
+Subtask 1) for the predictions.csv files written by prediction.py.
+
+    - Slot 1 : aspect category detection, micro F1-score over the
+      (sentence, feature) pairs.
+    - Slot 3 : sentiment polarity, accuracy over the actual opinions.
+
+Every measure is computed with grouped NumPy reductions over integer codes,
+and several runs can be scored in parallel into one comparison table.
+"""
+
+import argparse
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+
+# Constants
+# ==================================================
+
+PREDICTIONS_FILE = 'predictions.csv'
+
+
+def load_predictions(run_directory):
+    """
+    Load the predictions of a run.
+    :param run_directory: Folder of a run of train.py (containing the
+    predictions.csv file written by prediction.py) or path of the CSV file.
+    :type run_directory: string
+    :return: Pandas.DataFrame with at least the columns sentence_id,
+    feature, pred_feature, polarity, pred_polarity and pred_features
+    (missing in the files written by older versions of prediction.py).
+    """
+
+    filepath = run_directory
+    if os.path.isdir(run_directory):
+        filepath = os.path.join(run_directory, PREDICTIONS_FILE)
+
+    return pd.read_csv(filepath, index_col=0,
+                       dtype={'sentence_id': str, 'review_id': str,
+                              'pred_features': str})
+
+
+def _divide(numerator, denominator):
+    return float(numerator) / denominator if denominator else 0.0
+
+
+def slot1_scores(predictions):
+    """
+    Slot 1 : aspect category detection. The actual and predicted features of
+    each sentence are compared as sets of (sentence, feature) pairs. The
+    predicted features are read from the pred_features column (every
+    feature detected in the sentence, separated by spaces) or, in the files
+    without this column, from pred_feature.
+    :param predictions: DataFrame loaded by load_predictions.
+    :return: Dictionary with the keys slot1_precision, slot1_recall and
+    slot1_f1.
+    """
+
+    sentence_codes = pd.factorize(predictions['sentence_id'])[0]
+    if 'pred_features' in predictions:
+        detected = predictions['pred_features'].fillna('').astype(str)
+        detected = [features.split() for features in detected]
+        predicted_sentences = np.repeat(
+                sentence_codes, [len(features) for features in detected])
+        predicted_features = pd.Series(
+                [feature for features in detected for feature in features],
+                dtype=object)
+    else:
+        predicted_sentences = sentence_codes
+        predicted_features = predictions['pred_feature']
+
+    feature_codes, features = pd.factorize(
+            pd.concat([predictions['feature'], predicted_features],
+                      ignore_index=True))
+    num_features = len(features)
+    actual_codes = feature_codes[:len(predictions)]
+    predicted_codes = feature_codes[len(predictions):]
+
+    # Each (sentence, feature) pair is encoded as one integer
+    actual_pairs = np.unique(sentence_codes * num_features + actual_codes)
+    predicted_pairs = np.unique(predicted_sentences * num_features +
+                                predicted_codes)
+    true_positives = len(np.intersect1d(actual_pairs, predicted_pairs,
+                                        assume_unique=True))
+
+    precision = _divide(true_positives, len(predicted_pairs))
+    recall = _divide(true_positives, len(actual_pairs))
+    return {'slot1_precision': precision,
+            'slot1_recall': recall,
+            'slot1_f1': _divide(2 * precision * recall, precision + recall)}
+
+
+def slot3_scores(predictions):
+    """
+    Slot 3 : sentiment polarity of each actual opinion.
+    :param predictions: DataFrame loaded by load_predictions.
+    :return: Dictionary with the keys slot3_accuracy (over all the opinions),
+    slot3_mean_accuracy (mean of the accuracies of each feature) and
+    slot3_accuracy_per_feature (dictionary feature -> accuracy).
+    """
+
+    correct = (predictions['polarity'].values ==
+               predictions['pred_polarity'].values)
+    feature_codes, features = pd.factorize(predictions['feature'])
+
+    totals = np.bincount(feature_codes, minlength=len(features))
+    corrects = np.bincount(feature_codes, weights=correct,
+                           minlength=len(features))
+    accuracies = corrects / np.maximum(totals, 1)
+
+    return {'slot3_accuracy': _divide(correct.sum(), len(correct)),
+            'slot3_mean_accuracy': (float(accuracies.mean())
+                                    if len(features) else 0.0),
+            'slot3_accuracy_per_feature': dict(zip(features,
+                                                   accuracies.tolist()))}
+
+
+def score_run(run_directory):
+    """
+    Compute the slot 1 and slot 3 measures of a run.
+    :return: Dictionary of the measures, with the run under the key 'run'.
+    """
+
+    predictions = load_predictions(run_directory)
+    scores = {'run': run_directory, 'opinions': len(predictions)}
+    scores.update(slot1_scores(predictions))
+    scores.update(slot3_scores(predictions))
+    return scores
+
+
+def score_runs(run_directories, processes=1):
+    """
+    Score several runs, in parallel if processes > 1.
+    :return: Pandas.DataFrame with one row per run, sorted like
+    run_directories.
+    """
+
+    if processes > 1 and len(run_directories) > 1:
+        with multiprocessing.Pool(min(processes,
+                                      len(run_directories))) as pool:
+            all_scores = pool.map(score_run, run_directories)
+    else:
+        all_scores = [score_run(run) for run in run_directories]
+
+    for scores in all_scores:
+        del scores['slot3_accuracy_per_feature']
+
+    return pd.DataFrame(all_scores, columns=[
+            'run', 'opinions', 'slot1_precision', 'slot1_recall', 'slot1_f1',
+            'slot3_accuracy', 'slot3_mean_accuracy'])
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+            description="Score runs with the measures of the SemEval 2016 "
+                        "competition (slot 1 and slot 3)")
+    parser.add_argument("runs", nargs='+',
+                        help="Folders of runs (or predictions.csv files)")
+    parser.add_argument("--processes", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Number of runs scored in parallel")
+    parser.add_argument("--output", default="",
+                        help="CSV file where the comparison table is saved")
+    args = parser.parse_args()
+
+    table = score_runs(args.runs, args.processes)
+    with pd.option_context('display.max_colwidth', 200,
+                           'display.width', 200):
+        print(table.to_string(index=False, float_format="{:.4f}".format))
+
+    if args.output:
+        table.to_csv(args.output, index=False)
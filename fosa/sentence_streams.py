@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+"""
+Streams of the sentences scored by batch_prediction.py and
+sharded_prediction.py.
+
+The sentences are read one by one from JSONL, CSV or SemEval XML files (or
+stdin) and grouped into chunks. For the sharded scoring, the chunks are
+dealt to the shards in turn and the outputs of the shards are merged back
+in the order of the input.
+"""
+
+import csv
+import itertools
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+# Constants
+# ==================================================
+
+INPUT_FORMATS = ['jsonl', 'csv', 'xml']
+
+# Readers
+# ==================================================
+
+
+def read_jsonl(stream):
+    """
+    Read sentences from a JSONL stream. Each line is a JSON object with a
+    'text' key and optional 'review_id' and 'sentence_id' keys.
+    :param stream: Text stream opened for reading.
+    :return: Generator of dictionaries with the keys review_id, sentence_id
+    and text.
+    """
+
+    for line_number, line in enumerate(stream):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        yield {'review_id': record.get('review_id'),
+               'sentence_id': record.get('sentence_id', line_number),
+               'text': record['text']}
+
+
+def read_csv(stream):
+    """
+    Read sentences from a CSV stream. The first line is a header which must
+    contain a 'text' column, 'review_id' and 'sentence_id' columns are
+    optional.
+    :param stream: Text stream opened for reading.
+    :return: Generator of dictionaries with the keys review_id, sentence_id
+    and text.
+    """
+
+    for line_number, record in enumerate(csv.DictReader(stream)):
+        yield {'review_id': record.get('review_id'),
+               'sentence_id': record.get('sentence_id', line_number),
+               'text': record['text']}
+
+
+def read_semeval_xml(stream):
+    """
+    Read sentences from a SemEval 2016 XML stream (Task 5, Subtask 1). The
+    document is parsed incrementally and each element is freed as soon as it
+    has been read, so the whole tree is never held in memory.
+    :param stream: Binary stream opened for reading.
+    :return: Generator of dictionaries with the keys review_id, sentence_id
+    and text.
+    """
+
+    root = None
+    review_id = None
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            if element.tag == 'Review':
+                review_id = element.get('rid')
+            continue
+
+        if element.tag == 'sentence':
+            yield {'review_id': review_id,
+                   'sentence_id': element.get('id'),
+                   'text': element.findtext('text', default='')}
+            element.clear()
+        elif element.tag == 'Review':
+            # The root keeps a reference to every review already read
+            root.clear()
+
+
+def detect_input_format(filepath):
+    """
+    Deduce the format of an input file from its extension.
+    :param filepath: Path of the input file.
+    :type filepath: string
+    :return: 'jsonl', 'csv' or 'xml'.
+    """
+
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension in ('.jsonl', '.json'):
+        return 'jsonl'
+    elif extension == '.csv':
+        return 'csv'
+    elif extension == '.xml':
+        return 'xml'
+    else:
+        raise ValueError("Unable to detect the format of '{}', use the "
+                         "'input_format' parameter".format(filepath))
+
+
+def iter_sentences(filepath, input_format='auto'):
+    """
+    Read the sentences of an input file one by one.
+    :param filepath: Path of the input file, '-' to read from stdin.
+    :type filepath: string
+    :param input_format: 'auto', 'jsonl', 'csv' or 'xml'. If 'auto' is
+    specified, the format is deduced from the extension of the file.
+    :type input_format: string
+    :return: Generator of dictionaries with the keys review_id, sentence_id
+    and text.
+    """
+
+    if input_format == 'auto':
+        if filepath == '-':
+            raise ValueError("'input_format' must be specified when " +
+                             "reading from stdin")
+        input_format = detect_input_format(filepath)
+    if input_format not in INPUT_FORMATS:
+        raise ValueError("'input_format' parameter must be 'auto', " +
+                         "'jsonl', 'csv' or 'xml'")
+
+    if input_format == 'xml':
+        if filepath == '-':
+            yield from read_semeval_xml(sys.stdin.buffer)
+        else:
+            with open(filepath, 'rb') as stream:
+                yield from read_semeval_xml(stream)
+        return
+
+    reader = read_jsonl if input_format == 'jsonl' else read_csv
+    if filepath == '-':
+        yield from reader(sys.stdin)
+    else:
+        with open(filepath, 'r', encoding='utf-8', newline='') as stream:
+            yield from reader(stream)
+
+
+def iter_chunks(iterable, chunk_size):
+    """
+    Group the items of an iterable into lists of at most chunk_size items.
+    """
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Shards
+# ==================================================
+
+
+def split_into_shards(sentences, shard_folder, num_shards, chunk_size):
+    """
+    Split the sentences into shards written as JSONL files. The chunks of
+    sentences are dealt to the shards in turn : chunk k goes to the shard
+    k % num_shards. Hence merge_shards can restore the order of the input.
+    :param sentences: Iterable of dictionaries with the keys review_id,
+    sentence_id and text (see iter_sentences).
+    :param shard_folder: Folder where the shards are written.
+    :type shard_folder: string
+    :return: List of the paths of the shards.
+    """
+
+    shard_paths = [os.path.join(shard_folder, "shard_{}.jsonl".format(i))
+                   for i in range(num_shards)]
+    shard_files = [open(path, 'w', encoding='utf-8')
+                   for path in shard_paths]
+    try:
+        chunks = iter_chunks(sentences, chunk_size)
+        for chunk_number, chunk in enumerate(chunks):
+            shard_file = shard_files[chunk_number % num_shards]
+            for sentence in chunk:
+                shard_file.write(json.dumps(sentence) + "\n")
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+
+    return shard_paths
+
+
+def merge_shards(shard_paths, writer):
+    """
+    Merge the outputs of the workers in the order of the input. This is the
+    reverse operation of split_into_shards. The rows of the workers start
+    with the number of their chunk, which is removed during the merge.
+    :param shard_paths: Paths of the CSV outputs of the workers.
+    :param writer: csv.writer the merged predictions are written to.
+    """
+
+    shard_files = [open(path, 'r', encoding='utf-8', newline='')
+                   for path in shard_paths]
+    try:
+        chunks = [itertools.groupby(csv.reader(shard_file),
+                                    key=lambda row: row[0])
+                  for shard_file in shard_files]
+        remaining_chunks = list(chunks)
+        while remaining_chunks:
+            for shard_chunks in list(remaining_chunks):
+                chunk = next(shard_chunks, None)
+                if chunk is None:
+                    remaining_chunks.remove(shard_chunks)
+                    continue
+                writer.writerows(row[1:] for row in chunk[1])
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+"""
+Thread pools and CPU placement of the TensorFlow sessions.
+
+By default a TensorFlow session uses one thread per core for its intra-op and
+inter-op pools. When several jobs share a many-core host, each job should
+rather get a part of the cores : the settings of the 'session' section of the
+'config.yml' file (or the flags of the scripts) limit the pools and pin the
+process to some cores.
+
+The autotuner measures a few training steps of the current model with
+several settings of the pools and stores the fastest one in a JSON file, by
+shape of the model, so that the next runs of the same shape reuse it.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+
+# Constants
+# ==================================================
+
+DEFAULT_SETTINGS = {
+    'intra_op_parallelism_threads': 0,
+    'inter_op_parallelism_threads': 0,
+    'cpu_affinity': '',
+    'embedding_device': '/cpu:0',
+    'tuning_file': 'session_tuning.json',
+}
+
+# Functions
+# ==================================================
+
+
+def get_session_settings(config_file, intra_op_threads=-1, inter_op_threads=-1,
+                         cpu_affinity=None):
+    """
+    Settings of the sessions : the 'session' section of the 'config.yml' file
+    overridden by the flags of the script.
+    :param config_file: The configuration file of the project opened with yaml
+    library.
+    :param intra_op_threads: Size of the intra-op pool, -1 to keep the value
+    of the configuration file, 0 to let TensorFlow choose.
+    :param inter_op_threads: Same for the inter-op pool.
+    :param cpu_affinity: List of cores (see parse_cpu_list), None to keep the
+    value of the configuration file.
+    :return: Dictionary with the keys of DEFAULT_SETTINGS.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update((config_file or {}).get('session') or {})
+    if intra_op_threads >= 0:
+        settings['intra_op_parallelism_threads'] = intra_op_threads
+    if inter_op_threads >= 0:
+        settings['inter_op_parallelism_threads'] = inter_op_threads
+    if cpu_affinity is not None:
+        settings['cpu_affinity'] = cpu_affinity
+    return settings
+
+
+def parse_cpu_list(cpu_list):
+    """
+    :param cpu_list: Cores written as in taskset, e.g. "0-3,8".
+    :return: Sorted list of the ids of the cores.
+    """
+
+    cpus = set()
+    for part in str(cpu_list or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def available_cpus():
+    """
+    :return: List of the cores the process can run on.
+    """
+
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def apply_cpu_affinity(cpus):
+    """
+    Pin the current process to some cores (Linux only).
+    :param cpus: List of cores or string (see parse_cpu_list). Nothing is
+    done if empty.
+    :return: True if the process has been pinned.
+    """
+
+    if isinstance(cpus, str):
+        cpus = parse_cpu_list(cpus)
+    if not cpus:
+        return False
+    if not hasattr(os, 'sched_setaffinity'):
+        raise ValueError("CPU affinity is not supported on this platform")
+    os.sched_setaffinity(0, cpus)
+    return True
+
+
+def split_cpus(cpus, parts):
+    """
+    Split cores into contiguous groups, one per process.
+    :return: List of parts lists of cores. When there are fewer cores than
+    parts, the cores are shared in turn.
+    """
+
+    if len(cpus) < parts:
+        return [[cpus[part % len(cpus)]] for part in range(parts)]
+    size = len(cpus) // parts
+    return [cpus[part * size:(part + 1) * size] for part in range(parts)]
+
+
+def make_session_config(settings, allow_soft_placement=True,
+                        log_device_placement=False, **kwargs):
+    """
+    :param settings: See get_session_settings.
+    :param kwargs: Other fields of the tf.ConfigProto.
+    :return: tf.ConfigProto of the settings.
+    """
+
+    import tensorflow as tf
+    return tf.ConfigProto(
+            allow_soft_placement=allow_soft_placement,
+            log_device_placement=log_device_placement,
+            intra_op_parallelism_threads=int(
+                    settings['intra_op_parallelism_threads']),
+            inter_op_parallelism_threads=int(
+                    settings['inter_op_parallelism_threads']),
+            **kwargs)
+
+
+# Autotuner
+# ==================================================
+
+
+def candidate_settings(num_cpus=None):
+    """
+    :return: List of the (intra_op, inter_op) sizes of the pools tried by
+    the autotuner : 1, half and all the cores for the intra-op pool, 1 and 2
+    threads for the inter-op pool.
+    """
+
+    num_cpus = num_cpus or len(available_cpus())
+    intra_op = sorted(set([1, max(1, num_cpus // 2), num_cpus]))
+    return [(intra, inter) for intra in intra_op for inter in [1, 2]]
+
+
+def tuning_key(**shape):
+    """
+    :param shape: Parameters of the shape of the model (sequence length,
+    vocabulary size, batch size...).
+    :return: Key of the tuned settings of this shape on this host.
+    """
+
+    shape['cpus'] = len(available_cpus())
+    return "/".join("{}={}".format(name, shape[name])
+                    for name in sorted(shape))
+
+
+def load_tuned_settings(tuning_file, key):
+    """
+    :return: The settings stored by save_tuned_settings for the key, None if
+    there is none.
+    """
+
+    if not tuning_file or not os.path.exists(tuning_file):
+        return None
+    with open(tuning_file, 'r') as f:
+        return json.load(f).get(key)
+
+
+def save_tuned_settings(tuning_file, key, settings):
+    """
+    Store the settings of a key in the tuning file, along with the settings
+    of the other keys.
+    """
+
+    tuned = {}
+    if os.path.exists(tuning_file):
+        with open(tuning_file, 'r') as f:
+            tuned = json.load(f)
+    tuned[key] = settings
+    with open(tuning_file + ".tmp", 'w') as f:
+        json.dump(tuned, f, indent=2, sort_keys=True)
+    os.replace(tuning_file + ".tmp", tuning_file)
+
+
+def autotune(build_step, candidates=None, steps=10,
+             allow_soft_placement=True):
+    """
+    Measure a step of a model with several sizes of the thread pools.
+    :param build_step: Function building the model in the default graph and
+    returning the (fetches, feed_dict) of one step.
+    :param candidates: List of (intra_op, inter_op) sizes. Default : see
+    candidate_settings.
+    :param steps: Number of measured steps, after one warm-up step.
+    :return: List of dictionaries with the keys
+    intra_op_parallelism_threads, inter_op_parallelism_threads and
+    seconds_per_step, the fastest first.
+    """
+
+    import tensorflow as tf
+
+    results = []
+    for intra_op, inter_op in candidates or candidate_settings():
+        with tf.Graph().as_default():
+            fetches, feed_dict = build_step()
+            # Without per-session threads, the inter-op pool of the first
+            # session would be shared by all the candidates
+            config = tf.ConfigProto(
+                    allow_soft_placement=allow_soft_placement,
+                    intra_op_parallelism_threads=intra_op,
+                    inter_op_parallelism_threads=inter_op,
+                    use_per_session_threads=True)
+            with tf.Session(config=config) as sess:
+                sess.run(tf.global_variables_initializer())
+                sess.run(fetches, feed_dict)
+                start = time.perf_counter()
+                for _ in range(steps):
+                    sess.run(fetches, feed_dict)
+                elapsed = time.perf_counter() - start
+        results.append({'intra_op_parallelism_threads': intra_op,
+                        'inter_op_parallelism_threads': inter_op,
+                        'seconds_per_step': elapsed / steps})
+    return sorted(results, key=lambda result: result['seconds_per_step'])
@@ -0,0 +1,305 @@
+#! /usr/bin/env python3
+
+"""
+Sharded batch prediction part of the algorithm.
+
+The input corpus is split into N shards, each shard is scored by its own
+worker process holding a warm CNN_feature/CNN_polarity pair (see
+batch_prediction.py), and the outputs of the workers are merged back in the
+order of the input. The number of threads of each TensorFlow session is
+bounded so that the workers share the cores of the host instead of
+oversubscribing them.
+"""
+
+import tensorflow as tf
+import multiprocessing
+import os
+import sys
+import csv
+import time
+import shutil
+import tempfile
+import yaml
+import logging
+
+# Project modules
+import batch_prediction as bp
+from cache import PredictionCache
+import session_config as sc
+import logs
+from sentence_streams import split_into_shards, merge_shards
+
+# Same logger as the one configured by the entry points
+logger = logging.getLogger()
+
+# Functions
+# ==================================================
+
+
+def score_shard(shard):
+    """
+    Score one shard in a worker process. Both CNNs are loaded once in the
+    worker and their sessions are limited to the given thread budget.
+    :param shard: Dictionary with the keys input_path, output_path,
+    checkpoint_dir, batch_size, chunk_size, session_settings (see
+    session_config.get_session_settings), intra_op_threads (intra-op pool
+    of the worker, which overrides the one of session_settings),
+    cache_size, cache_path, multilabel, threshold, top_k,
+    target_names_feature and target_names_polarity, and optionally cpus
+    (cores the worker is pinned to).
+    :return: Number of scored sentences and time spent scoring them.
+    """
+
+    # Log the progress of the worker on the console
+    worker_logger = logging.getLogger()
+    if not worker_logger.handlers:
+        worker_logger.setLevel(logging.INFO)
+        console_handler = logging.StreamHandler(sys.stderr)
+        console_handler.setFormatter(logging.Formatter(
+                "[" + os.path.basename(shard['input_path']) + "] "
+                "%(message)s"))
+        worker_logger.addHandler(console_handler)
+
+    # Each worker runs on its own cores
+    if sc.apply_cpu_affinity(shard.get('cpus')):
+        worker_logger.info("Worker pinned to the cores {}".format(
+                shard['cpus']))
+
+    session_settings = dict(
+            shard['session_settings'],
+            intra_op_parallelism_threads=shard['intra_op_threads'])
+    session_conf = sc.make_session_config(session_settings)
+
+    cache = None
+    if shard['cache_size'] > 0:
+        cache = PredictionCache(shard['cache_size'],
+                                shard['cache_path'] or None)
+
+    feature_predictor = bp.CNNPredictor(shard['checkpoint_dir'], 'feature',
+                                        shard['batch_size'], session_conf,
+                                        cache, shard['multilabel'])
+    polarity_predictor = bp.CNNPredictor(shard['checkpoint_dir'], 'polarity',
+                                         shard['batch_size'], session_conf,
+                                         cache)
+
+    start_time = time.time()
+    try:
+        with open(shard['output_path'], 'w', encoding='utf-8',
+                  newline='') as output_file:
+            number_of_rows = bp.score_stream(
+                    bp.iter_sentences(shard['input_path'], 'jsonl'),
+                    feature_predictor, polarity_predictor,
+                    shard['target_names_feature'],
+                    shard['target_names_polarity'],
+                    csv.writer(output_file), shard['chunk_size'],
+                    threshold=shard['threshold'], top_k=shard['top_k'],
+                    with_chunk_number=True)
+    finally:
+        feature_predictor.close()
+        polarity_predictor.close()
+        if cache is not None:
+            worker_logger.info("Cache : {}".format(cache.metrics()))
+            cache.close()
+
+    return number_of_rows, time.time() - start_time
+
+
+def sharded_scoring(input_file, input_format, output_file, num_workers,
+                    worker_args, chunk_size, tmp_dir=None):
+    """
+    Score an input file with num_workers worker processes.
+    :param worker_args: Arguments shared by every worker (see score_shard).
+    :type worker_args: dict
+    :return: Number of scored sentences and wall time of the whole scoring
+    (split, scoring and merge).
+    """
+
+    start_time = time.time()
+    shard_folder = tempfile.mkdtemp(prefix="shards_", dir=tmp_dir)
+    try:
+        input_paths = split_into_shards(
+                bp.iter_sentences(input_file, input_format), shard_folder,
+                num_workers, chunk_size)
+        logger.info("Input split into {} shards in {:.1f}s".format(
+                num_workers, time.time() - start_time))
+
+        worker_cpus = sc.split_cpus(sc.available_cpus(), num_workers)
+        shards = []
+        for index, input_path in enumerate(input_paths):
+            shard = dict(worker_args)
+            shard['input_path'] = input_path
+            shard['output_path'] = input_path.replace('.jsonl', '.csv')
+            shard['chunk_size'] = chunk_size
+            if worker_args.get('pin_workers'):
+                shard['cpus'] = worker_cpus[index]
+            shards.append(shard)
+
+        # TensorFlow sessions must not be shared with forked processes
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(num_workers) as pool:
+            results = pool.map(score_shard, shards, chunksize=1)
+
+        with open(output_file, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(bp.OUTPUT_COLUMNS)
+            merge_shards([shard['output_path'] for shard in shards], writer)
+    finally:
+        shutil.rmtree(shard_folder, ignore_errors=True)
+
+    number_of_rows = sum(rows for rows, _ in results)
+    return number_of_rows, time.time() - start_time
+
+
+if __name__ == '__main__':
+
+    with open("config.yml", 'r') as ymlfile:
+        cfg = yaml.load(ymlfile)
+
+    # Parameters
+    # ==================================================
+
+    # Data Parameters
+    tf.flags.DEFINE_string("input_file", "", "File to score")
+    tf.flags.DEFINE_string("input_format", "auto",
+                           "'auto', 'jsonl', 'csv' or 'xml' (default: auto)")
+    tf.flags.DEFINE_string("output_file", "predictions_batch.csv",
+                           "CSV file where the predictions are written")
+    tf.flags.DEFINE_string("tmp_dir", None,
+                           "Folder where the shards are stored during the "
+                           "scoring (default: system temporary folder)")
+
+    # Eval Parameters
+    tf.flags.DEFINE_integer("batch_size", 64, "Batch Size (default: 64)")
+    tf.flags.DEFINE_integer("chunk_size", 10000,
+                            "Number of sentences held in memory at once by "
+                            "each worker (default: 10000)")
+    tf.flags.DEFINE_string("checkpoint_dir", "",
+                           "Checkpoint directory from training run")
+
+    # Cache Parameters
+    tf.flags.DEFINE_integer("cache_size", 100000,
+                            "Number of sentences whose outputs are kept in "
+                            "memory by each worker, 0 to disable the cache "
+                            "(default: 100000)")
+    tf.flags.DEFINE_string("cache_path", "",
+                           "SQLite file used as on-disk tier of the cache, "
+                           "shared by the workers (default: no disk tier)")
+
+    # Parallelism Parameters
+    tf.flags.DEFINE_integer("num_workers", multiprocessing.cpu_count(),
+                            "Number of worker processes (default: number of "
+                            "cores)")
+    tf.flags.DEFINE_integer("intra_op_threads", 0,
+                            "Threads used by each TensorFlow session "
+                            "(default: cores divided by the number of "
+                            "workers)")
+    tf.flags.DEFINE_integer("inter_op_threads", -1,
+                            "Threads of the inter-op pool of each "
+                            "TensorFlow session, 0 to let TensorFlow choose "
+                            "(default: config.yml)")
+    tf.flags.DEFINE_string("cpu_affinity", None,
+                           "Cores shared by the workers, e.g. '0-3,8' "
+                           "(default: config.yml)")
+    tf.flags.DEFINE_boolean("pin_workers", False,
+                            "Pin each worker to its own slice of the cores "
+                            "(Linux only, default: False)")
+    tf.flags.DEFINE_boolean("scaling", False,
+                            "Score the input with 1, 2, 4... up to "
+                            "num_workers workers and report the throughput "
+                            "of each run")
+
+    tf.flags.DEFINE_boolean("aspects",
+                            False,
+                            "Scope widened to aspects and not only entities")
+
+    # Multi-label Parameters
+    tf.flags.DEFINE_boolean("multilabel",
+                            False,
+                            "CNN_feature has been trained as a multi-label "
+                            "classifier (see train.py)")
+    tf.flags.DEFINE_float("threshold", 0.5,
+                          "Minimal probability of a feature detected in a "
+                          "sentence (default: 0.5)")
+    tf.flags.DEFINE_integer("top_k", 3,
+                            "Maximal number of features detected in a "
+                            "sentence (default: 3)")
+
+    FLAGS = tf.flags.FLAGS
+    FLAGS._parse_flags()
+
+    # Logger
+    # ==================================================
+
+    # Log file of the run (see logs.py)
+    logs.setup_logging(os.path.join(FLAGS.checkpoint_dir, "sharded.log"),
+                       shared_log_file=None)
+    logger.debug(" *** Parameters *** ")
+    for attr, value in sorted(FLAGS.__flags.items()):
+        logger.debug("{}={}".format(attr.upper(), value))
+    logger.debug("")
+
+    # ==================================================
+    # Scoring
+    # ==================================================
+
+    # The intra-op pool of each worker is set below from its share of the
+    # cores. The workers inherit the affinity of this process
+    session_settings = sc.get_session_settings(
+            cfg, inter_op_threads=FLAGS.inter_op_threads,
+            cpu_affinity=FLAGS.cpu_affinity)
+    if sc.apply_cpu_affinity(session_settings['cpu_affinity']):
+        logger.info("Process pinned to the cores {}".format(
+                session_settings['cpu_affinity']))
+
+    if FLAGS.scaling:
+        # Powers of two up to num_workers
+        workers_to_test = []
+        i = 0
+        while 2 ** i < FLAGS.num_workers:
+            workers_to_test.append(2 ** i)
+            i += 1
+        workers_to_test.append(FLAGS.num_workers)
+    else:
+        workers_to_test = [FLAGS.num_workers]
+
+    results = []
+    for num_workers in workers_to_test:
+        intra_op_threads = FLAGS.intra_op_threads or max(
+                1, len(sc.available_cpus()) // num_workers)
+        worker_args = {
+            'checkpoint_dir': FLAGS.checkpoint_dir,
+            'batch_size': FLAGS.batch_size,
+            'session_settings': session_settings,
+            'intra_op_threads': intra_op_threads,
+            'pin_workers': FLAGS.pin_workers,
+            'cache_size': FLAGS.cache_size,
+            'cache_path': FLAGS.cache_path,
+            'multilabel': FLAGS.multilabel,
+            'threshold': FLAGS.threshold,
+            'top_k': FLAGS.top_k,
+            'target_names_feature': bp.get_target_names(cfg, 'feature',
+                                                        FLAGS.aspects),
+            'target_names_polarity': bp.get_target_names(cfg, 'polarity')}
+
+        logger.info("")
+        logger.info(" *** Scoring with {} workers ({} threads each) *** "
+                    .format(num_workers, intra_op_threads))
+        number_of_rows, elapsed_time = sharded_scoring(
+                FLAGS.input_file, FLAGS.input_format, FLAGS.output_file,
+                num_workers, worker_args, FLAGS.chunk_size, FLAGS.tmp_dir)
+        throughput = number_of_rows / max(elapsed_time, 1e-9)
+        logger.info("{} sentences scored in {:.1f}s ({:.1f} sentences/s)"
+                    .format(number_of_rows, elapsed_time, throughput))
+        results.append((num_workers, throughput))
+
+    # ==================================================
+    # Scaling report
+    # ==================================================
+
+    logger.info("")
+    logger.info("Workers | Sentences/s | Speedup | Efficiency")
+    for num_workers, throughput in results:
+        speedup = throughput / results[0][1]
+        logger.info("{:>7} | {:>11.1f} | {:>6.2f}x | {:>9.0%}".format(
+                num_workers, throughput, speedup,
+                speedup * results[0][0] / num_workers))
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+"""
+Generator of synthetic datasets in the format of SemEval 2016 (Task 5,
+Subtask 1), used to stress-test the parsing, training and prediction paths
+at the scale of 100 or 1000 times the real datasets.
+
+The XML document is written review by review, so that a dataset of any size
+is generated with a constant memory. The generation is controlled by :
+
+    - the number of reviews, or a scale relative to the real dataset of the
+      domain (see REFERENCE_REVIEWS)
+    - the number of sentences per review, of opinions per sentence and of
+      words per sentence (ranges of values drawn uniformly)
+    - the distributions of the categories and of the polarities (weights)
+
+Each opinion adds a word of its entity and a word of its polarity to the
+sentence, so that the CNNs have something to learn from the synthetic data.
+
+Usage : python synthetic.py --domain RESTAURANT --scale 100 --output_dir
+../data/synthetic/restaurant_x100 writes train.xml and test/test_gold.xml,
+which are declared as a domain in the 'config.yml' file (see domains.py).
+"""
+
+import argparse
+import bisect
+import os
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+# Project modules
+import domains as dm
+
+# Constants
+# ==================================================
+
+# Number of reviews of the real training datasets
+REFERENCE_REVIEWS = {'RESTAURANT': 350, 'LAPTOP': 450}
+
+SENTENCES_PER_REVIEW = (1, 10)
+OPINIONS_PER_SENTENCE = (0, 3)
+SENTENCE_LENGTH = (4, 30)
+
+# Filler words of the sentences. Some of them need to be cleaned by
+# preprocessing.clean_str (contractions, punctuation)
+WORDS = ['the', 'food', 'was', 'great', 'but', 'service', 'slow', 'and',
+         'waiter', "didn't", 'care', 'price', 'is', 'fair', 'for', 'such',
+         'a', 'place', "it's", 'noisy', 'we', "we've", 'loved', 'wine',
+         'list', 'sushi', 'fresh', 'never', 'again', 'staff', 'friendly',
+         'view', 'dessert', '(really)', 'good!', 'why?', 'drinks,', 'screen',
+         'battery', 'keyboard', 'fast', 'it', 'with', 'this', 'one', 'very']
+
+POLARITY_WORDS = {'positive': ['great', 'excellent', 'loved'],
+                  'neutral': ['okay', 'average', 'decent'],
+                  'negative': ['awful', 'terrible', 'hated']}
+
+# Functions
+# ==================================================
+
+
+def domain_categories(domain, aspects=True):
+    """
+    Categories (E#A) of the opinions of a synthetic dataset of the domain :
+    its aspects if it defines aspects, otherwise its entities and the
+    entities it simplifies, with the attribute GENERAL.
+    :param domain: Name of a registered domain or domains.Domain.
+    :param aspects: If False, the categories are built from the entities even
+    if the domain defines aspects.
+    """
+
+    if not isinstance(domain, dm.Domain):
+        domain = dm.get_domain(domain)
+    if domain.uses_aspects(aspects):
+        return list(domain.aspects.names)
+    entities = list(domain.entities.names) + sorted(domain.simplify)
+    return ["{}#GENERAL".format(entity) for entity in entities]
+
+
+def _weights(names, weights):
+    """
+    :param weights: Dictionary name -> weight, the names which are not in the
+    dictionary have the weight 0. Default : uniform distribution.
+    :return: List of the cumulative weights of names (see _choice).
+    """
+
+    if weights is None:
+        values = [1.0] * len(names)
+    else:
+        unknown = set(weights) - set(names)
+        if unknown:
+            raise ValueError("Unknown labels in the weights : {}".format(
+                    ", ".join(sorted(unknown))))
+        values = [float(weights.get(name, 0)) for name in names]
+    if sum(values) <= 0:
+        raise ValueError("The weights must have a positive sum")
+
+    cumulative = []
+    total = 0.0
+    for value in values:
+        total += value
+        cumulative.append(total)
+    return cumulative
+
+
+def _choice(rng, names, cumulative):
+    """
+    Draw one of names following its cumulative weights.
+    """
+
+    return names[bisect.bisect_right(cumulative,
+                                     rng.random() * cumulative[-1])]
+
+
+def generate_reviews(num_reviews, categories, category_weights=None,
+                     polarities=dm.POLARITY, polarity_weights=None,
+                     sentences_per_review=SENTENCES_PER_REVIEW,
+                     opinions_per_sentence=OPINIONS_PER_SENTENCE,
+                     sentence_length=SENTENCE_LENGTH, seed=42):
+    """
+    Generate synthetic reviews.
+    :param categories: Categories (E#A) of the opinions.
+    :param category_weights: Dictionary category -> weight. Default : uniform
+    distribution.
+    :param polarity_weights: Dictionary polarity -> weight. Default : uniform
+    distribution.
+    :param sentences_per_review: (min, max) number of sentences of a review.
+    :param opinions_per_sentence: (min, max) number of opinions of a
+    sentence.
+    :param sentence_length: (min, max) number of filler words of a sentence.
+    :return: Iterator of (review_id, sentences) where sentences is the list
+    of (sentence_id, text, opinions) and opinions the list of (category,
+    polarity).
+    """
+
+    rng = random.Random(seed)
+    category_cumulative = _weights(categories, category_weights)
+    polarity_cumulative = _weights(polarities, polarity_weights)
+
+    for review_index in range(num_reviews):
+        review_id = str(review_index)
+        sentences = []
+        for sentence_index in range(rng.randint(*sentences_per_review)):
+            num_opinions = rng.randint(*opinions_per_sentence)
+            opinions = [(_choice(rng, categories, category_cumulative),
+                         _choice(rng, polarities, polarity_cumulative))
+                        for _ in range(num_opinions)]
+
+            words = [rng.choice(WORDS)
+                     for _ in range(rng.randint(*sentence_length))]
+            for category, polarity in opinions:
+                entity = category.split('#')[0].lower().replace('_', ' ')
+                words.insert(rng.randint(0, len(words)), entity)
+                words.insert(rng.randint(0, len(words)),
+                             rng.choice(POLARITY_WORDS.get(polarity, WORDS)))
+
+            sentences.append(("{}:{}".format(review_id, sentence_index),
+                              " ".join(words).capitalize() + ".", opinions))
+        yield review_id, sentences
+
+
+def write_semeval_xml(filepath, reviews):
+    """
+    Write reviews (see generate_reviews) into an XML document in the format
+    of SemEval 2016, one review at a time.
+    :return: Dictionary with the number of reviews, sentences and opinions
+    written.
+    """
+
+    folder = os.path.dirname(filepath)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    stats = {'reviews': 0, 'sentences': 0, 'opinions': 0}
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n')
+        f.write('<Reviews>\n')
+        for review_id, sentences in reviews:
+            lines = ['    <Review rid={}>'.format(quoteattr(review_id)),
+                     '        <sentences>']
+            for sentence_id, text, opinions in sentences:
+                lines.append('            <sentence id={}>'.format(
+                        quoteattr(sentence_id)))
+                lines.append('                <text>{}</text>'.format(
+                        escape(text)))
+                if opinions:
+                    lines.append('                <Opinions>')
+                    for category, polarity in opinions:
+                        lines.append(
+                                '                    <Opinion target="NULL" '
+                                'category={} polarity={} from="0" '
+                                'to="0"/>'.format(quoteattr(category),
+                                                  quoteattr(polarity)))
+                    lines.append('                </Opinions>')
+                lines.append('            </sentence>')
+                stats['opinions'] += len(opinions)
+            lines.append('        </sentences>')
+            lines.append('    </Review>')
+            f.write("\n".join(lines) + "\n")
+            stats['reviews'] += 1
+            stats['sentences'] += len(sentences)
+        f.write('</Reviews>\n')
+    return stats
+
+
+def generate_semeval_xml(filepath, domain='RESTAURANT', scale=1.0,
+                         num_reviews=None, aspects=True, seed=42, **kwargs):
+    """
+    Write a synthetic dataset of a domain.
+    :param domain: Name of a registered domain or domains.Domain.
+    :param scale: Size of the dataset relative to the real training dataset
+    of the domain (see REFERENCE_REVIEWS). Ignored if num_reviews is given.
+    :param num_reviews: Number of reviews.
+    :param aspects: See domain_categories.
+    :param kwargs: Other parameters of generate_reviews.
+    :return: Dictionary with the number of reviews, sentences and opinions
+    written.
+    """
+
+    if not isinstance(domain, dm.Domain):
+        domain = dm.get_domain(domain)
+    if num_reviews is None:
+        num_reviews = int(round(scale * REFERENCE_REVIEWS.get(
+                domain.name, REFERENCE_REVIEWS['RESTAURANT'])))
+
+    reviews = generate_reviews(num_reviews,
+                               domain_categories(domain, aspects),
+                               polarities=list(domain.polarities.names),
+                               seed=seed, **kwargs)
+    return write_semeval_xml(filepath, reviews)
+
+
+def register_synthetic_domain(name, domain, train_path, test_path):
+    """
+    Register a domain with the labels of domain and synthetic dataset files.
+    :param domain: Name of a registered domain or domains.Domain.
+    :return: The new domains.Domain.
+    """
+
+    if not isinstance(domain, dm.Domain):
+        domain = dm.get_domain(domain)
+    aspects = list(domain.aspects.names) if domain.aspects else None
+    return dm.register_domain(dm.Domain(
+            name, train_path, test_path, list(domain.entities.names),
+            aspects, domain.simplify, list(domain.polarities.names)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+            description="Generate a synthetic SemEval dataset")
+    parser.add_argument("--domain", default='RESTAURANT',
+                        help="Domain whose labels are used "
+                             "(default: RESTAURANT)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Size relative to the real training dataset "
+                             "(default: 1)")
+    parser.add_argument("--num_reviews", type=int, default=None,
+                        help="Number of reviews of the training dataset "
+                             "(overrides --scale)")
+    parser.add_argument("--test_ratio", type=float, default=0.25,
+                        help="Size of the test dataset relative to the "
+                             "training dataset (default: 0.25)")
+    parser.add_argument("--entities_only", action='store_true',
+                        help="Build the categories from the entities even if "
+                             "the domain defines aspects")
+    parser.add_argument("--max_opinions", type=int,
+                        default=OPINIONS_PER_SENTENCE[1],
+                        help="Maximum number of opinions per sentence "
+                             "(default: {})".format(OPINIONS_PER_SENTENCE[1]))
+    parser.add_argument("--max_length", type=int,
+                        default=SENTENCE_LENGTH[1],
+                        help="Maximum number of filler words per sentence "
+                             "(default: {})".format(SENTENCE_LENGTH[1]))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output_dir", required=True,
+                        help="Folder of train.xml and test/test_gold.xml")
+
+    FLAGS = parser.parse_args()
+
+    domain = dm.get_domain(FLAGS.domain)
+    num_reviews = FLAGS.num_reviews or int(round(
+            FLAGS.scale * REFERENCE_REVIEWS.get(
+                    domain.name, REFERENCE_REVIEWS['RESTAURANT'])))
+    options = {'aspects': not FLAGS.entities_only,
+               'opinions_per_sentence': (OPINIONS_PER_SENTENCE[0],
+                                         FLAGS.max_opinions),
+               'sentence_length': (SENTENCE_LENGTH[0], FLAGS.max_length)}
+
+    train_path = os.path.join(FLAGS.output_dir, 'train.xml')
+    test_path = os.path.join(FLAGS.output_dir, 'test', 'test_gold.xml')
+    for filepath, size, seed in [
+            (train_path, num_reviews, FLAGS.seed),
+            (test_path, max(1, int(num_reviews * FLAGS.test_ratio)),
+             FLAGS.seed + 1)]:
+        stats = generate_semeval_xml(filepath, domain, num_reviews=size,
+                                     seed=seed, **options)
+        print("{} : {} reviews, {} sentences, {} opinions".format(
+                filepath, stats['reviews'], stats['sentences'],
+                stats['opinions']))
+
+    print("")
+    print("Declaration of the dataset in the 'config.yml' file "
+          "(datasets > semeval > domains) :")
+    print("  SYNTHETIC_{}:".format(domain.name))
+    print("    train: {}".format(train_path))
+    print("    test: {}".format(test_path))
+    print("    entities: [{}]".format(", ".join(domain.entities.names)))
+    if domain.aspects is not None:
+        print("    aspects: [{}]".format(", ".join(domain.aspects.names)))
+    if domain.simplify:
+        print("    simplify: {{{}}}".format(", ".join(
+                "{}: {}".format(key, value)
+                for key, value in sorted(domain.simplify.items()))))
@@ -23,30 +23,175 @@ import numpy as np
 import os
 import time
 import datetime
-import logging
+import json
 import yaml
-import math
 
 # Project modules
 import preprocessing as pp
+import data_sources as src
+import prepare as prep
+import profiling
+import session_config as sc
 import CNN
+import logs
 
 # Constants
 # ==================================================
 
 RUN_DIRECTORY = "runs"
-SEMEVAL_FOLDER = '../data/SemEval/Subtask1'
-RESTAURANT_TRAIN = os.path.join(SEMEVAL_FOLDER, 'restaurant', 'train.xml')
-RESTAURANT_TEST = os.path.join(SEMEVAL_FOLDER, 'restaurant', 'test',
-                               'test_gold.xml')
-LAPTOP_TRAIN = os.path.join(SEMEVAL_FOLDER, 'laptop', 'train.xml')
-LAPTOP_TEST = os.path.join(SEMEVAL_FOLDER, 'laptop', 'test', 'test_gold.xml')
+
+# Position of the training loop, saved with each checkpoint
+TRAINING_STATE_FILE = "training_state.json"
+
+# Learning rate schedule : it decays exponentially from the maximum to the
+# minimum value (see learning_rate_schedule)
+MAX_LEARNING_RATE = 0.005
+MIN_LEARNING_RATE = 0.0001
 
 # Functions
 # ==================================================
 
 
-def build_required_data_for_CNN(config_file, focus):
+def save_training_state(checkpoint_dir, state):
+    """
+    Write the position of the training loop next to the checkpoints, so that
+    an interrupted training can be resumed (see --resume_dir).
+    :param state: Dictionary with the keys step, counter, batch_size,
+    num_epochs, shuffle_seed and checkpoint.
+    """
+
+    # Written then renamed : an interruption never leaves a truncated file
+    path = os.path.join(checkpoint_dir, TRAINING_STATE_FILE)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def load_training_state(checkpoint_dir):
+    """
+    :return: The position of the training loop saved with the last
+    checkpoint, None if there is none.
+    """
+
+    path = os.path.join(checkpoint_dir, TRAINING_STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def restore_trunk(sess, cnn, checkpoint_file):
+    """
+    Initialize the embedding and convolution layers of a CNN with the ones of
+    a checkpoint of another run (fine-tuning). The output layer keeps its
+    initial values, as the classes of both runs can differ.
+    """
+
+    shapes = tf.train.NewCheckpointReader(
+            checkpoint_file).get_variable_to_shape_map()
+    for variable in cnn.trunk_variables:
+        name = variable.op.name
+        if name not in shapes:
+            raise ValueError("The variable {} is not in the checkpoint "
+                             "{}".format(name, checkpoint_file))
+        if shapes[name] != variable.get_shape().as_list():
+            raise ValueError("The variable {} has the shape {} in the "
+                             "checkpoint {} instead of {} : both runs must "
+                             "have the same word embeddings, filter sizes and "
+                             "number of filters".format(
+                                     name, shapes[name], checkpoint_file,
+                                     variable.get_shape().as_list()))
+    tf.train.Saver(cnn.trunk_variables).restore(sess, checkpoint_file)
+
+
+def learning_rate_schedule(global_step, decay_speed,
+                           max_learning_rate=MAX_LEARNING_RATE,
+                           min_learning_rate=MIN_LEARNING_RATE):
+    """
+    Dynamic learning rate with a high value at the beginning to speed up the
+    training : min + (max - min) * exp(-step / decay_speed). It is computed
+    in the graph from the global step, so that the training loop does not
+    compute nor feed it.
+    :param global_step: Variable of the number of training steps.
+    :param decay_speed: Number of steps dividing the global step.
+    :return: Tensor of the learning rate of the current step.
+    """
+
+    step = tf.cast(global_step, tf.float32)
+    return tf.add(min_learning_rate,
+                  (max_learning_rate - min_learning_rate) *
+                  tf.exp(-step / decay_speed),
+                  name="learning_rate")
+
+
+def tune_session(required_data, cnn_parameters):
+    """
+    Sizes of the thread pools of the training session : the ones given by
+    the 'config.yml' file or the flags, otherwise the fastest ones found by
+    the autotuner for the shape of the CNN (see session_config.autotune).
+    With --autotune, the sizes are measured again and stored.
+    :param cnn_parameters: Parameters of CNN.TextCNN.
+    :return: Settings of session_config.make_session_config.
+    """
+
+    settings = dict(session_settings)
+    if not FLAGS.autotune and (settings['intra_op_parallelism_threads'] or
+                               settings['inter_op_parallelism_threads']):
+        return settings
+
+    key = sc.tuning_key(
+            sequence_length=cnn_parameters['sequence_length'],
+            num_classes=cnn_parameters['num_classes'],
+            vocab_size=cnn_parameters['vocab_size'],
+            embedding_size=cnn_parameters['embedding_size'],
+            filter_sizes=FLAGS.filter_sizes,
+            num_filters=cnn_parameters['num_filters'],
+            embedding_policy=cnn_parameters['embedding_policy'],
+            fused_convolutions=cnn_parameters['fused_convolutions'],
+            xla_jit=cnn_parameters['xla_jit'],
+            batch_size=FLAGS.batch_size)
+
+    if FLAGS.autotune:
+        batch_indices = required_data['train_indices'][:FLAGS.batch_size]
+        x_batch = required_data['x'][batch_indices]
+        y_batch = required_data['y'][batch_indices]
+
+        decay_speed = (FLAGS.decay_coefficient *
+                       len(required_data['train_indices']) /
+                       FLAGS.batch_size)
+
+        def build_step():
+            # Same training operation as the one of the training loop
+            cnn = CNN.TextCNN(**cnn_parameters)
+            global_step = tf.Variable(0, name="global_step", trainable=False)
+            learning_rate = learning_rate_schedule(global_step, decay_speed)
+            train_op = tf.train.AdamOptimizer(learning_rate).minimize(
+                    cnn.loss, global_step=global_step)
+            return train_op, {cnn.input_x: x_batch,
+                              cnn.input_y: y_batch,
+                              cnn.dropout_keep_prob: FLAGS.dropout_keep_prob}
+
+        logger.info("Autotuning of the thread pools :")
+        results = sc.autotune(build_step, steps=FLAGS.autotune_steps,
+                              allow_soft_placement=FLAGS.allow_soft_placement)
+        for result in results:
+            logger.info("intra_op {intra_op_parallelism_threads}, inter_op "
+                        "{inter_op_parallelism_threads} : "
+                        "{seconds_per_step:.4f}s per step".format(**result))
+        tuned = results[0]
+        sc.save_tuned_settings(settings['tuning_file'], key, tuned)
+    else:
+        tuned = sc.load_tuned_settings(settings['tuning_file'], key)
+
+    if tuned is not None:
+        settings['intra_op_parallelism_threads'] = (
+                tuned['intra_op_parallelism_threads'])
+        settings['inter_op_parallelism_threads'] = (
+                tuned['inter_op_parallelism_threads'])
+    return settings
+
+
+def build_required_data_for_CNN(config_file, focus, vocab_processor=None):
     """
     Compute the different parameters, data to give to a CNN.
     :param config_file: The configuration file of the project opened with yaml
@@ -59,56 +204,96 @@ def build_required_data_for_CNN(config_file, focus):
     focusing on either features or polarities. Raise an error if there is an
     unexpected value.
     :type focus: string
+    :param vocab_processor: Vocabulary of a resumed or fine-tuned run.
+    Default : the vocabulary is fitted on the data.
     """
 
     # Detect errors
     if focus != 'feature' and focus != 'polarity':
         raise ValueError("'focus' parameter must be 'feature' or 'polarity'")
 
+    # Only CNN_feature can be trained as a multi-label classifier, the
+    # polarity is predicted once for the whole sentence
+    multilabel = FLAGS.multilabel and focus == 'feature'
+
     # Load data
     logger.info(" *** Loading data... *** ")
 
-    datasets = None
-    if dataset_name == "semeval":
-        current_domain =\
-            config_file["datasets"][dataset_name]["current_domain"]
-        if current_domain == 'RESTAURANT':
-            datasets = pp.get_dataset_semeval(RESTAURANT_TRAIN, focus,
-                                              FLAGS.aspects)
-        elif current_domain == 'LAPTOP':
-            datasets = pp.get_dataset_semeval(LAPTOP_TRAIN, focus)
-        else:
-            raise ValueError("The 'current_domain' parameter in the " +
-                             "'config.yml' file must be 'RESTAURANT' " +
-                             "or 'LAPTOP'")
-
-    x_text, y = pp.load_data_and_labels(datasets)
-
-    # Build vocabulary
-    max_document_length = max([len(x.split(" ")) for x in x_text])
-    logger.debug("Max document length : %s", max_document_length)
-    vocab_processor = (learn.preprocessing.VocabularyProcessor(
-            max_document_length))
-    x = np.array(list(vocab_processor.fit_transform(x_text)))
-    logger.debug("Data (shape : %s):\n %s", x.shape, x)
-
-    # Randomly shuffle data
+    stage = "CNN_" + focus + "/"
+    embeddings = None
+    if FLAGS.prepared_dir:
+        # Data prepared by prepare.py, memory-mapped
+        with profiler.stage(stage + "load_prepared"):
+            prepared = prep.load_prepared(os.path.join(FLAGS.prepared_dir,
+                                                       'CNN_' + focus))
+        meta = prepared['meta']
+        dataset_name, domain_name = prep.dataset_of_config(config_file)
+        if (meta['dataset'], meta['domain']) != (dataset_name, domain_name):
+            raise ValueError("The data of CNN_{} have been prepared from the "
+                             "dataset {} (domain {}), not from the dataset "
+                             "{} (domain {}) of the 'config.yml' file".format(
+                                     focus, meta['dataset'], meta['domain'],
+                                     dataset_name, domain_name))
+        if meta['multilabel'] != multilabel or (
+                meta['aspects'] != FLAGS.aspects and focus == 'feature'):
+            raise ValueError("The data of CNN_{} have been prepared with "
+                             "aspects={} and multilabel={}".format(
+                                     focus, meta['aspects'],
+                                     meta['multilabel']))
+        # The word ids of the prepared data must be the ones of the
+        # embeddings restored from the checkpoint
+        if vocab_processor is not None and not prep.same_vocabulary(
+                vocab_processor, prepared['vocab_processor']):
+            raise ValueError("The data of CNN_{} have not been prepared with "
+                             "the vocabulary of the resumed or fine-tuned "
+                             "run".format(focus))
+        x = prepared['x']
+        y = prepared['y']
+        vocab_processor = prepared['vocab_processor']
+        embeddings = prepared['embeddings']
+        target_names = meta['target_names']
+    else:
+        source = src.get_source(config_file, 'train', focus, FLAGS.aspects,
+                                multilabel)
+        # Reading and cleaning are interleaved batch by batch, so they are
+        # timed as one stage
+        with profiler.stage(stage + "read_and_clean"):
+            x_text, y = src.load_data_and_labels(source)
+
+        # Build vocabulary
+        with profiler.stage(stage + "vocabulary"):
+            if vocab_processor is None:
+                x, vocab_processor = prep.build_vocabulary(x_text)
+            else:
+                # Vocabulary of the resumed or fine-tuned run, which matches
+                # its checkpoints. The words it does not know are mapped to
+                # the padding id
+                x = np.array(list(vocab_processor.transform(x_text)),
+                             dtype=np.int32)
+        target_names = source.target_names
+    profiler.count(stage + "examples", len(y))
+    if logs.data_enabled():
+        logs.log_data("Data (shape : %s):\n %s", x.shape, x)
+
+    # Randomly shuffle data. Only the indices are shuffled : the training
+    # examples are gathered batch by batch (see CNN_process), so that
+    # memory-mapped prepared data are not copied in memory
     np.random.seed(10)
     shuffle_indices = np.random.permutation(np.arange(len(y)))
-    x_shuffled = x[shuffle_indices]
-    logger.debug("Data shuffled (shape: %s):\n %s", x_shuffled.shape,
-                 x_shuffled)
-    y_shuffled = y[shuffle_indices]
-    logger.debug("Label shuffled (shape: %s):\n %s", y_shuffled.shape,
-                 y_shuffled)
+    if logs.data_enabled():
+        logs.log_data("Data shuffled (shape: %s):\n %s", x.shape,
+                      x[shuffle_indices])
+        logs.log_data("Label shuffled (shape: %s):\n %s", y.shape,
+                      y[shuffle_indices])
 
     # Split train/test set
     # TODO: This is very crude, should use cross-validation
     dev_sample_index = -1 * int(FLAGS.dev_sample_percentage * float(len(y)))
-    x_train, x_dev = (x_shuffled[:dev_sample_index],
-                      x_shuffled[dev_sample_index:])
-    y_train, y_dev = (y_shuffled[:dev_sample_index],
-                      y_shuffled[dev_sample_index:])
+    train_indices = shuffle_indices[:dev_sample_index]
+    dev_indices = shuffle_indices[dev_sample_index:]
+    # The dev set is evaluated at once, it is read in memory
+    x_dev = np.asarray(x[dev_indices])
+    y_dev = np.asarray(y[dev_indices])
 
     logger.info("")
     logger.info(" ==> VOCABULARY <== ")
@@ -125,15 +310,17 @@ def build_required_data_for_CNN(config_file, focus):
                  vocab_processor.vocabulary_.reverse(
                          len(vocab_processor.vocabulary_) - 1))
 
-    logger.info("Train/Dev : %s/%s", len(y_train), len(y_dev))
+    logger.info("Train/Dev : %s/%s", len(train_indices), len(y_dev))
     logger.info("")
 
-    return {'sequence_length': x_train.shape[1],
-            'num_classes': y_train.shape[1],
+    return {'sequence_length': x.shape[1],
+            'num_classes': len(target_names),
             'vocab_processor': vocab_processor,
-            'x_train': x_train,
+            'embeddings': embeddings,
+            'x': x,
+            'y': y,
+            'train_indices': train_indices,
             'x_dev': x_dev,
-            'y_train': y_train,
             'y_dev': y_dev}
 
 
@@ -152,17 +339,67 @@ def CNN_process(config_file, focus):
     :type focus: string
     """
 
+    # Output directory for models and summaries
+    out_dir = os.path.abspath(os.path.join(
+            os.path.curdir, CURRENT_RUN_DIRECTORY, 'CNN_' + focus))
+    checkpoint_dir = os.path.abspath(os.path.join(out_dir, "checkpoints"))
+    checkpoint_prefix = os.path.join(checkpoint_dir, "model")
+
+    # Restore the vocabulary and the latest checkpoint of the run to resume
+    vocab_processor = None
+    checkpoint_file = None
+    if FLAGS.resume_dir:
+        checkpoint_file = tf.train.latest_checkpoint(checkpoint_dir)
+        if checkpoint_file is None:
+            logger.info("No checkpoint in {}, CNN_{} is trained from "
+                        "scratch".format(checkpoint_dir, focus))
+        else:
+            vocab_processor = learn.preprocessing.VocabularyProcessor.restore(
+                    os.path.join(out_dir, "vocab"))
+
+    # Fine-tuning : the vocabulary and the embedding and convolution layers
+    # come from a run trained on another domain
+    finetune_checkpoint = None
+    if checkpoint_file is None and FLAGS.finetune_dir:
+        finetune_out_dir = os.path.join(FLAGS.finetune_dir, 'CNN_' + focus)
+        finetune_checkpoint = tf.train.latest_checkpoint(
+                os.path.join(finetune_out_dir, "checkpoints"))
+        if finetune_checkpoint is None:
+            raise ValueError("No checkpoint of CNN_{} in the run to "
+                             "fine-tune {}".format(focus, FLAGS.finetune_dir))
+        vocab_processor = learn.preprocessing.VocabularyProcessor.restore(
+                os.path.join(finetune_out_dir, "vocab"))
+
     # Data Preparation
     # ==================================================
-    required_data = build_required_data_for_CNN(config_file, focus)
+    required_data = build_required_data_for_CNN(config_file, focus,
+                                                vocab_processor)
 
     # Training
     # ==================================================
+    stage = "CNN_" + focus + "/"
+    cnn_parameters = {
+        'sequence_length': required_data['sequence_length'],
+        'num_classes': required_data['num_classes'],
+        'vocab_size': len(required_data['vocab_processor'].vocabulary_),
+        'embedding_size': embedding_dimension,
+        'filter_sizes': list(map(int, FLAGS.filter_sizes.split(","))),
+        'num_filters': FLAGS.num_filters,
+        'l2_reg_lambda': FLAGS.l2_reg_lambda,
+        'multilabel': FLAGS.multilabel and focus == 'feature',
+        'embedding_policy': FLAGS.embedding_policy,
+        'embedding_device': session_settings['embedding_device'] or None,
+        'fused_convolutions': FLAGS.fused_convolutions,
+        'xla_jit': FLAGS.xla_jit}
+    with profiler.stage(stage + "tune_session"):
+        settings = tune_session(required_data, cnn_parameters)
+
     logger.info(" *** Define Graph for CNN_" + focus + " *** ")
+    build_graph = profiler.start(stage + "build_graph")
     with tf.Graph().as_default():
-        session_conf = tf.ConfigProto(
-          allow_soft_placement=FLAGS.allow_soft_placement,
-          log_device_placement=FLAGS.log_device_placement)
+        session_conf = sc.make_session_config(
+                settings, FLAGS.allow_soft_placement,
+                FLAGS.log_device_placement)
         sess = tf.Session(config=session_conf)
         with sess.as_default():
 
@@ -171,20 +408,25 @@ def CNN_process(config_file, focus):
 
             logger.info(" *** CNN_" + focus + " *** ")
 
-            cnn = CNN.TextCNN(
-                sequence_length=required_data['sequence_length'],
-                num_classes=required_data['num_classes'],
-                vocab_size=len(required_data['vocab_processor'].vocabulary_),
-                embedding_size=embedding_dimension,
-                filter_sizes=list(map(int, FLAGS.filter_sizes.split(","))),
-                num_filters=FLAGS.num_filters,
-                l2_reg_lambda=FLAGS.l2_reg_lambda)
+            cnn = CNN.TextCNN(**cnn_parameters)
 
             # Define Training procedure
             global_step = tf.Variable(0, name="global_step", trainable=False)
-            # TODO : Add learning rate
-            optimizer = tf.train.AdamOptimizer(cnn.learning_rate)
-            grads_and_vars = optimizer.compute_gradients(cnn.loss)
+            decay_speed = (FLAGS.decay_coefficient *
+                           len(required_data['train_indices']) /
+                           FLAGS.batch_size)
+            learning_rate = learning_rate_schedule(global_step, decay_speed)
+            optimizer = tf.train.AdamOptimizer(learning_rate)
+            trained_variables = None
+            if FLAGS.finetune_dir and FLAGS.freeze_trunk:
+                # Only the output layer is trained
+                trunk = set(variable.op.name
+                            for variable in cnn.trunk_variables)
+                trained_variables = [variable for variable in
+                                     tf.trainable_variables()
+                                     if variable.op.name not in trunk]
+            grads_and_vars = optimizer.compute_gradients(
+                    cnn.loss, var_list=trained_variables)
             train_op = optimizer.apply_gradients(grads_and_vars,
                                                  global_step=global_step)
 
@@ -204,19 +446,18 @@ def CNN_process(config_file, focus):
             # Summaries
             # ==================================================
 
-            # Output directory for models and summaries
-            out_dir = os.path.abspath(os.path.join(
-                    os.path.curdir, CURRENT_RUN_DIRECTORY,
-                    'CNN_' + focus))
             logger.info("")
             logger.info("Writing to {}".format(out_dir))
 
             # Summaries for loss and accuracy
             loss_summary = tf.summary.scalar("loss", cnn.loss)
             acc_summary = tf.summary.scalar("accuracy", cnn.accuracy)
+            learning_rate_summary = tf.summary.scalar("learning_rate",
+                                                      learning_rate)
 
             # Train Summaries
             train_summary_op = tf.summary.merge([loss_summary, acc_summary,
+                                                 learning_rate_summary,
                                                  grad_summaries_merged])
             train_summary_dir = os.path.join(out_dir, "summaries", "train")
             train_summary_writer = tf.summary.FileWriter(train_summary_dir,
@@ -231,71 +472,106 @@ def CNN_process(config_file, focus):
             # Checkpointing
             # ==================================================
 
-            checkpoint_dir = os.path.abspath(os.path.join(out_dir,
-                                                          "checkpoints"))
-            checkpoint_prefix = os.path.join(checkpoint_dir, "model")
-
             # Tensorflow assumes this directory already exists so we
             # need to create it
             if not os.path.exists(checkpoint_dir):
                 os.makedirs(checkpoint_dir)
             saver = tf.train.Saver(tf.global_variables(),
                                    max_to_keep=FLAGS.num_checkpoints)
+            build_graph.stop()
+
+            # TensorFlow traces of some training steps
+            tracer = profiling.StepTracer(FLAGS.trace_every,
+                                          os.path.join(out_dir, "traces"))
 
             # Write vocabulary
             # ==================================================
 
-            required_data['vocab_processor'].save(os.path.join(
-                    out_dir, "vocab"))
+            if checkpoint_file is None:
+                required_data['vocab_processor'].save(os.path.join(
+                        out_dir, "vocab"))
 
             # Initializing the variables
             # ==================================================
 
-            sess.run(tf.global_variables_initializer())
-
-            if (FLAGS.enable_word_embeddings and
+            if checkpoint_file is not None:
+                # The embeddings are part of the checkpoint
+                with profiler.stage(stage + "restore_checkpoint"):
+                    saver.restore(sess, checkpoint_file)
+                logger.info("Resume CNN_{} from {}".format(focus,
+                                                           checkpoint_file))
+            else:
+                with profiler.stage(stage + "init_variables"):
+                    sess.run(tf.global_variables_initializer())
+
+            if finetune_checkpoint is not None:
+                # The embeddings are part of the restored layers
+                with profiler.stage(stage + "restore_trunk"):
+                    restore_trunk(sess, cnn, finetune_checkpoint)
+                logger.info("Fine-tune CNN_{} from {}".format(
+                        focus, finetune_checkpoint))
+            elif checkpoint_file is None and (
+                    FLAGS.enable_word_embeddings and
                     cfg['word_embeddings']['default'] is not None):
-                vocabulary = required_data['vocab_processor'].vocabulary_
-                initW = None
-                if embedding_name == 'word2vec':
-                    # Load embedding vectors from the word2vec
-                    logger.info("Load word2vec file {}".format(
-                            cfg['word_embeddings']['word2vec']['path']))
-                    initW = pp.load_embedding_vectors_word2vec(
-                            vocabulary,
-                            cfg['word_embeddings']['word2vec']['path'],
-                            cfg['word_embeddings']['word2vec']['binary'])
-                    logger.info("Word2vec file has been loaded")
-                elif embedding_name == 'glove':
-                    # Load embedding vectors from the glove
-                    logger.info("Load glove file {}".format(
-                            cfg['word_embeddings']['glove']['path']))
-                    initW = pp.load_embedding_vectors_glove(
-                            vocabulary,
-                            cfg['word_embeddings']['glove']['path'],
-                            embedding_dimension)
-                    logger.info("Glove file has been loaded")
-                sess.run(cnn.W.assign(initW))
-
-            def train_step(x_batch, y_batch, learning_rate):
+                initW = required_data['embeddings']
+                if initW is None:
+                    with profiler.stage(stage + "load_embeddings"):
+                        initW = prep.load_embeddings(
+                                cfg,
+                                required_data['vocab_processor'].vocabulary_,
+                                embedding_name, embedding_dimension)
+                elif initW.shape[1] != embedding_dimension:
+                    raise ValueError("The word embeddings have been prepared "
+                                     "with {} dimensions instead of {}".format(
+                                             initW.shape[1],
+                                             embedding_dimension))
+                # Fed through a placeholder rather than stored as a constant
+                # of the graph
+                initial_embeddings = tf.placeholder(tf.float32, initW.shape)
+                for variable in cnn.embedding_variables:
+                    sess.run(variable.assign(initial_embeddings),
+                             {initial_embeddings: initW})
+            elif (checkpoint_file is None and
+                    FLAGS.embedding_policy != 'trainable'):
+                logger.info("Warning : the embeddings of CNN_{} are frozen "
+                            "without word embeddings, they keep random "
+                            "values".format(focus))
+
+            def train_step(x_batch, y_batch, log=True):
                 """
                 A single training step
+                :param log: If True, the step is logged and its summaries
+                are written. Otherwise only the global step is fetched.
+                :return: The global step after the training step.
                 """
 
                 feed_dict = {
                   cnn.input_x: x_batch,
                   cnn.input_y: y_batch,
-                  cnn.dropout_keep_prob: FLAGS.dropout_keep_prob,
-                  cnn.learning_rate: learning_rate
+                  cnn.dropout_keep_prob: FLAGS.dropout_keep_prob
                 }
-                _, step, summaries, loss, accuracy = sess.run(
-                    [train_op, global_step, train_summary_op, cnn.loss,
-                     cnn.accuracy],
-                    feed_dict)
+                run_kwargs = tracer.run_kwargs()
+                if not log:
+                    with profiler.stage(stage + "train_step"):
+                        _, step = sess.run([train_op, global_step],
+                                           feed_dict, **run_kwargs)
+                    tracer.save(run_kwargs, step, train_summary_writer)
+                    profiler.count(stage + "trained_examples", len(y_batch))
+                    return step
+
+                with profiler.stage(stage + "train_step"):
+                    _, step, summaries, loss, accuracy, rate = sess.run(
+                        [train_op, global_step, train_summary_op, cnn.loss,
+                         cnn.accuracy, learning_rate],
+                        feed_dict, **run_kwargs)
                 time_str = datetime.datetime.now().isoformat()
                 logger.info("{}: step {}, loss {:g}, acc {:g}, learning_rate {:g}".format(
-                             time_str, step, loss, accuracy, learning_rate))
-                train_summary_writer.add_summary(summaries, step)
+                             time_str, step, loss, accuracy, rate))
+                with profiler.stage(stage + "summaries"):
+                    train_summary_writer.add_summary(summaries, step)
+                    tracer.save(run_kwargs, step, train_summary_writer)
+                profiler.count(stage + "trained_examples", len(y_batch))
+                return step
 
             def dev_step(x_batch, y_batch, writer=None):
                 """
@@ -308,26 +584,50 @@ def CNN_process(config_file, focus):
                   cnn.input_y: y_batch,
                   cnn.dropout_keep_prob: 1.0
                 }
-                step, summaries, loss, accuracy = sess.run(
-                    [global_step, dev_summary_op, cnn.loss, cnn.accuracy],
-                    feed_dict)
+                with profiler.stage(stage + "dev_step"):
+                    step, summaries, loss, accuracy = sess.run(
+                        [global_step, dev_summary_op, cnn.loss, cnn.accuracy],
+                        feed_dict)
                 time_str = datetime.datetime.now().isoformat()
                 logger.info("{}: step {}, loss {:g}, acc {:g}".format(
                              time_str, step, loss, accuracy))
                 if writer:
                     writer.add_summary(summaries, step)
 
+            # Position of the training loop
+            # ==================================================
+
+            # Number of batches already processed
+            counter = 0
+            if checkpoint_file is not None:
+                counter = tf.train.global_step(sess, global_step)
+                state = load_training_state(checkpoint_dir)
+                if state is not None and state['step'] == counter:
+                    if (state['batch_size'] != FLAGS.batch_size or
+                            state['shuffle_seed'] != FLAGS.shuffle_seed):
+                        raise ValueError(
+                                "CNN_{} has been trained with batch_size={} "
+                                "and shuffle_seed={}, it can only be resumed "
+                                "with the same values".format(
+                                        focus, state['batch_size'],
+                                        state['shuffle_seed']))
+                    counter = state['counter']
+                logger.info("CNN_{} resumed at step {}".format(focus, counter))
+
             # Generate batches
             # ==================================================
 
-            data = list(zip(required_data['x_train'], required_data['y_train']))
-            batches = pp.batch_iter(data, FLAGS.batch_size, FLAGS.num_epochs)
+            # The batches of each epoch only depend on the seed, so that the
+            # batches already processed by a resumed run are skipped. The
+            # batches are made of indices of training examples, which are
+            # gathered from the (possibly memory-mapped) data at each step
+            data = required_data['train_indices']
+            batches = pp.batch_iter(data, FLAGS.batch_size, FLAGS.num_epochs,
+                                    seed=FLAGS.shuffle_seed, start=counter)
 
-            # It uses dynamic learning rate with a high value at the
-            # beginning to speed up the training
-            max_learning_rate = 0.005
-            min_learning_rate = 0.0001
-            decay_speed = FLAGS.decay_coefficient*len(required_data['y_train'])/FLAGS.batch_size
+            last_step = (pp.batch_number(data, FLAGS.batch_size,
+                                         FLAGS.num_epochs) *
+                         FLAGS.num_epochs)
 
             # Training loop. For each batch...
             # ==================================================
@@ -335,42 +635,44 @@ def CNN_process(config_file, focus):
             logger.info("")
             logger.info("*** TRAINING LOOP ***")
 
-            counter = 0
             for batch in batches:
 
-                learning_rate =\
-                    min_learning_rate + (max_learning_rate - min_learning_rate) * math.exp(-counter/decay_speed)
                 counter += 1
+                # The training steps are logged every log_every steps only
+                log = counter % FLAGS.log_every == 0 or counter == last_step
 
-                x_batch, y_batch = zip(*batch)
-                train_step(x_batch, y_batch, learning_rate)
-                current_step = tf.train.global_step(sess, global_step)
-
-                # Progress
-                last_step = (pp.batch_number(
-                    data,
-                    FLAGS.batch_size,
-                    FLAGS.num_epochs) * FLAGS.num_epochs)
-                progress_pourcentage = round(current_step*100/last_step, 2)
+                x_batch = required_data['x'][batch]
+                y_batch = required_data['y'][batch]
+                current_step = train_step(x_batch, y_batch, log)
 
                 # Evaluation and checkpoint are made every given steps but
                 # also at the last step of the algorithm
                 if (current_step % FLAGS.evaluate_every == 0 or
-                        progress_pourcentage == float(100)):
+                        current_step == last_step):
                     logger.info("")
                     logger.info("Evaluation :")
                     dev_step(required_data['x_dev'], required_data['y_dev'],
                              writer=dev_summary_writer)
                     logger.info("")
                 if (current_step % FLAGS.checkpoint_every == 0 or
-                        progress_pourcentage == float(100)):
-                    path = saver.save(sess, checkpoint_prefix,
-                                      global_step=current_step)
+                        current_step == last_step):
+                    with profiler.stage(stage + "checkpoint"):
+                        path = saver.save(sess, checkpoint_prefix,
+                                          global_step=current_step)
+                        save_training_state(checkpoint_dir, {
+                                'step': int(current_step),
+                                'counter': counter,
+                                'batch_size': FLAGS.batch_size,
+                                'num_epochs': FLAGS.num_epochs,
+                                'shuffle_seed': FLAGS.shuffle_seed,
+                                'checkpoint': os.path.basename(path)})
                     logger.info("Saved model checkpoint to {}".format(path))
                     logger.info("")
 
-                logging.info("Progress : {}%".format(progress_pourcentage, 2))
-                logger.info("")
+                if log:
+                    logger.info("Progress : {}%".format(
+                            current_step * 100 // last_step))
+                    logger.info("")
 
 
 if __name__ == '__main__':
@@ -398,9 +700,17 @@ if __name__ == '__main__':
     tf.flags.DEFINE_string(
             "negative_data_file", "../data/rt-polaritydata/rt-polarity.neg",
             "Data source for the negative data.")
+    tf.flags.DEFINE_string(
+            "prepared_dir", "",
+            "Folder of the data prepared by prepare.py (default: the dataset "
+            "is read and prepared again)")
     tf.flags.DEFINE_boolean("aspects",
                             False,
                             "Scope widened to aspects and not only entities")
+    tf.flags.DEFINE_boolean("multilabel",
+                            False,
+                            "Train CNN_feature as a multi-label classifier : "
+                            "each sentence appears once with all its features")
 
     # Model Hyperparameters
     tf.flags.DEFINE_boolean(
@@ -421,6 +731,19 @@ if __name__ == '__main__':
     tf.flags.DEFINE_float(
             "l2_reg_lambda", 0.0,
             "L2 regularization lambda (default: 0.0)")
+    tf.flags.DEFINE_string(
+            "embedding_policy", "trainable",
+            "Training of the embeddings : 'trainable', 'frozen' (not "
+            "trained, no gradient nor optimizer slots) or 'multichannel' "
+            "(frozen and trainable channels) (default: trainable)")
+    tf.flags.DEFINE_boolean(
+            "fused_convolutions", False,
+            "Compute the filters of all sizes in a single convolution "
+            "(default: False)")
+    tf.flags.DEFINE_boolean(
+            "xla_jit", False,
+            "Compile the convolution and output layers with XLA, needs a "
+            "TensorFlow built with XLA (default: False)")
 
     # Training parameters
     tf.flags.DEFINE_integer(
@@ -440,6 +763,9 @@ if __name__ == '__main__':
             "Number of checkpoints to store (default: 5)")
 
     # Misc Parameters
+    tf.flags.DEFINE_boolean(
+            "log_data", False,
+            "Log the whole data arrays in the log files (default: False)")
     tf.flags.DEFINE_boolean(
             "allow_soft_placement", True,
             "Allow device soft device placement")
@@ -448,50 +774,87 @@ if __name__ == '__main__':
             "Log placement of ops on devices")
     tf.flags.DEFINE_float("decay_coefficient", 2.5,
                           "Decay coefficient (default: 2.5)")
+    tf.flags.DEFINE_integer("log_every", 10,
+                            "Log the training steps and write their "
+                            "summaries every this many steps (default: 10)")
+    tf.flags.DEFINE_integer("shuffle_seed", 10,
+                            "Seed of the shuffling of the batches of each "
+                            "epoch (default: 10)")
+    tf.flags.DEFINE_string(
+            "resume_dir", "",
+            "Directory of an interrupted run (RUN_DIRECTORY/directory_name/"
+            "timestamp) : each CNN is restored from its latest checkpoint "
+            "and trained until num_epochs, in the same directory "
+            "(default: a new run is started)")
+    tf.flags.DEFINE_string(
+            "finetune_dir", "",
+            "Directory of a run trained on another domain : the vocabulary "
+            "and the embedding and convolution layers of each CNN are "
+            "initialized from its latest checkpoint, the output layer is "
+            "trained for the classes of the current domain (default: the "
+            "CNNs are trained from scratch)")
+    tf.flags.DEFINE_boolean(
+            "freeze_trunk", False,
+            "With finetune_dir, only train the output layer (default: False)")
+
+    # Session Parameters (default: 'session' section of the 'config.yml' file)
+    tf.flags.DEFINE_integer("intra_op_threads", -1,
+                            "Threads of the intra-op pool, 0 to let "
+                            "TensorFlow choose (default: config.yml)")
+    tf.flags.DEFINE_integer("inter_op_threads", -1,
+                            "Threads of the inter-op pool, 0 to let "
+                            "TensorFlow choose (default: config.yml)")
+    tf.flags.DEFINE_string("cpu_affinity", None,
+                           "Cores the process is pinned to, e.g. '0-3,8' "
+                           "(default: config.yml)")
+    tf.flags.DEFINE_boolean("autotune", False,
+                            "Measure training steps with several sizes of "
+                            "the thread pools and keep the fastest one for "
+                            "this shape of CNN (default: False)")
+    tf.flags.DEFINE_integer("autotune_steps", 10,
+                            "Training steps measured for each size of the "
+                            "thread pools (default: 10)")
+
+    # Profiling Parameters
+    tf.flags.DEFINE_boolean("profile", True,
+                            "Measure the time spent in each stage and write "
+                            "it in timings.json inside the run directory")
+    tf.flags.DEFINE_integer("trace_every", 0,
+                            "Save the TensorFlow trace of one training step "
+                            "every this many steps, 0 to disable "
+                            "(default: 0)")
 
     FLAGS = tf.flags.FLAGS
     FLAGS._parse_flags()
+    profiler = profiling.Profiler(FLAGS.profile)
     CURRENT_RUN_DIRECTORY = os.path.join(os.path.curdir, RUN_DIRECTORY,
                                          FLAGS.directory_name, timestamp)
+    if FLAGS.resume_dir:
+        if not os.path.isdir(FLAGS.resume_dir):
+            raise ValueError("The run to resume {} does not exist".format(
+                    FLAGS.resume_dir))
+        CURRENT_RUN_DIRECTORY = FLAGS.resume_dir
 
     # Logger
     # ==================================================
 
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-
-    # File handler which logs even debug messages
-    file_handler = logging.FileHandler('log.log')
-    file_handler.setLevel(logging.DEBUG)
-
-    # Other file handler to store information for each run
-    if not os.path.exists(CURRENT_RUN_DIRECTORY):
-        os.makedirs(CURRENT_RUN_DIRECTORY)
-    log_directory = os.path.join(CURRENT_RUN_DIRECTORY, "train.log")
-    run_file_handler = logging.FileHandler(log_directory)
-    run_file_handler.setLevel(logging.DEBUG)
-
-    # Console handler which logs info messages
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-
-    # Create formatter and add it to the handlers
-#    formatter = logging.Formatter('%(asctime)s -- %(name)s -- %(levelname)s\n'
-#                                  '%(message)s\n')
-    formatter = logging.Formatter("%(message)s")
-    file_handler.setFormatter(formatter)
-    run_file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-
-    # Add handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(run_file_handler)
-    logger.addHandler(console_handler)
+    # Shared log file and log file of the run (see logs.py)
+    logger = logs.setup_logging(
+            os.path.join(CURRENT_RUN_DIRECTORY, "train.log"),
+            log_data=FLAGS.log_data)
 
     # Use parameters set in config file
     with open("config.yml", 'r') as ymlfile:
         cfg = yaml.load(ymlfile)
 
+    # Thread pools and CPU placement of the sessions
+    session_settings = sc.get_session_settings(
+            cfg, FLAGS.intra_op_threads, FLAGS.inter_op_threads,
+            FLAGS.cpu_affinity)
+    if sc.apply_cpu_affinity(session_settings['cpu_affinity']):
+        logger.info("Process pinned to the cores {}".format(
+                session_settings['cpu_affinity']))
+
     dataset_name = cfg["datasets"]["default"]
     embedding_name = "NONE"
     if (FLAGS.enable_word_embeddings and
@@ -536,3 +899,11 @@ if __name__ == '__main__':
     # ==================================================
 
     CNN_process(cfg, 'polarity')
+
+    # ==================================================
+    # Timings
+    # ==================================================
+
+    logger.info("")
+    profiler.log(logger)
+    profiler.save(CURRENT_RUN_DIRECTORY)
@@ -0,0 +1,17 @@
+"""
+Configuration of the tests of the FOSA project.
+
+The modules of the project and the benchmarks import each other by their
+bare names (the scripts are run from their folder), so both folders are
+added once to sys.path.
+"""
+
+import os
+import sys
+
+ROOT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+for folder in ['fosa', 'benchmarks']:
+    path = os.path.abspath(os.path.join(ROOT_FOLDER, folder))
+    if path not in sys.path:
+        sys.path.insert(0, path)
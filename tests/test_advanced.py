@@ -0,0 +1,74 @@
+"""
+Advanced tests of the FOSA project.
+"""
+
+import pytest
+
+# Benchmarks which do not need TensorFlow
+LIGHT_BENCHMARKS = ['clean_str', 'parse_XML', 'get_dataset_semeval',
+                    'load_word2vec', 'load_glove', 'batch_iter']
+
+
+@pytest.fixture(scope='module')
+def bench():
+    import bench_fosa
+    return bench_fosa
+
+
+def test_benchmarks_quick_scale(bench):
+    results = bench.run_benchmarks('quick', LIGHT_BENCHMARKS,
+                                   log=lambda message: None)
+
+    assert list(results['results']) == LIGHT_BENCHMARKS
+    for result in results['results'].values():
+        assert result['seconds'] >= 0
+        assert result['items'] > 0
+    # The synthetic domain is removed from the registry
+    assert bench.BENCHMARK_DOMAIN not in bench.dm.DOMAINS
+
+    # A run compared with itself has no regression
+    assert bench.compare(results, results, log=lambda message: None) == []
+
+
+def test_benchmarks_unknown_name(bench):
+    with pytest.raises(ValueError):
+        bench.run_benchmarks('quick', ['unknown'])
+
+
+@pytest.fixture(scope='module')
+def fosa():
+    import preprocessing
+    import synthetic
+    return preprocessing, synthetic
+
+
+def test_synthetic_dataset_is_parsed(fosa, tmpdir):
+    pp, synthetic = fosa
+    filepath = str(tmpdir.join('synthetic', 'train.xml'))
+    weights = {'FOOD#QUALITY': 3, 'SERVICE#GENERAL': 1}
+    stats = synthetic.generate_semeval_xml(
+            filepath, 'RESTAURANT', num_reviews=30, category_weights=weights,
+            opinions_per_sentence=(1, 2), sentence_length=(2, 5))
+
+    assert stats['reviews'] == 30
+    dataset = pp.parse_XML(filepath, aspects=True)
+    assert len(dataset) == stats['opinions']
+    assert dataset['sentence_id'].nunique() == stats['sentences']
+    # The categories without weight never appear
+    assert set(dataset['feature']) == set(weights)
+
+
+def test_synthetic_domain_of_laptop(fosa, tmpdir):
+    pp, synthetic = fosa
+    train_path = str(tmpdir.join('train.xml'))
+    test_path = str(tmpdir.join('test_gold.xml'))
+    synthetic.generate_semeval_xml(train_path, 'LAPTOP', num_reviews=20)
+    domain = synthetic.register_synthetic_domain('SYNTHETIC_LAPTOP', 'LAPTOP',
+                                                 train_path, test_path)
+    try:
+        dataset = pp.get_dataset_semeval(train_path, 'feature')
+        assert dataset['target_names'] == list(domain.entities.names)
+        # The hardware components are simplified as HARDWARE
+        assert domain.entities.index['HARDWARE'] in dataset['target']
+    finally:
+        pp.dm.DOMAINS.pop('SYNTHETIC_LAPTOP')
@@ -0,0 +1,686 @@
+"""
+Basic tests of the FOSA project.
+"""
+
+import os
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn import metrics as sklearn_metrics
+
+FOSA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'fosa')
+
+# Modules which must not be loaded just by importing the light tools
+HEAVY_MODULES = ['tensorflow', 'matplotlib', 'sklearn', 'pandas_ml']
+LIGHT_TOOLS = ['preprocessing', 'analysis', 'evaluation', 'scorer',
+               'dataset_stats', 'cache', 'domains', 'data_sources',
+               'profiling', 'synthetic', 'session_config', 'logs',
+               'sentence_streams']
+
+# Generous budget : importing numpy and pandas alone takes about one second
+IMPORT_TIME_BUDGET = 5.0
+
+
+def import_in_subprocess(modules):
+    """
+    Import modules in a fresh interpreter.
+    :return: Import time in seconds and names of the heavy modules loaded.
+    """
+
+    code = (
+        "import sys, time\n"
+        "sys.path.insert(0, {folder!r})\n"
+        "start = time.perf_counter()\n"
+        "for module in {modules!r}:\n"
+        "    __import__(module)\n"
+        "elapsed = time.perf_counter() - start\n"
+        "heavy = [m for m in {heavy!r} if m in sys.modules]\n"
+        "print(elapsed)\n"
+        "print(','.join(heavy))\n").format(
+            folder=FOSA_FOLDER, modules=modules, heavy=HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     cwd=FOSA_FOLDER,
+                                     universal_newlines=True)
+    elapsed, heavy = output.split('\n')[:2]
+    return float(elapsed), [m for m in heavy.split(',') if m]
+
+
+@pytest.mark.parametrize('module', LIGHT_TOOLS)
+def test_light_tools_do_not_import_heavy_dependencies(module):
+
+    _, heavy = import_in_subprocess([module])
+    assert heavy == []
+
+
+def test_light_tools_import_time():
+
+    elapsed, _ = import_in_subprocess(LIGHT_TOOLS)
+    assert elapsed < IMPORT_TIME_BUDGET
+
+
+def test_batch_iter_resumes_at_any_batch():
+    import preprocessing as pp
+
+    data = list(range(10))
+    batches = [list(batch) for batch in pp.batch_iter(data, 3, 3, seed=10)]
+    assert len(batches) == 12
+    for start in range(len(batches) + 1):
+        resumed = pp.batch_iter(data, 3, 3, seed=10, start=start)
+        assert [list(batch) for batch in resumed] == batches[start:]
+
+
+def test_session_settings():
+    import session_config as sc
+
+    assert sc.parse_cpu_list("0-3, 8,2") == [0, 1, 2, 3, 8]
+    assert sc.parse_cpu_list("") == []
+    assert sc.split_cpus([0, 1, 2, 3, 4], 2) == [[0, 1], [2, 3]]
+    assert sc.split_cpus([0, 1], 3) == [[0], [1], [0]]
+
+    config_file = {'session': {'intra_op_parallelism_threads': 4}}
+    settings = sc.get_session_settings(config_file, inter_op_threads=2)
+    assert settings['intra_op_parallelism_threads'] == 4
+    assert settings['inter_op_parallelism_threads'] == 2
+    assert sc.get_session_settings(
+            config_file, 0)['intra_op_parallelism_threads'] == 0
+
+
+def test_rotating_queued_logs(tmpdir):
+    import logging
+    import logs
+
+    root_level = logging.getLogger().level
+    run_log = str(tmpdir.join('run', 'train.log'))
+    logger = logs.setup_logging(run_log, shared_log_file=None,
+                                console_stream=open(os.devnull, 'w'),
+                                max_bytes=200, backup_count=2)
+    try:
+        assert not logs.data_enabled()
+        for i in range(50):
+            logger.debug("step %s of the training loop", i)
+    finally:
+        logs.shutdown_logging()
+        logging.getLogger().setLevel(root_level)
+
+    # The queued records are written and the files are bounded
+    with open(run_log) as f:
+        assert "step 49 of the training loop" in f.read()
+    assert os.path.exists(run_log + '.2')
+    assert not os.path.exists(run_log + '.3')
+    assert os.path.getsize(run_log) <= 200
+
+
+def test_shared_log_keeps_the_records_of_every_process(tmpdir):
+    shared_log = str(tmpdir.join('log.log'))
+    code = (
+        "import os, sys\n"
+        "sys.path.insert(0, {folder!r})\n"
+        "import logs\n"
+        "logger = logs.setup_logging(\n"
+        "    os.path.join({tmpdir!r}, 'run_%s.log' % sys.argv[1]),\n"
+        "    shared_log_file={shared_log!r},\n"
+        "    console_stream=open(os.devnull, 'w'), max_bytes=200)\n"
+        "for i in range(200):\n"
+        "    logger.debug('process %s record %s', sys.argv[1], i)\n").format(
+            folder=FOSA_FOLDER, tmpdir=str(tmpdir), shared_log=shared_log)
+    processes = [subprocess.Popen([sys.executable, '-c', code, str(i)])
+                 for i in range(3)]
+    assert [process.wait() for process in processes] == [0, 0, 0]
+
+    # The shared file is not rotated, unlike the log files of the runs
+    with open(shared_log) as f:
+        records = f.read().splitlines()
+    assert sorted(records) == sorted("process {} record {}".format(p, i)
+                                     for p in range(3) for i in range(200))
+    assert not os.path.exists(shared_log + '.1')
+    assert os.path.exists(str(tmpdir.join('run_0.log.1')))
+
+
+def test_sentence_readers(tmpdir):
+    import sentence_streams as ss
+
+    jsonl_path = tmpdir.join('input.jsonl')
+    jsonl_path.write('{"text": "Great food", "review_id": "r1"}\n\n'
+                     '{"text": "Slow service", "sentence_id": "s2"}\n')
+    csv_path = tmpdir.join('input.csv')
+    csv_path.write('review_id,text\nr1,"Great food, really"\nr2,Slow\n')
+    xml_path = tmpdir.join('input.xml')
+    xml_path.write('<Reviews><Review rid="r1"><sentences>'
+                   '<sentence id="r1:0"><text>Great food</text></sentence>'
+                   '<sentence id="r1:1"><text>Slow</text></sentence>'
+                   '</sentences></Review><Review rid="r2"><sentences>'
+                   '<sentence id="r2:0"><text>Fair price</text></sentence>'
+                   '</sentences></Review></Reviews>')
+
+    assert list(ss.iter_sentences(str(jsonl_path))) == [
+            {'review_id': 'r1', 'sentence_id': 0, 'text': 'Great food'},
+            {'review_id': None, 'sentence_id': 's2', 'text': 'Slow service'}]
+    assert list(ss.iter_sentences(str(csv_path))) == [
+            {'review_id': 'r1', 'sentence_id': 0,
+             'text': 'Great food, really'},
+            {'review_id': 'r2', 'sentence_id': 1, 'text': 'Slow'}]
+    assert list(ss.iter_sentences(str(xml_path))) == [
+            {'review_id': 'r1', 'sentence_id': 'r1:0', 'text': 'Great food'},
+            {'review_id': 'r1', 'sentence_id': 'r1:1', 'text': 'Slow'},
+            {'review_id': 'r2', 'sentence_id': 'r2:0', 'text': 'Fair price'}]
+    with pytest.raises(ValueError):
+        list(ss.iter_sentences(str(tmpdir.join('input.txt'))))
+
+    assert list(ss.iter_chunks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(ss.iter_chunks([], 3)) == []
+
+
+@pytest.mark.parametrize('num_sentences,num_shards,chunk_size',
+                         [(23, 3, 4), (5, 4, 2), (6, 2, 3)])
+def test_shards_are_merged_in_input_order(tmpdir, num_sentences, num_shards,
+                                          chunk_size):
+    import csv
+    import io
+    import json
+    import sentence_streams as ss
+
+    sentences = [{'review_id': 'r{}'.format(i // 3), 'sentence_id': str(i),
+                  'text': 'sentence {}'.format(i)}
+                 for i in range(num_sentences)]
+    shard_paths = ss.split_into_shards(sentences, str(tmpdir), num_shards,
+                                       chunk_size)
+    assert len(shard_paths) == num_shards
+
+    # Each worker writes its rows prefixed with the number of its chunk
+    output_paths = []
+    for shard_path in shard_paths:
+        output_path = shard_path.replace('.jsonl', '.csv')
+        with open(shard_path) as f:
+            shard = [json.loads(line) for line in f]
+        with open(output_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            for chunk_number, chunk in enumerate(
+                    ss.iter_chunks(shard, chunk_size)):
+                writer.writerows([chunk_number, sentence['sentence_id'],
+                                  sentence['text']] for sentence in chunk)
+        output_paths.append(output_path)
+
+    merged = io.StringIO()
+    ss.merge_shards(output_paths, csv.writer(merged))
+    rows = list(csv.reader(io.StringIO(merged.getvalue())))
+    assert rows == [[sentence['sentence_id'], sentence['text']]
+                    for sentence in sentences]
+
+
+def test_prediction_cache_lru_and_disk_tier(tmpdir):
+    from cache import PredictionCache
+
+    disk_path = str(tmpdir.join('cache.sqlite'))
+    cache = PredictionCache(max_size=2, disk_path=disk_path)
+    cache.put('ckpt', 'a', 0, [0.9, 0.1])
+    cache.put('ckpt', 'b', 1, [0.2, 0.8])
+    # A hit promotes 'a', so 'b' is the least recently used entry
+    assert cache.get('ckpt', 'a')[0] == 0
+    cache.put('ckpt', 'c', 1, [0.4, 0.6])
+    assert list(cache.entries) == [cache.make_key('ckpt', 'a'),
+                                   cache.make_key('ckpt', 'c')]
+
+    # 'b' has been evicted from memory but is still on disk
+    prediction, probabilities = cache.get('ckpt', 'b')
+    assert prediction == 1
+    assert probabilities.tolist() == pytest.approx([0.2, 0.8])
+    assert cache.get('other_ckpt', 'a') is None
+    assert cache.metrics() == {'hits': 1, 'disk_hits': 1, 'misses': 1,
+                               'hit_rate': 2 / 3, 'size': 2, 'max_size': 2}
+    cache.close()
+
+    # The disk tier survives the reopening of the file
+    reopened = PredictionCache(max_size=2, disk_path=disk_path)
+    assert reopened.get('ckpt', 'a')[0] == 0
+    assert reopened.metrics()['disk_hits'] == 1
+    reopened.close()
+
+
+def test_cached_predict_scores_each_missing_sentence_once():
+    from cache import PredictionCache, cached_predict
+
+    calls = []
+
+    def predict(x_text):
+        calls.append(list(x_text))
+        predictions = np.array([len(text) % 2 for text in x_text])
+        return predictions, np.eye(2)[predictions]
+
+    cache = PredictionCache(max_size=10)
+    predictions, probabilities = cached_predict(
+            cache, 'ckpt', ['ab', 'abc', 'ab'], predict)
+    assert calls == [['ab', 'abc']]
+    assert predictions.tolist() == [0, 1, 0]
+    assert probabilities.tolist() == [[1, 0], [0, 1], [1, 0]]
+    assert cache.metrics()['misses'] == 3
+
+    # The second call is answered by the cache only
+    predictions, _ = cached_predict(cache, 'ckpt', ['abc', 'ab'], predict)
+    assert len(calls) == 1
+    assert predictions.tolist() == [1, 0]
+    assert cache.metrics()['hits'] == 2
+
+
+def test_select_labels():
+    import evaluation as ev
+
+    probabilities = np.array([[0.7, 0.2, 0.9, 0.6],
+                              [0.1, 0.3, 0.2, 0.4],
+                              [0.5, 0.5, 0.1, 0.0]])
+    # Sorted by decreasing probability, the first class is always kept
+    assert ev.select_labels(probabilities) == [[2, 0, 3], [3], [0, 1]]
+    assert ev.select_labels(probabilities, top_k=2) == [[2, 0], [3], [0, 1]]
+    assert ev.select_labels(probabilities, threshold=0.65) == [[2, 0], [3],
+                                                               [0]]
+
+
+def test_slot1_counts_every_detected_feature():
+    import scorer
+
+    # Sentence 1 has two opinions and FOOD plus a false positive PRICES,
+    # sentence 2 has one opinion which is missed
+    predictions = pd.DataFrame({
+            'sentence_id': ['1', '1', '2'],
+            'feature': ['FOOD', 'SERVICE', 'AMBIENCE'],
+            'pred_feature': ['FOOD', 'SERVICE', 'FOOD'],
+            'pred_features': ['FOOD SERVICE PRICES', 'FOOD SERVICE PRICES',
+                              'FOOD']})
+    scores = scorer.slot1_scores(predictions)
+    assert scores['slot1_precision'] == pytest.approx(2 / 4)
+    assert scores['slot1_recall'] == pytest.approx(2 / 3)
+
+    # Without pred_features, the false positive is not seen
+    scores = scorer.slot1_scores(predictions.drop('pred_features', axis=1))
+    assert scores['slot1_precision'] == pytest.approx(2 / 3)
+
+
+def check_metrics_against_sklearn(metrics, y, y_pred, num_classes):
+
+    labels = list(range(num_classes))
+    precision, recall, f1, support = \
+        sklearn_metrics.precision_recall_fscore_support(
+                y, y_pred, labels=labels)
+    np.testing.assert_allclose(metrics['precision'], precision)
+    np.testing.assert_allclose(metrics['recall'], recall)
+    np.testing.assert_allclose(metrics['f1'], f1)
+    np.testing.assert_array_equal(metrics['support'], support)
+    assert metrics['accuracy'] == pytest.approx(
+            sklearn_metrics.accuracy_score(y, y_pred))
+    if metrics['confusion_matrix'] is not None:
+        np.testing.assert_array_equal(
+                metrics['confusion_matrix'],
+                sklearn_metrics.confusion_matrix(y, y_pred, labels=labels))
+
+
+def test_classification_metrics_match_sklearn():
+    import evaluation as ev
+
+    names = ['FOOD', 'SERVICE', 'PRICES', 'AMBIENCE']
+    y = np.array([0, 0, 1, 2, 2, 2, 1, 0, 1, 2])
+    y_pred = np.array([0, 1, 1, 2, 0, 2, 1, 0, 2, 2])
+    metrics = ev.classification_metrics(y, y_pred, names)
+    check_metrics_against_sklearn(metrics, y, y_pred, len(names))
+    # AMBIENCE is neither actual nor predicted
+    assert metrics['f1'][3] == 0.0
+
+    # Multi-label : multi-hot arrays
+    y = np.array([[1, 0, 1, 0], [0, 1, 0, 0], [1, 1, 0, 0], [0, 0, 1, 1]])
+    y_pred = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [1, 0, 1, 0],
+                       [0, 0, 1, 1]])
+    metrics = ev.classification_metrics(y, y_pred, names)
+    assert metrics['confusion_matrix'] is None
+    check_metrics_against_sklearn(metrics, y, y_pred, len(names))
+
+
+def test_classification_metrics_unknown_classes():
+    import evaluation as ev
+
+    names = ['FOOD', 'SERVICE', 'PRICES']
+    # -1 is an unknown class (see domains.CombinationEncoder.encode)
+    y = np.array([0, 1, 1, -1, 2, -1])
+    y_pred = np.array([0, -1, 1, 2, -1, -1])
+    metrics = ev.classification_metrics(y, y_pred, names)
+
+    # The examples of unknown actual class are ignored, the unknown
+    # predictions are errors outside of the confusion matrix
+    known = y >= 0
+    check_metrics_against_sklearn(metrics, y[known], y_pred[known],
+                                  len(names))
+    assert metrics['confusion_matrix'].tolist() == [[1, 0, 0], [0, 1, 0],
+                                                    [0, 0, 0]]
+    assert metrics['support'].tolist() == [1, 2, 1]
+    assert metrics['recall'].tolist() == [1.0, 0.5, 0.0]
+
+    with pytest.raises(ValueError):
+        ev.classification_metrics(np.array([0, 3]), np.array([0, 1]), names)
+
+
+def write_run(folder, rows):
+    folder.mkdir()
+    pd.DataFrame(rows, columns=[
+            'review_id', 'sentence_id', 'text', 'feature', 'pred_feature',
+            'pred_features', 'polarity', 'pred_polarity']).to_csv(
+                    str(folder.join('predictions.csv')))
+    return str(folder)
+
+
+def test_scorer_runs(tmpdir):
+    import scorer
+
+    # Run A : 3 actual pairs, 4 predicted pairs, 2 true positives,
+    # 3 correct polarities out of 4 opinions
+    run_a = write_run(tmpdir.join('run_a'), [
+            ['r1', '1', 'a', 'FOOD', 'FOOD', 'FOOD SERVICE',
+             'positive', 'positive'],
+            ['r1', '1', 'a', 'FOOD', 'FOOD', 'FOOD SERVICE',
+             'negative', 'negative'],
+            ['r1', '2', 'b', 'PRICES', 'AMBIENCE', 'AMBIENCE',
+             'negative', 'positive'],
+            ['r2', '3', 'c', 'SERVICE', 'SERVICE', 'SERVICE',
+             'neutral', 'neutral']])
+    # Run B : every pair and polarity found
+    run_b = write_run(tmpdir.join('run_b'), [
+            ['r1', '1', 'a', 'FOOD', 'FOOD', 'FOOD',
+             'positive', 'positive'],
+            ['r1', '2', 'b', 'PRICES', 'PRICES', 'PRICES',
+             'negative', 'negative']])
+
+    scores = scorer.score_run(run_a)
+    assert scores['opinions'] == 4
+    assert scores['slot1_precision'] == pytest.approx(2 / 4)
+    assert scores['slot1_recall'] == pytest.approx(2 / 3)
+    assert scores['slot1_f1'] == pytest.approx(4 / 7)
+    assert scores['slot3_accuracy'] == pytest.approx(3 / 4)
+    # FOOD : 2/2, PRICES : 0/1, SERVICE : 1/1
+    assert scores['slot3_accuracy_per_feature'] == {
+            'FOOD': 1.0, 'PRICES': 0.0, 'SERVICE': 1.0}
+    assert scores['slot3_mean_accuracy'] == pytest.approx(2 / 3)
+
+    # The comparison table follows the order of the runs
+    for processes in [1, 2]:
+        table = scorer.score_runs([run_b, run_a, run_b], processes)
+        assert table['run'].tolist() == [run_b, run_a, run_b]
+        assert table['slot1_f1'].tolist() == pytest.approx([1.0, 4 / 7, 1.0])
+        assert table['slot3_accuracy'].tolist() == pytest.approx(
+                [1.0, 3 / 4, 1.0])
+
+
+def test_dataset_statistics_match_pandas_and_are_reused(tmpdir):
+    import json
+    import dataset_stats as ds
+    import preprocessing as pp
+    import synthetic
+
+    filepath = str(tmpdir.join('train.xml'))
+    synthetic.generate_semeval_xml(filepath, 'RESTAURANT', num_reviews=30,
+                                   seed=3)
+
+    # Same counts as the former pandas path (duplicates counted once)
+    for aspects, level in [(False, 'entity'), (True, 'aspect')]:
+        expected = ds.count_dataframe(pp.parse_XML(filepath, aspects))
+        counters = ds.file_statistics(filepath, level)
+        for name in ds.COUNTERS:
+            assert counters[name] == expected[name]
+
+    # The stored statistics are reused while the file is unchanged
+    stats_path = str(tmpdir.join(ds.STATS_FILE))
+    with open(stats_path) as f:
+        stored = json.load(f)
+    stored['files']['train.xml']['counters']['entity']['polarity'] = {
+            'positive': -1}
+    with open(stats_path, 'w') as f:
+        json.dump(stored, f)
+    assert ds.DatasetStatistics(str(tmpdir)).update([filepath]) == []
+    assert ds.file_statistics(filepath)['polarity'] == {'positive': -1}
+
+    # A modified file is parsed again
+    synthetic.generate_semeval_xml(filepath, 'RESTAURANT', num_reviews=40,
+                                   seed=4)
+    expected = ds.count_dataframe(pp.parse_XML(filepath))
+    assert ds.file_statistics(filepath)['polarity'] == expected['polarity']
+
+
+def test_label_encoder():
+    import domains
+
+    encoder = domains.LabelEncoder(['FOOD', 'DRINKS', 'HARDWARE'])
+    ids = encoder.encode(['DRINKS', 'CPU', 'FOOD', 'UNKNOWN', 'DRINKS'],
+                         aliases={'CPU': 'HARDWARE'})
+    assert ids.dtype == np.int32
+    assert ids.tolist() == [1, 2, 0, -1, 1]
+    assert encoder.decode([2, 0, 1]).tolist() == ['HARDWARE', 'FOOD',
+                                                  'DRINKS']
+    assert encoder.encode([]).tolist() == []
+    with pytest.raises(ValueError):
+        domains.LabelEncoder(['FOOD', 'FOOD'])
+    with pytest.raises(AttributeError):
+        encoder.names = ('FOOD',)
+
+
+def test_combination_encoder():
+    import domains
+
+    combinations = domains.RESTAURANT.combinations()
+    num_polarities = len(domains.POLARITY)
+    assert len(combinations) == (len(domains.RESTAURANT_ENTITIES) *
+                                 num_polarities)
+    assert combinations.names[0] == 'FOOD - positive'
+    assert combinations.names[num_polarities + 2] == 'DRINKS - negative'
+    classes = combinations.encode(['FOOD', 'DRINKS', 'FOOD', 'UNKNOWN'],
+                                  ['neutral', 'negative', 'mixed',
+                                   'positive'])
+    assert classes.tolist() == [1, num_polarities + 2, -1, -1]
+    assert domains.RESTAURANT.combinations(aspects=True).features is \
+        domains.RESTAURANT.aspects
+    # LAPTOP has no aspects : its entities are kept
+    assert domains.LAPTOP.combinations(aspects=True).features is \
+        domains.LAPTOP.entities
+
+
+def test_register_config_domains_and_get_domain_of_file():
+    import domains
+
+    config = {'datasets': {'default': 'semeval', 'semeval': {
+            'current_domain': 'HOTEL',
+            'domains': {'HOTEL': {
+                    'train': 'hotel/train.xml',
+                    'test': 'hotel/test.xml',
+                    'entities': ['ROOMS', 'SERVICE'],
+                    'simplify': {'ROOM': 'ROOMS'}}}}}}
+    try:
+        hotel = domains.get_current_domain(config)
+        assert hotel is domains.get_domain('HOTEL')
+        assert hotel.aspects is None
+        assert hotel.entities.encode(['ROOM', 'SERVICE'],
+                                     hotel.simplify).tolist() == [0, 1]
+        assert domains.get_domain_of_file('hotel/test.xml') is hotel
+    finally:
+        domains.DOMAINS.pop('HOTEL', None)
+
+    assert domains.get_domain_of_file(domains.LAPTOP_TRAIN) is \
+        domains.LAPTOP
+    assert domains.get_domain_of_file(domains.RESTAURANT_TEST) is \
+        domains.RESTAURANT
+    with pytest.raises(ValueError):
+        domains.get_domain_of_file('hotel/test.xml')
+    with pytest.raises(ValueError):
+        domains.get_domain('HOTEL')
+
+
+def write_sentences_xml(filepath, sentences):
+    """
+    Write a SemEval XML document with a single review.
+    :param sentences: List of (text, list of (category, polarity)).
+    """
+
+    import synthetic
+
+    synthetic.write_semeval_xml(filepath, [('1', [
+            ('1:{}'.format(i), text, opinions)
+            for i, (text, opinions) in enumerate(sentences)])])
+
+
+def test_semeval_source_examples(tmpdir):
+    import data_sources as src
+    import domains as dm
+
+    filepath = str(tmpdir.join('laptop.xml'))
+    write_sentences_xml(filepath, [
+            ('fast cpu', [('CPU#OPERATION_PERFORMANCE', 'positive'),
+                          ('LAPTOP#GENERAL', 'positive'),
+                          ('MEMORY#GENERAL', 'positive')]),
+            ('nice os', [('OS#GENERAL', 'positive')]),
+            ('no opinion', []),
+            ('fast cpu', [('SUPPORT#QUALITY', 'negative')])])
+
+    def examples(focus, multilabel=False):
+        source = src.SemEvalSource(filepath, focus, multilabel=multilabel,
+                                   domain=dm.LAPTOP)
+        return sorted((text, tuple(label) if multilabel else label)
+                      for text, label in source.iter_examples())
+
+    laptop = dm.LAPTOP.entities.index
+    # One example per distinct (text, label), CPU and MEMORY simplified as
+    # HARDWARE and OS (out of the scope) left out
+    assert examples('feature') == sorted([
+            ('fast cpu', laptop['HARDWARE']), ('fast cpu', laptop['LAPTOP']),
+            ('fast cpu', laptop['SUPPORT'])])
+    polarity = dm.LAPTOP.polarities.index
+    assert examples('polarity') == sorted([
+            ('fast cpu', polarity['positive']),
+            ('fast cpu', polarity['negative']),
+            ('nice os', polarity['positive'])])
+    # The labels of the repeated sentence are gathered in multi-label mode
+    assert examples('feature', multilabel=True) == [
+            ('fast cpu', (laptop['HARDWARE'], laptop['LAPTOP'],
+                          laptop['SUPPORT']))]
+
+
+def test_semeval_source_matches_selected_dataset(tmpdir):
+    import data_sources as src
+    import domains as dm
+    import preprocessing as pp
+    import synthetic
+
+    train_path = str(tmpdir.join('train.xml'))
+    test_path = str(tmpdir.join('test.xml'))
+    synthetic.generate_semeval_xml(train_path, 'LAPTOP', num_reviews=40,
+                                   seed=5)
+    try:
+        domain = synthetic.register_synthetic_domain(
+                'SYNTHETIC_LAPTOP', 'LAPTOP', train_path, test_path)
+        selected = pp.select_and_simplify_dataset(pp.parse_XML(train_path),
+                                                  train_path)
+        expected = selected[['text', 'feature']].drop_duplicates()
+        source = src.SemEvalSource(train_path, 'feature', domain=domain)
+        examples = [(text, domain.entities.names[label])
+                    for text, label in source.iter_examples()]
+    finally:
+        dm.DOMAINS.pop('SYNTHETIC_LAPTOP', None)
+
+    assert len(examples) == len(set(examples))
+    assert sorted(examples) == sorted(expected.itertuples(index=False,
+                                                          name=None))
+
+
+def test_local_data_source_matches_load_files(tmpdir):
+    from sklearn.datasets import load_files
+    import data_sources as src
+
+    for category, num_files in [('sports', 4), ('music', 3), ('empty', 0)]:
+        folder = tmpdir.mkdir(category)
+        for i in range(num_files):
+            folder.join('{}.txt'.format(i)).write_text(
+                    u'{} text {} é'.format(category, i), 'utf-8')
+
+    for categories, shuffle in [(None, True), (None, False),
+                                (['music', 'sports'], True)]:
+        expected = load_files(str(tmpdir), categories=categories,
+                              encoding='utf-8', shuffle=shuffle,
+                              random_state=42)
+        source = src.LocalDataSource(str(tmpdir), categories, shuffle=shuffle)
+        datasets = source.load()
+        assert datasets['target_names'] == list(expected.target_names)
+        assert datasets['data'] == list(expected.data)
+        assert datasets['target'] == expected.target.tolist()
+
+
+def test_source_registry():
+    import data_sources as src
+
+    class ListSource(src.DataSource):
+        target_names = ['a', 'b']
+
+        def __init__(self, examples):
+            self.examples = examples
+
+        def iter_examples(self):
+            return iter(self.examples)
+
+    def factory(parameters, split, focus, aspects, multilabel):
+        return ListSource(parameters[split])
+
+    config = {'datasets': {'default': 'lists', 'lists': {
+            'train': [('one', 0), ('two', 1), ('three', 1)],
+            'test': [('four', 0)]}}}
+    with pytest.raises(ValueError):
+        src.get_source(config)
+    src.register_source('lists', factory)
+    try:
+        assert src.get_source(config).load()['data'] == ['one', 'two',
+                                                         'three']
+        source = src.get_source(config, split='test')
+        assert list(source.iter_examples()) == [('four', 0)]
+        assert [texts for texts, _ in src.get_source(config).iter_batches(
+                2, clean=False)] == [['one', 'two'], ['three']]
+    finally:
+        src.SOURCES.pop('lists')
+
+
+def test_profiler(tmpdir, monkeypatch):
+    import json
+    import profiling
+
+    # Clock advancing by one second at each reading
+    clock = iter(range(100))
+    monkeypatch.setattr(profiling.time, 'perf_counter', lambda: next(clock))
+
+    profiler = profiling.Profiler()
+    for _ in range(2):
+        with profiler.stage('epoch'):
+            with profiler.stage('epoch/batch'):
+                pass
+            profiler.count('batches')
+    measure = profiler.start('evaluation')
+    measure.stop()
+    profiler.count('sentences', 64)
+    profiler.count('sentences', 36)
+
+    timings = profiler.report()['timings']
+    assert list(timings) == ['epoch/batch', 'epoch', 'evaluation']
+    # The outer stage includes the time of the nested stage
+    assert timings['epoch'] == {'count': 2, 'total': 6, 'mean': 3, 'min': 3,
+                                'max': 3}
+    assert timings['epoch/batch'] == {'count': 2, 'total': 2, 'mean': 1,
+                                      'min': 1, 'max': 1}
+    assert timings['evaluation']['total'] == 1
+
+    path = profiler.save(str(tmpdir))
+    assert path == str(tmpdir.join(profiling.REPORT_FILE))
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved['timings'] == timings
+    assert saved['counters'] == {'batches': 2, 'sentences': 100}
+    assert saved['wall_time'] >= 0
+
+    # A disabled profiler measures nothing and writes nothing
+    null = profiling.NULL_PROFILER
+    with null.stage('epoch'):
+        null.count('batches')
+    null.start('evaluation').stop()
+    assert null.report()['timings'] == {}
+    assert null.report()['counters'] == {}
+    assert not os.path.exists(null.save(str(tmpdir.mkdir('null'))))